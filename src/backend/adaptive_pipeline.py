@@ -0,0 +1,147 @@
+"""
+高度なRAGの適応的なパイプライン制御
+元の質問だけで1回目の検索を行い、その結果の確からしさからクエリ拡張（LLM呼び出し1回）と
+CrossEncoderによる再ランキングが必要かを判定する。1回目の検索で答えが明らかな場合は両方を省略する（高速経路）。
+
+判定の順序:
+    1. 質問中の識別子（エラーコード E-101、安全規定 S-01、型番など）がすべて最上位のチャンクに含まれる
+       → クエリ拡張・再ランキングとも省略（identifier_match）
+    2. 最上位の類似度が ADAPTIVE_MIN_SCORE 以上、かつ2位との差が ADAPTIVE_MIN_MARGIN 以上
+       → クエリ拡張・再ランキングとも省略（decisive）
+    3. 最上位の類似度は十分だが2位との差が小さい
+       → クエリ拡張のみ省略し、再ランキングで順位を決める（ambiguous）
+    4. 最上位の類似度が低い → クエリ拡張・再ランキングとも実行（low_confidence）
+
+類似度は正規化済みの埋め込みのL2距離の2乗dから、コサイン類似度 1 - d / 2 に換算して判定する。
+"""
+
+import os
+import threading
+from collections import Counter
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from knowledge_base import contains_identifier, extract_identifiers
+
+
+class AdaptiveSettings(NamedTuple):
+    """適応的なパイプライン制御の設定"""
+    enabled: bool = True
+    # クエリ拡張を省略する最上位の類似度
+    min_score: float = 0.6
+    # 再ランキングを省略する1位と2位の類似度の差
+    min_margin: float = 0.05
+
+
+class RetrievalDecision(NamedTuple):
+    """1回目の検索結果に基づく判定"""
+    expand: bool
+    rerank: bool
+    reason: str
+    top_score: Optional[float]
+    margin: Optional[float]
+    identifiers: List[str]
+    matched_identifiers: List[str]
+
+    @property
+    def fast_path(self) -> bool:
+        return not self.expand and not self.rerank
+
+
+def get_adaptive_settings() -> AdaptiveSettings:
+    """環境変数から適応的なパイプライン制御の設定を取得"""
+    defaults = AdaptiveSettings()
+    return AdaptiveSettings(enabled=os.getenv("ADAPTIVE_RAG_ENABLED", "true").lower() == "true",
+                            min_score=float(os.getenv("ADAPTIVE_MIN_SCORE", defaults.min_score)),
+                            min_margin=float(os.getenv("ADAPTIVE_MIN_MARGIN", defaults.min_margin)))
+
+
+def distance_to_similarity(distance: float) -> float:
+    """正規化済みベクトル間のL2距離の2乗をコサイン類似度に換算"""
+    return 1.0 - distance / 2.0
+
+
+def decide_retrieval(query: str, first_pass: List[Tuple[int, float]], store: Any,
+                     settings: AdaptiveSettings) -> RetrievalDecision:
+    """
+    1回目の検索結果からクエリ拡張・再ランキングの要否を判定する
+
+    Args:
+        query: 元の質問
+        first_pass: 元の質問での検索結果 (チャンクID, 距離) の近い順のリスト
+        store: チャンクストア（最上位のチャンクのテキストを参照する）
+        settings: 判定のしきい値
+    """
+    identifiers = extract_identifiers(query)
+    if not first_pass:
+        return RetrievalDecision(True, True, "no_results", None, None, identifiers, [])
+
+    similarities = [distance_to_similarity(distance) for _, distance in first_pass]
+    top_score = similarities[0]
+    margin = top_score - similarities[1] if len(similarities) > 1 else top_score
+
+    top_text = store.text(first_pass[0][0])
+    matched = [identifier for identifier in identifiers if contains_identifier(top_text, identifier)]
+    if identifiers and len(matched) == len(identifiers):
+        return RetrievalDecision(False, False, "identifier_match", top_score, margin, identifiers, matched)
+
+    if top_score >= settings.min_score and margin >= settings.min_margin:
+        return RetrievalDecision(False, False, "decisive", top_score, margin, identifiers, matched)
+    if top_score >= settings.min_score:
+        return RetrievalDecision(False, True, "ambiguous", top_score, margin, identifiers, matched)
+    return RetrievalDecision(True, True, "low_confidence", top_score, margin, identifiers, matched)
+
+
+def describe_decision(decision: RetrievalDecision) -> str:
+    """判定理由の説明文（intermediate_stepsの表示用）"""
+    if decision.reason == "identifier_match":
+        return f"質問中の識別子（{', '.join(decision.matched_identifiers)}）が最上位のチャンクに一致"
+    return {
+        "decisive": "1回目の検索で最上位が明確",
+        "ambiguous": "最上位の類似度は十分だが、上位の差が小さい",
+        "low_confidence": "1回目の検索の類似度が低い",
+        "no_results": "1回目の検索結果なし"
+    }[decision.reason]
+
+
+class AdaptiveStats:
+    """判定結果の集計（高速経路を通ったリクエストの割合など）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.total = 0
+        self.fast_path = 0
+        self.expansion_skipped = 0
+        self.rerank_skipped = 0
+        self.reasons: Counter = Counter()
+
+    def record(self, decision: RetrievalDecision):
+        with self._lock:
+            self.total += 1
+            self.fast_path += decision.fast_path
+            self.expansion_skipped += not decision.expand
+            self.rerank_skipped += not decision.rerank
+            self.reasons[decision.reason] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.total
+            return {
+                "settings": get_adaptive_settings()._asdict(),
+                "total": total,
+                "fast_path": self.fast_path,
+                "fast_path_rate": round(self.fast_path / total, 3) if total else 0.0,
+                "expansion_skipped_rate": round(self.expansion_skipped / total, 3) if total else 0.0,
+                "rerank_skipped_rate": round(self.rerank_skipped / total, 3) if total else 0.0,
+                "reasons": dict(self.reasons)
+            }
+
+
+_adaptive_stats: Optional[AdaptiveStats] = None
+
+
+def get_adaptive_stats() -> AdaptiveStats:
+    """共有の判定結果の集計を取得"""
+    global _adaptive_stats
+    if _adaptive_stats is None:
+        _adaptive_stats = AdaptiveStats()
+    return _adaptive_stats
@@ -0,0 +1,184 @@
+"""
+受付制御（処理モードごとの同時実行数制限と待ち行列）
+重いモード（CrossEncoderで再ランキングする高度なRAG、エージェント系）の集中が軽いモードの
+レイテンシまで悪化させないよう、モードごとに同時実行数の上限と長さの上限付きの待ち行列を設ける。
+待ち行列が満杯の場合は即座に429を、待ち時間が上限を超えた場合は503を、Retry-After付きで返す。
+"""
+
+import asyncio
+import math
+import os
+import time
+from typing import Any, Dict, NamedTuple, Optional
+
+from metrics import QUEUE_DEPTH, QUEUE_WAIT, REJECTED
+
+
+class AdmissionLimits(NamedTuple):
+    """1モードの受付制御設定"""
+    max_concurrency: int
+    # 処理枠の空きを待てるリクエスト数（0の場合は待たずに拒否）
+    max_queue: int
+    # 処理枠の空きを待つ最大秒数
+    queue_timeout: float = 30.0
+
+
+# モードごとの既定値（重いモードほど同時実行数を絞る）
+DEFAULT_LIMITS: Dict[str, AdmissionLimits] = {
+    "llm_only": AdmissionLimits(max_concurrency=16, max_queue=64),
+    "prompt_stuffing": AdmissionLimits(max_concurrency=8, max_queue=32),
+    "rag_only": AdmissionLimits(max_concurrency=8, max_queue=32),
+    "rag_advanced": AdmissionLimits(max_concurrency=2, max_queue=8),
+    "function_calling": AdmissionLimits(max_concurrency=4, max_queue=16),
+    "rag_function_calling": AdmissionLimits(max_concurrency=4, max_queue=16),
+}
+
+
+class AdmissionRejected(Exception):
+    """受付制御でリクエストを拒否した場合の例外"""
+
+    def __init__(self, mode: str, reason: str, retry_after: int):
+        self.mode = mode
+        self.reason = reason
+        self.retry_after = retry_after
+        # 待ち行列が満杯の場合は429（リクエスト過多）、待ち時間の超過は503（一時的に処理不能）
+        self.status_code = 429 if reason == "queue_full" else 503
+        message = "待ち行列が満杯です" if reason == "queue_full" else "処理枠の待ち時間が上限を超えました"
+        super().__init__(f"{mode}: {message}（{retry_after}秒後に再試行してください）")
+
+
+def get_admission_limits() -> Dict[str, AdmissionLimits]:
+    """
+    環境変数から受付制御設定を取得
+
+    ADMISSION_LIMITS="rag_advanced=2:8,llm_only=32:128" の形式（モード=同時実行数:待ち行列長）で
+    モードごとの既定値を上書きする。待ち時間の上限はADMISSION_QUEUE_TIMEOUT_SECONDSで共通に設定する。
+    """
+    queue_timeout = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_SECONDS", 30))
+    limits = {mode: mode_limits._replace(queue_timeout=queue_timeout) for mode, mode_limits in DEFAULT_LIMITS.items()}
+
+    for item in os.getenv("ADMISSION_LIMITS", "").split(","):
+        if not item.strip():
+            continue
+        try:
+            mode, values = item.split("=", 1)
+            max_concurrency, max_queue = values.split(":", 1)
+            limits[mode.strip()] = AdmissionLimits(max_concurrency=max(1, int(max_concurrency)),
+                                                   max_queue=max(0, int(max_queue)),
+                                                   queue_timeout=queue_timeout)
+        except ValueError:
+            print(f"警告: ADMISSION_LIMITSの設定 '{item}' を解釈できないため無視します（形式: モード=同時実行数:待ち行列長）")
+    return limits
+
+
+class ModeLimiter:
+    """1モード分の処理枠（セマフォ）と待ち行列"""
+
+    # Retry-Afterの見積もりに使う処理時間の指数移動平均の重み
+    _EWMA_ALPHA = 0.2
+
+    def __init__(self, mode: str, limits: AdmissionLimits):
+        self.mode = mode
+        self.limits = limits
+        self._semaphore = asyncio.Semaphore(limits.max_concurrency)
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self._service_seconds: Optional[float] = None
+
+    def retry_after(self) -> int:
+        """待ち行列がはけるまでの目安（秒）"""
+        service_seconds = self._service_seconds or 1.0
+        return max(1, math.ceil(service_seconds * (self.waiting + 1) / self.limits.max_concurrency))
+
+    def _reject(self, reason: str) -> AdmissionRejected:
+        self.rejected += 1
+        REJECTED.labels(mode=self.mode, reason=reason).inc()
+        return AdmissionRejected(self.mode, reason, self.retry_after())
+
+    async def acquire(self, timeout: Optional[float] = None) -> float:
+        """
+        処理枠を確保する（空きがなければ待ち行列で待つ）
+
+        Args:
+            timeout: 待ち時間の上限（秒）。queue_timeoutより短い場合に優先する（リクエストの残り時間など）
+
+        Returns:
+            処理枠の空きを待った秒数
+
+        Raises:
+            AdmissionRejected: 待ち行列が満杯、または待ち時間が上限を超えた場合
+        """
+        started = time.perf_counter()
+        if not self._semaphore.locked():
+            # 空きがあれば待たずに確保する（この場合acquireは制御を手放さない）
+            await self._semaphore.acquire()
+        else:
+            if self.waiting >= self.limits.max_queue:
+                raise self._reject("queue_full")
+
+            self.waiting += 1
+            QUEUE_DEPTH.labels(mode=self.mode).inc()
+            try:
+                queue_timeout = self.limits.queue_timeout if timeout is None else min(timeout, self.limits.queue_timeout)
+                await asyncio.wait_for(self._semaphore.acquire(), queue_timeout)
+            except asyncio.TimeoutError:
+                raise self._reject("queue_timeout")
+            finally:
+                self.waiting -= 1
+                QUEUE_DEPTH.labels(mode=self.mode).dec()
+
+        waited = time.perf_counter() - started
+        QUEUE_WAIT.labels(mode=self.mode).observe(waited)
+        self.active += 1
+        self.admitted += 1
+        return waited
+
+    def release(self, service_seconds: float):
+        """処理枠を解放し、処理時間をRetry-Afterの見積もりに反映する"""
+        self.active -= 1
+        self._semaphore.release()
+        if self._service_seconds is None:
+            self._service_seconds = service_seconds
+        else:
+            self._service_seconds += self._EWMA_ALPHA * (service_seconds - self._service_seconds)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.limits._asdict(),
+            "active": self.active,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "avg_service_seconds": round(self._service_seconds, 3) if self._service_seconds is not None else None
+        }
+
+
+class AdmissionController:
+    """モードごとのModeLimiterを管理する"""
+
+    def __init__(self, limits: Dict[str, AdmissionLimits]):
+        self._limits = limits
+        self._limiters: Dict[str, ModeLimiter] = {}
+
+    def limiter(self, mode: str) -> ModeLimiter:
+        limiter = self._limiters.get(mode)
+        if limiter is None:
+            limits = self._limits.get(mode) or AdmissionLimits(max_concurrency=8, max_queue=32)
+            limiter = self._limiters[mode] = ModeLimiter(mode, limits)
+        return limiter
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {mode: limiter.get_stats() for mode, limiter in self._limiters.items()}
+
+
+_admission_controller: Optional[AdmissionController] = None
+
+
+def get_admission_controller() -> AdmissionController:
+    """共有の受付制御を取得"""
+    global _admission_controller
+    if _admission_controller is None:
+        _admission_controller = AdmissionController(get_admission_limits())
+    return _admission_controller
@@ -0,0 +1,135 @@
+"""
+Google Cloud認証状況のキャッシュ
+認証状況の確認（gcloud auth listのサブプロセスなど）は非同期に実行し、結果をTTL付きでキャッシュする。
+TTLが切れた後の参照ではキャッシュ済みの結果をそのまま返し、再確認はバックグラウンドで1つだけ実行する。
+フロントエンドがポーリングする /auth/status はイベントループをブロックせずに即座に応答できる。
+"""
+
+import asyncio
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+
+def get_auth_status_settings() -> Dict[str, float]:
+    """環境変数から認証状況キャッシュの設定を取得"""
+    return {
+        "ttl_seconds": float(os.getenv("AUTH_STATUS_TTL_SECONDS", 60)),
+        "timeout_seconds": float(os.getenv("AUTH_CHECK_TIMEOUT_SECONDS", 5))
+    }
+
+
+async def _gcloud_has_active_account(timeout: float) -> bool:
+    """gcloud auth listを非同期のサブプロセスで実行し、有効なアカウントがあるか確認する"""
+    # WindowsのPATHEXT（gcloud.cmd）にも対応するため、実行ファイルのパスを解決してから起動する
+    gcloud_path = shutil.which("gcloud")
+    if gcloud_path is None:
+        return False
+
+    process = await asyncio.create_subprocess_exec(gcloud_path,
+                                                   "auth",
+                                                   "list",
+                                                   "--filter=status:ACTIVE",
+                                                   stdout=asyncio.subprocess.PIPE,
+                                                   stderr=asyncio.subprocess.DEVNULL)
+    try:
+        stdout, _ = await asyncio.wait_for(process.communicate(), timeout)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        return False
+    return process.returncode == 0 and bool(stdout.strip())
+
+
+async def probe_auth_status(timeout: float = 5.0) -> Dict[str, Any]:
+    """
+    認証状況を確認する（check_google_cloud_authと同じ判定順の非同期版）
+
+    Returns:
+        {"authenticated": bool, "method": 認証方法またはNone, "project_id": ..., "checked_at": ...}
+    """
+    method: Optional[str] = None
+    credentials_path = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
+    if os.getenv("GOOGLE_CLOUD_SHELL"):
+        method = "cloud_shell"
+    elif credentials_path and Path(credentials_path).exists():
+        method = "service_account"
+    elif await _gcloud_has_active_account(timeout):
+        method = "gcloud"
+
+    return {
+        "authenticated": method is not None,
+        "method": method,
+        "project_id": os.getenv("GOOGLE_CLOUD_PROJECT"),
+        "checked_at": time.time()
+    }
+
+
+class AuthStatusCache:
+    """認証状況のTTL付きキャッシュ（期限切れ後は古い結果を返しつつバックグラウンドで更新）"""
+
+    def __init__(self, ttl_seconds: float = 60.0, timeout_seconds: float = 5.0):
+        self.ttl_seconds = ttl_seconds
+        self.timeout_seconds = timeout_seconds
+        self._status: Optional[Dict[str, Any]] = None
+        self._expires_at = 0.0
+        self._refresh_task: Optional[asyncio.Task] = None
+        self.refreshes = 0
+
+    async def _refresh(self) -> Dict[str, Any]:
+        try:
+            status = await probe_auth_status(self.timeout_seconds)
+        except Exception as e:
+            status = {
+                "authenticated": False,
+                "method": None,
+                "project_id": os.getenv("GOOGLE_CLOUD_PROJECT"),
+                "checked_at": time.time(),
+                "error": str(e)
+            }
+
+        previous = self._status
+        if previous is None or previous["authenticated"] != status["authenticated"]:
+            if status["authenticated"]:
+                print(f"✅ Google Cloud認証を確認しました（{status['method']}）")
+            else:
+                print("❌ Google Cloud認証が設定されていません（/auth/status）")
+
+        self._status = status
+        self._expires_at = time.monotonic() + self.ttl_seconds
+        self.refreshes += 1
+        return status
+
+    def refresh_in_background(self) -> asyncio.Task:
+        """更新タスクを起動する（実行中であればそのタスクを返す）"""
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._refresh())
+        return self._refresh_task
+
+    async def get(self) -> Dict[str, Any]:
+        """
+        認証状況を取得する
+
+        初回のみ確認の完了を待つ。以降はキャッシュを即座に返し、TTLが切れていれば
+        バックグラウンドで更新する（同時に複数の確認は実行しない）。
+        """
+        if self._status is None:
+            return {**await asyncio.shield(self.refresh_in_background()), "stale": False}
+
+        stale = time.monotonic() >= self._expires_at
+        if stale:
+            self.refresh_in_background()
+        return {**self._status, "stale": stale}
+
+
+_auth_status_cache: Optional[AuthStatusCache] = None
+
+
+def get_auth_status_cache() -> AuthStatusCache:
+    """共有の認証状況キャッシュを取得"""
+    global _auth_status_cache
+    if _auth_status_cache is None:
+        _auth_status_cache = AuthStatusCache(**get_auth_status_settings())
+    return _auth_status_cache
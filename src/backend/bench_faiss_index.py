@@ -0,0 +1,183 @@
+"""
+FAISSインデックス種別ベンチマーク (bench_faiss_index.py)
+目的: Flat / HNSW / IVF-Flat / IVF-PQ の構築時間・メモリ・検索レイテンシ・recall@k を、
+フラットインデックス（厳密検索）を基準として比較する。
+
+使用例:
+    python bench_faiss_index.py --num-vectors 300000 --nprobe 8,16,64 --ef-search 32,64,128
+    python bench_faiss_index.py --source knowledge --knowledge ../../data/knowledge.txt
+"""
+
+import argparse
+import json
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+import faiss
+import numpy as np
+from vector_index import INDEX_TYPES, IndexConfig, apply_search_params, build_faiss_index
+
+
+def _synthetic_vectors(num_vectors: int, dimension: int, num_clusters: int, seed: int) -> np.ndarray:
+    """文書埋め込みに近いクラスタ構造を持つ正規化済みベクトルを生成"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((num_clusters, dimension)).astype("float32")
+    labels = rng.integers(0, num_clusters, size=num_vectors)
+    vectors = centers[labels] + 0.35 * rng.standard_normal((num_vectors, dimension)).astype("float32")
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+def _knowledge_vectors(knowledge_path: Path) -> np.ndarray:
+    """ナレッジファイルのチャンクを実際の埋め込みモデルでベクトル化"""
+    from chunker import DEFAULT_CHUNK_CONFIG, get_chunks
+    from vector_index import get_embeddings
+
+    _, chunks = get_chunks(knowledge_path, DEFAULT_CHUNK_CONFIG)
+    return np.asarray(get_embeddings().embed_documents([chunk.text for chunk in chunks]), dtype="float32")
+
+
+def _index_memory_bytes(index: faiss.Index) -> int:
+    """シリアライズ後のサイズでインデックスのメモリ使用量を近似"""
+    return int(faiss.serialize_index(index).size)
+
+
+def _measure_queries(index: faiss.Index, queries: np.ndarray, k: int) -> Dict[str, Any]:
+    """1件ずつの検索レイテンシ分布と、バッチ検索のスループットを計測"""
+    latencies = []
+    for query in queries:
+        started = time.perf_counter()
+        index.search(query.reshape(1, -1), k)
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    _, ids = index.search(queries, k)
+    batch_seconds = time.perf_counter() - started
+
+    latencies_array = np.asarray(latencies)
+    return {
+        "ids": ids,
+        "latency_ms_p50": float(np.percentile(latencies_array, 50)),
+        "latency_ms_p95": float(np.percentile(latencies_array, 95)),
+        "latency_ms_p99": float(np.percentile(latencies_array, 99)),
+        "batch_qps": len(queries) / batch_seconds if batch_seconds > 0 else float("inf")
+    }
+
+
+def _recall_at_k(ids: np.ndarray, ground_truth: np.ndarray, k: int) -> float:
+    """厳密検索の上位k件のうち、近似検索の上位k件に含まれる割合"""
+    hits = sum(len(set(row[:k]) & set(truth[:k])) for row, truth in zip(ids, ground_truth))
+    return hits / (len(ground_truth) * k)
+
+
+def run_benchmark(vectors: np.ndarray, queries: np.ndarray, k: int, index_types: List[str],
+                  base_config: IndexConfig, nprobe_values: List[int], ef_search_values: List[int]) -> List[Dict]:
+    """各インデックス種別を構築・計測し、結果のリストを返す"""
+    results = []
+    ground_truth = None
+
+    # フラットインデックスを基準として最初に計測する
+    ordered_types = ["flat"] + [index_type for index_type in index_types if index_type != "flat"]
+    for index_type in ordered_types:
+        started = time.perf_counter()
+        index, config = build_faiss_index(vectors, base_config._replace(index_type=index_type))
+        build_seconds = time.perf_counter() - started
+
+        if config.index_type != index_type:
+            print(f"   {index_type}: 条件を満たさないため{config.index_type}で構築されました（スキップ）")
+            continue
+
+        if index_type in ("ivf_flat", "ivf_pq"):
+            tuning = [("nprobe", value) for value in nprobe_values]
+        elif index_type == "hnsw":
+            tuning = [("ef_search", value) for value in ef_search_values]
+        else:
+            tuning = [(None, None)]
+
+        for param_name, param_value in tuning:
+            tuned_config = config._replace(**{param_name: param_value}) if param_name else config
+            apply_search_params(index, tuned_config)
+            measured = _measure_queries(index, queries, k)
+
+            if ground_truth is None:
+                ground_truth = measured["ids"]
+
+            result = {
+                "index_type": index_type,
+                "param": f"{param_name}={param_value}" if param_name else "-",
+                "config": tuned_config._asdict(),
+                "num_vectors": int(vectors.shape[0]),
+                "build_seconds": build_seconds,
+                "memory_mb": _index_memory_bytes(index) / (1024 * 1024),
+                "latency_ms_p50": measured["latency_ms_p50"],
+                "latency_ms_p95": measured["latency_ms_p95"],
+                "latency_ms_p99": measured["latency_ms_p99"],
+                "batch_qps": measured["batch_qps"],
+                f"recall@{k}": _recall_at_k(measured["ids"], ground_truth, k)
+            }
+            results.append(result)
+            print(f"   {index_type:<8} {result['param']:<14} build={build_seconds:7.2f}s "
+                  f"mem={result['memory_mb']:8.1f}MB p50={result['latency_ms_p50']:7.3f}ms "
+                  f"p95={result['latency_ms_p95']:7.3f}ms qps={result['batch_qps']:9.0f} "
+                  f"recall@{k}={result[f'recall@{k}']:.4f}")
+    return results
+
+
+def _parse_int_list(value: str) -> List[int]:
+    return [int(item) for item in value.split(",") if item.strip()]
+
+
+def main():
+    """直接実行用"""
+    parser = argparse.ArgumentParser(description="FAISSインデックス種別ベンチマーク")
+    parser.add_argument("--source", choices=["synthetic", "knowledge"], default="synthetic")
+    parser.add_argument("--knowledge", type=Path, default=Path(__file__).parent.parent.parent / "data" / "knowledge.txt")
+    parser.add_argument("--num-vectors", type=int, default=200000)
+    parser.add_argument("--dimension", type=int, default=384)
+    parser.add_argument("--num-clusters", type=int, default=2000)
+    parser.add_argument("--num-queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--index-types", default=",".join(INDEX_TYPES))
+    parser.add_argument("--nlist", type=int, default=IndexConfig().nlist)
+    parser.add_argument("--pq-m", type=int, default=IndexConfig().pq_m)
+    parser.add_argument("--pq-nbits", type=int, default=IndexConfig().pq_nbits)
+    parser.add_argument("--hnsw-m", type=int, default=IndexConfig().hnsw_m)
+    parser.add_argument("--ef-construction", type=int, default=IndexConfig().ef_construction)
+    parser.add_argument("--nprobe", default="4,16,64")
+    parser.add_argument("--ef-search", default="32,64,128")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", type=Path, help="結果をJSONで保存するパス")
+    args = parser.parse_args()
+
+    print("=== FAISSインデックス種別ベンチマーク ===")
+    if args.source == "knowledge":
+        vectors = _knowledge_vectors(args.knowledge)
+        rng = np.random.default_rng(args.seed)
+        queries = vectors[rng.integers(0, len(vectors), size=args.num_queries)]
+        queries = queries + 0.05 * rng.standard_normal(queries.shape).astype("float32")
+    else:
+        data = _synthetic_vectors(args.num_vectors + args.num_queries, args.dimension, args.num_clusters, args.seed)
+        vectors, queries = data[:args.num_vectors], data[args.num_vectors:]
+    queries = np.ascontiguousarray(queries, dtype="float32")
+
+    print(f"ベクトル数: {len(vectors)}, 次元数: {vectors.shape[1]}, クエリ数: {len(queries)}, k={args.k}")
+    print("-" * 50)
+
+    base_config = IndexConfig(nlist=args.nlist,
+                              pq_m=args.pq_m,
+                              pq_nbits=args.pq_nbits,
+                              hnsw_m=args.hnsw_m,
+                              ef_construction=args.ef_construction)
+    results = run_benchmark(vectors, queries, args.k,
+                            [item.strip() for item in args.index_types.split(",")], base_config,
+                            _parse_int_list(args.nprobe), _parse_int_list(args.ef_search))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"k": args.k, "source": args.source, "results": results}, f, ensure_ascii=False, indent=4)
+        print(f"結果を保存しました: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""
+推論バックエンド比較ベンチマーク (bench_inference_backend.py)
+目的: 埋め込みモデル（all-MiniLM-L6-v2）とCrossEncoder（ms-marco-MiniLM-L-6-v2）について、
+PyTorch（FP32）とONNX Runtime（int8動的量子化）の出力の一致度とレイテンシ・スループットを比較する。
+
+使用例:
+    python bench_inference_backend.py --repeat 50 --output onnx_parity.json
+"""
+
+import argparse
+import json
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+import numpy as np
+from chunker import DEFAULT_CHUNK_CONFIG, get_chunks
+from inference_backend import get_embedding_model_args, load_cross_encoder
+from run_rag_advanced import CROSS_ENCODER_MODEL_NAME
+from vector_index import EMBEDDING_MODEL_NAME
+
+# パリティ確認用のクエリ（ナレッジの主要トピックを網羅）
+BENCH_QUERIES = [
+    "エラーコードE-404の対処法は？",
+    "定期メンテナンス情報を教えてください",
+    "500時間ごとのメンテナンス内容は？",
+    "安全センサーが人を検知した場合の動作は？",
+    "溶接電流の範囲はどれくらいですか？",
+    "シールドガスの供給圧力の規定値は？",
+    "ネットワーク設定の手順を教えてください",
+    "緊急停止後の再起動条件は？",
+]
+
+
+def _load_sentence_transformer(backend: str):
+    from sentence_transformers import SentenceTransformer
+
+    model_name, model_kwargs = get_embedding_model_args(EMBEDDING_MODEL_NAME, backend=backend)
+    return SentenceTransformer(model_name, **model_kwargs)
+
+
+def _time_calls(func: Callable[[], Any], repeat: int) -> Dict[str, float]:
+    """関数を繰り返し実行してレイテンシ分布（ミリ秒）を計測"""
+    func()  # ウォームアップ
+    latencies = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        latencies.append((time.perf_counter() - started) * 1000)
+    latencies_array = np.asarray(latencies)
+    return {
+        "p50_ms": float(np.percentile(latencies_array, 50)),
+        "p95_ms": float(np.percentile(latencies_array, 95)),
+        "mean_ms": float(latencies_array.mean())
+    }
+
+
+def _topk_overlap(scores_a: np.ndarray, scores_b: np.ndarray, k: int) -> float:
+    """スコア行列の各行について、上位k件の重なり率の平均を計算"""
+    overlaps = []
+    for row_a, row_b in zip(scores_a, scores_b):
+        top_a = set(np.argsort(-row_a)[:k])
+        top_b = set(np.argsort(-row_b)[:k])
+        overlaps.append(len(top_a & top_b) / k)
+    return float(np.mean(overlaps))
+
+
+def _spearman(a: np.ndarray, b: np.ndarray) -> float:
+    """順位相関係数（同順位は考慮しない簡易版）"""
+    rank_a = np.argsort(np.argsort(a))
+    rank_b = np.argsort(np.argsort(b))
+    return float(np.corrcoef(rank_a, rank_b)[0, 1])
+
+
+def bench_embeddings(chunks: List[str], queries: List[str], k: int, repeat: int) -> Dict[str, Any]:
+    """埋め込みモデルのパリティとレイテンシを計測"""
+    results: Dict[str, Any] = {}
+    vectors = {}
+    for backend in ("torch", "onnx"):
+        model = _load_sentence_transformer(backend)
+        chunk_vectors = model.encode(chunks, normalize_embeddings=True)
+        query_vectors = model.encode(queries, normalize_embeddings=True)
+        vectors[backend] = (chunk_vectors, query_vectors)
+
+        single = _time_calls(lambda: model.encode([queries[0]]), repeat)
+        started = time.perf_counter()
+        model.encode(chunks, batch_size=32)
+        batch_seconds = time.perf_counter() - started
+        results[backend] = {
+            "single_query": single,
+            "batch_texts_per_second": len(chunks) / batch_seconds if batch_seconds > 0 else float("inf")
+        }
+
+    torch_chunks, torch_queries = vectors["torch"]
+    onnx_chunks, onnx_queries = vectors["onnx"]
+    cosine = np.sum(torch_chunks * onnx_chunks, axis=1)
+    results["parity"] = {
+        "cosine_mean": float(cosine.mean()),
+        "cosine_min": float(cosine.min()),
+        f"retrieval_top{k}_overlap": _topk_overlap(torch_queries @ torch_chunks.T, onnx_queries @ onnx_chunks.T, k)
+    }
+    return results
+
+
+def bench_cross_encoder(chunks: List[str], queries: List[str], k: int, repeat: int) -> Dict[str, Any]:
+    """CrossEncoderのパリティとレイテンシを計測"""
+    results: Dict[str, Any] = {}
+    # 再ランキング時と同様に先頭800文字を使用
+    pairs = [[query, chunk[:800]] for query in queries for chunk in chunks]
+    rerank_pairs = pairs[:20]  # 高度RAGの最大候補数
+    scores = {}
+    for backend in ("torch", "onnx"):
+        model = load_cross_encoder(CROSS_ENCODER_MODEL_NAME, backend=backend)
+        scores[backend] = np.asarray(model.predict(pairs)).reshape(len(queries), len(chunks))
+
+        rerank = _time_calls(lambda: model.predict(rerank_pairs), repeat)
+        started = time.perf_counter()
+        model.predict(pairs, batch_size=32)
+        batch_seconds = time.perf_counter() - started
+        results[backend] = {
+            "rerank_20_candidates": rerank,
+            "batch_pairs_per_second": len(pairs) / batch_seconds if batch_seconds > 0 else float("inf")
+        }
+
+    torch_scores, onnx_scores = scores["torch"], scores["onnx"]
+    results["parity"] = {
+        "pearson": float(np.corrcoef(torch_scores.ravel(), onnx_scores.ravel())[0, 1]),
+        "spearman": _spearman(torch_scores.ravel(), onnx_scores.ravel()),
+        f"rerank_top{k}_overlap": _topk_overlap(torch_scores, onnx_scores, k)
+    }
+    return results
+
+
+def _print_section(title: str, results: Dict[str, Any]):
+    print(f"\n=== {title} ===")
+    for key, value in results.items():
+        print(f"{key}: {json.dumps(value, ensure_ascii=False)}")
+
+
+def main():
+    """直接実行用"""
+    parser = argparse.ArgumentParser(description="PyTorchとONNX Runtime（int8）の推論比較")
+    parser.add_argument("--knowledge", type=Path, default=Path(__file__).parent.parent.parent / "data" / "knowledge.txt")
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=30)
+    parser.add_argument("--output", type=Path, help="結果をJSONで保存するパス")
+    args = parser.parse_args()
+
+    _, chunk_list = get_chunks(args.knowledge, DEFAULT_CHUNK_CONFIG)
+    chunks = [chunk.text for chunk in chunk_list]
+    print(f"チャンク数: {len(chunks)}, クエリ数: {len(BENCH_QUERIES)}, k={args.k}")
+
+    embedding_results = bench_embeddings(chunks, BENCH_QUERIES, args.k, args.repeat)
+    _print_section("埋め込みモデル (all-MiniLM-L6-v2)", embedding_results)
+
+    cross_encoder_results = bench_cross_encoder(chunks, BENCH_QUERIES, args.k, args.repeat)
+    _print_section("CrossEncoder (ms-marco-MiniLM-L-6-v2)", cross_encoder_results)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            results = {"embeddings": embedding_results, "cross_encoder": cross_encoder_results}
+            json.dump(results, f, ensure_ascii=False, indent=4)
+        print(f"\n結果を保存しました: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+"""
+全処理モードのオフラインベンチマーク (benchmark_modes.py)
+目的: 各モードの処理関数を固定のクエリセットに対してモックLLM（LLM_BACKEND=mock）で実行し、
+ネットワークなしでパイプライン自体の性能を計測する。
+
+計測項目:
+    - 段階ごとのレイテンシ（load / embed / retrieve / rerank / generate など）
+    - エンドツーエンドのレイテンシ p50 / p95 / p99
+    - 同時実行数ごとのスループット
+    - ピークRSS
+
+結果はJSONで保存でき、--baselineで保存済みの結果と比較して性能劣化を検出する（劣化があれば終了コード1）。
+
+使用例:
+    python benchmark_modes.py --repeat 20 --concurrency 1 4 16 --output bench_modes.json
+    python benchmark_modes.py --baseline bench_modes.json --tolerance 0.2
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from ingest import peak_rss_mb
+from metrics import start_request
+from mock_llm import get_mock_llm_settings
+from mode_registry import MODE_MODULES, get_mode_module
+
+# 固定のクエリセット（ナレッジの主要トピック・識別子・一般的な質問を含む）
+BENCH_QUERIES = [
+    "エラーコードE-404の対処法は？",
+    "定期メンテナンス情報を教えてください",
+    "500時間ごとのメンテナンス内容は？",
+    "安全センサーが人を検知した場合の動作は？",
+    "溶接電流の範囲はどれくらいですか？",
+    "シールドガスの供給圧力の規定値は？",
+    "ネットワーク設定の手順を教えてください",
+    "ロボットのシリアル番号を教えてください",
+]
+
+# ベースライン比較の対象とするレイテンシ指標（スループットは同時実行数ごとに比較）
+LATENCY_KEYS = ("p50_ms", "p95_ms", "p99_ms")
+
+
+def _percentiles(values: List[float]) -> Dict[str, float]:
+    array = np.asarray(values) * 1000
+    return {
+        "p50_ms": round(float(np.percentile(array, 50)), 2),
+        "p95_ms": round(float(np.percentile(array, 95)), 2),
+        "p99_ms": round(float(np.percentile(array, 99)), 2),
+        "mean_ms": round(float(array.mean()), 2)
+    }
+
+
+async def _run_once(mode: str, query: str) -> Dict[str, float]:
+    """1リクエストを実行し、段階ごとの時間とエンドツーエンドの時間（秒）を返す"""
+    from main import ProcessingMode, ProcessRequest, run_mode
+
+    stage_timings = start_request(mode)
+    started = time.perf_counter()
+    await run_mode(get_mode_module(mode), ProcessRequest(query=query, mode=ProcessingMode(mode)))
+    return {"total": time.perf_counter() - started, **stage_timings}
+
+
+async def _run_with_context(mode: str, query: str) -> Dict[str, float]:
+    # 同時実行時に段階の計測がリクエスト間で混ざらないよう、リクエストごとに別タスクで実行する
+    return await asyncio.create_task(_run_once(mode, query))
+
+
+async def bench_mode(mode: str, repeat: int, concurrency_levels: List[int]) -> Dict[str, Any]:
+    """1モードのレイテンシとスループットを計測"""
+    from main import get_knowledge_path
+
+    result: Dict[str, Any] = {"errors": 0}
+
+    # コールドスタート（モジュール読み込み・warm_up・初回クエリ）は別に計測する
+    started = time.perf_counter()
+    module = get_mode_module(mode)
+    await asyncio.to_thread(module.warm_up, get_knowledge_path(mode))
+    await _run_with_context(mode, BENCH_QUERIES[0])
+    result["cold_start_seconds"] = round(time.perf_counter() - started, 3)
+
+    # 逐次実行でレイテンシを計測
+    totals: List[float] = []
+    stages: Dict[str, List[float]] = {}
+    for i in range(repeat):
+        query = BENCH_QUERIES[i % len(BENCH_QUERIES)]
+        try:
+            timings = await _run_with_context(mode, query)
+        except Exception as e:
+            result["errors"] += 1
+            result["last_error"] = str(e)
+            continue
+        totals.append(timings.pop("total"))
+        for stage, seconds in timings.items():
+            stages.setdefault(stage, []).append(seconds)
+
+    if totals:
+        result["latency"] = _percentiles(totals)
+        result["stages"] = {stage: _percentiles(values) for stage, values in sorted(stages.items())}
+
+    # 同時実行数ごとのスループット
+    result["throughput"] = {}
+    for concurrency in concurrency_levels:
+        semaphore = asyncio.Semaphore(concurrency)
+        requests = max(repeat, concurrency * 2)
+
+        async def limited(query: str):
+            async with semaphore:
+                return await _run_with_context(mode, query)
+
+        started = time.perf_counter()
+        outcomes = await asyncio.gather(*(limited(BENCH_QUERIES[i % len(BENCH_QUERIES)]) for i in range(requests)),
+                                        return_exceptions=True)
+        elapsed = time.perf_counter() - started
+        failed = sum(1 for outcome in outcomes if isinstance(outcome, Exception))
+        result["errors"] += failed
+        result["throughput"][str(concurrency)] = {
+            "requests": requests,
+            "seconds": round(elapsed, 3),
+            "throughput_rps": round((requests - failed) / elapsed, 2) if elapsed > 0 else 0.0
+        }
+
+    # プロセス全体のピーク（それまでに計測したモードの分を含む累積値）
+    result["peak_rss_mb"] = peak_rss_mb()
+    return result
+
+
+def compare_with_baseline(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """ベースラインと比較し、許容範囲を超えて悪化した指標を列挙する"""
+    regressions = []
+    for mode, current in results["modes"].items():
+        previous = baseline.get("modes", {}).get(mode)
+        if not previous:
+            continue
+
+        for key in LATENCY_KEYS:
+            before = previous.get("latency", {}).get(key)
+            after = current.get("latency", {}).get(key)
+            if before and after and after > before * (1 + tolerance):
+                regressions.append(f"{mode} latency.{key}: {before} -> {after} ms (+{(after / before - 1) * 100:.1f}%)")
+
+        for concurrency, stats in current.get("throughput", {}).items():
+            before = previous.get("throughput", {}).get(concurrency, {}).get("throughput_rps")
+            after = stats.get("throughput_rps")
+            if before and after is not None and after < before * (1 - tolerance):
+                regressions.append(f"{mode} throughput@{concurrency}: {before} -> {after} rps "
+                                   f"({(after / before - 1) * 100:.1f}%)")
+
+        if current.get("errors", 0) > previous.get("errors", 0):
+            regressions.append(f"{mode} errors: {previous.get('errors', 0)} -> {current['errors']}")
+    return regressions
+
+
+async def run_benchmark(modes: List[str], repeat: int, concurrency_levels: List[int]) -> Dict[str, Any]:
+    results: Dict[str, Any] = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": sys.version.split()[0],
+            "cpu_count": os.cpu_count(),
+            "repeat": repeat,
+            "concurrency": concurrency_levels,
+            "queries": len(BENCH_QUERIES),
+            "mock_llm": get_mock_llm_settings()
+        },
+        "modes": {}
+    }
+    for mode in modes:
+        print(f"\n=== {mode} ===")
+        mode_result = await bench_mode(mode, repeat, concurrency_levels)
+        results["modes"][mode] = mode_result
+        latency = mode_result.get("latency", {})
+        print(f"コールドスタート: {mode_result['cold_start_seconds']}秒, "
+              f"p50/p95/p99: {latency.get('p50_ms')}/{latency.get('p95_ms')}/{latency.get('p99_ms')} ms, "
+              f"エラー: {mode_result['errors']}")
+        for stage, stats in mode_result.get("stages", {}).items():
+            print(f"  {stage:<10} p50 {stats['p50_ms']:>9} ms  p95 {stats['p95_ms']:>9} ms")
+        for concurrency, stats in mode_result["throughput"].items():
+            print(f"  同時実行数 {concurrency:>3}: {stats['throughput_rps']} req/s")
+    return results
+
+
+def main():
+    """直接実行用"""
+    parser = argparse.ArgumentParser(description="全処理モードのオフラインベンチマーク（モックLLM使用）")
+    parser.add_argument("--modes", nargs="*", default=list(MODE_MODULES), help="計測するモード（既定: すべて）")
+    parser.add_argument("--repeat", type=int, default=20, help="逐次実行でのリクエスト数")
+    parser.add_argument("--concurrency", type=int, nargs="*", default=[1, 4, 16], help="スループットを計測する同時実行数")
+    parser.add_argument("--output", type=Path, help="結果をJSONで保存するパス")
+    parser.add_argument("--baseline", type=Path, help="比較するベースラインのJSON")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="劣化とみなす変化率（既定: 20%%）")
+    args = parser.parse_args()
+
+    # LLM呼び出しはすべてモックLLMで行う（.envの設定より優先）
+    os.environ["LLM_BACKEND"] = "mock"
+
+    results = asyncio.run(run_benchmark(args.modes, args.repeat, args.concurrency))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=4)
+        print(f"\n結果を保存しました: {args.output}")
+
+    regressions: Optional[List[str]] = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(results, baseline, args.tolerance)
+        print(f"\n=== ベースライン比較 ({args.baseline}, 許容 {args.tolerance * 100:.0f}%) ===")
+        if regressions:
+            for regression in regressions:
+                print(f"❌ {regression}")
+        else:
+            print("✅ 性能劣化は検出されませんでした")
+
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+"""
+コンパクトなチャンクストア
+全チャンクのテキストを1つのUTF-8バッファファイルに連結してメモリマップし、
+チャンクの位置情報は配列で保持する。検索処理では整数のチャンクIDだけを受け渡し、
+テキストはプロンプト作成時など必要な時点でのみデコードする。
+"""
+
+import json
+import mmap
+import os
+import shutil
+import threading
+from array import array
+from bisect import bisect_right
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from chunker import Chunk, ChunkConfig, config_key, get_chunks
+
+# 保存形式での位置情報配列のファイル名と型コード
+_ARRAY_FILES = (
+    ("byte_offsets", "q"),
+    ("char_starts", "q"),
+    ("char_ends", "q"),
+    ("source_ids", "i"),
+    ("section_ids", "i"),
+)
+
+# チャンクストアのバッファファイル置き場（同一ファイルを複数プロセスでメモリマップして共有する）
+CHUNK_STORE_DIR = Path(os.getenv("CHUNK_STORE_DIR", Path(__file__).parent.parent.parent / "cache" / "chunk_store"))
+
+# チャンク設定ごとに残すバッファファイル数（現在のバージョンと、まだ切り替えていない他プロセス向けの1つ前）
+KEEP_BUFFERS = 2
+
+
+class ChunkRecord:
+    """チャンクのメタデータ（テキスト本体は保持しない）"""
+    __slots__ = ("chunk_id", "source_id", "section_id", "char_start", "char_end", "byte_start", "byte_end")
+
+    def __init__(self, chunk_id: int, source_id: int, section_id: int, char_start: int, char_end: int,
+                 byte_start: int, byte_end: int):
+        self.chunk_id = chunk_id
+        self.source_id = source_id
+        self.section_id = section_id
+        self.char_start = char_start
+        self.char_end = char_end
+        self.byte_start = byte_start
+        self.byte_end = byte_end
+
+
+class ChunkStore:
+    """メモリマップしたUTF-8バッファと配列ベースのオフセットによるチャンクストア"""
+
+    def __init__(self, buffer_path: Path, version: str, byte_offsets: array, char_starts: array, char_ends: array,
+                 source_ids: array, section_ids: array, sources: List[str], section_titles: List[str]):
+        self.buffer_path = buffer_path
+        self.version = version
+        self._byte_offsets = byte_offsets  # 長さ n+1（チャンクiは [offsets[i], offsets[i+1]) ）
+        self._char_starts = char_starts  # 元ファイル内の文字オフセット
+        self._char_ends = char_ends
+        self._source_ids = source_ids
+        self._section_ids = section_ids
+        self._sources = sources
+        self._section_titles = section_titles
+
+        if byte_offsets[-1] > 0:
+            with open(buffer_path, "rb") as f:
+                self._buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._buffer = b""
+
+    def __len__(self) -> int:
+        return len(self._byte_offsets) - 1
+
+    @classmethod
+    def build(cls, version: str, chunks: Sequence[Chunk], buffer_path: Path, source: str = "") -> "ChunkStore":
+        """単一ファイルのチャンクリストからストアを構築する"""
+        writer = ChunkStoreWriter(buffer_path)
+        source_id = writer.add_source(source)
+        for chunk in chunks:
+            writer.add(chunk, source_id)
+        return writer.finish(version)
+
+    def save(self, directory: Path):
+        """
+        ストアをディレクトリに保存する（バッファ・位置情報配列・メタデータ）
+
+        保存したストアはChunkStore.openで、位置情報配列も含めてメモリマップで開ける。
+        """
+        directory.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(self.buffer_path, directory / "chunks.utf8")
+        for name, _ in _ARRAY_FILES:
+            with open(directory / f"{name}.bin", "wb") as f:
+                f.write(bytes(getattr(self, f"_{name}")))
+        meta = {
+            "version": self.version,
+            "chunks": len(self),
+            "sources": self._sources,
+            "section_titles": self._section_titles
+        }
+        with open(directory / "chunks.json", "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+
+    @classmethod
+    def open(cls, directory: Path) -> "ChunkStore":
+        """
+        saveで保存したストアを読み取り専用で開く
+
+        テキストバッファと位置情報配列はいずれもメモリマップするため、同じファイルを開いた
+        複数のプロセスはページキャッシュ上の同じ物理メモリを共有する。
+        """
+        with open(directory / "chunks.json", "r", encoding="utf-8") as f:
+            meta = json.load(f)
+
+        arrays = []
+        for name, typecode in _ARRAY_FILES:
+            path = directory / f"{name}.bin"
+            if path.stat().st_size == 0:
+                arrays.append(array(typecode))
+                continue
+            with open(path, "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            arrays.append(memoryview(mapped).cast(typecode))
+        return cls(directory / "chunks.utf8", meta["version"], *arrays, meta["sources"], meta["section_titles"])
+
+    def record(self, chunk_id: int) -> ChunkRecord:
+        """チャンクIDに対応するレコードを取得"""
+        return ChunkRecord(chunk_id, self._source_ids[chunk_id], self._section_ids[chunk_id],
+                           self._char_starts[chunk_id], self._char_ends[chunk_id], self._byte_offsets[chunk_id],
+                           self._byte_offsets[chunk_id + 1])
+
+    def section(self, chunk_id: int) -> str:
+        """チャンクが属するセクション名を取得"""
+        return self._section_titles[self._section_ids[chunk_id]]
+
+    def source(self, chunk_id: int) -> str:
+        """チャンクの元ファイルパスを取得"""
+        return self._sources[self._source_ids[chunk_id]]
+
+    def metadata(self, chunk_id: int) -> Dict[str, Any]:
+        """チャンクのメタデータ（元ファイル・セクション・文字オフセット）を取得"""
+        return {
+            "source": self.source(chunk_id),
+            "section": self.section(chunk_id),
+            "start_index": self._char_starts[chunk_id],
+            "end_index": self._char_ends[chunk_id]
+        }
+
+    def text(self, chunk_id: int, max_chars: Optional[int] = None) -> str:
+        """チャンクのテキストをデコードして取得"""
+        data = self._buffer[self._byte_offsets[chunk_id]:self._byte_offsets[chunk_id + 1]]
+        text = data.decode("utf-8")
+        return text[:max_chars] if max_chars is not None else text
+
+    def texts(self, chunk_ids: Iterable[int]) -> List[str]:
+        """複数チャンクのテキストを取得"""
+        return [self.text(chunk_id) for chunk_id in chunk_ids]
+
+    def find_containing(self, keywords: Iterable[str]) -> List[int]:
+        """
+        いずれかのキーワードを含むチャンクIDを昇順で取得する
+
+        バッファ上でバイト列検索を行うため、チャンクテキストをデコードしない。
+        """
+        found = set()
+        total = len(self)
+        for keyword in keywords:
+            needle = keyword.encode("utf-8")
+            if not needle:
+                continue
+            pos = self._buffer.find(needle)
+            while pos != -1:
+                chunk_id = bisect_right(self._byte_offsets, pos) - 1
+                if chunk_id < total and pos + len(needle) <= self._byte_offsets[chunk_id + 1]:
+                    found.add(chunk_id)
+                pos = self._buffer.find(needle, pos + 1)
+        return sorted(found)
+
+    def close(self):
+        """メモリマップを解放"""
+        if isinstance(self._buffer, mmap.mmap):
+            self._buffer.close()
+
+
+class ChunkStoreWriter:
+    """
+    チャンクを1件ずつバッファファイルへ追記してストアを構築するライター
+
+    テキストは逐次ファイルに書き出すため、構築中にメモリ上へ保持するのは配列のオフセット情報のみ。
+    """
+
+    def __init__(self, buffer_path: Path):
+        self.buffer_path = buffer_path
+        buffer_path.parent.mkdir(parents=True, exist_ok=True)
+        # 他プロセスが部分的なファイルを読まないよう、一時ファイルに書いてから置き換える
+        self._tmp_path = buffer_path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        self._file = open(self._tmp_path, "wb")
+        self._byte_offsets = array("q", [0])
+        self._char_starts = array("q")
+        self._char_ends = array("q")
+        self._source_ids = array("i")
+        self._section_ids = array("i")
+        self._sources: List[str] = []
+        self._section_titles: List[str] = []
+        # (ソースID, ファイル内セクション番号) -> ストア全体でのセクションID
+        self._section_keys: Dict[Tuple[int, int], int] = {}
+
+    def add_source(self, source: str) -> int:
+        """元ファイルを登録してソースIDを返す"""
+        self._sources.append(source)
+        return len(self._sources) - 1
+
+    def add(self, chunk: Chunk, source_id: int) -> int:
+        """チャンクを追記してチャンクIDを返す"""
+        data = chunk.text.encode("utf-8")
+        self._file.write(data)
+        self._byte_offsets.append(self._byte_offsets[-1] + len(data))
+        self._char_starts.append(chunk.start)
+        self._char_ends.append(chunk.end)
+        self._source_ids.append(source_id)
+
+        section_key = (source_id, chunk.section_index)
+        section_id = self._section_keys.get(section_key)
+        if section_id is None:
+            section_id = len(self._section_titles)
+            self._section_titles.append(chunk.section)
+            self._section_keys[section_key] = section_id
+        self._section_ids.append(section_id)
+        return len(self._byte_offsets) - 2
+
+    def finish(self, version: str) -> ChunkStore:
+        """書き込みを完了してストアを開く"""
+        self._file.close()
+        if self.buffer_path.exists():
+            # 同じ内容のバッファが既にある（他プロセスが先に構築した）場合はそれを共有する
+            os.remove(self._tmp_path)
+        else:
+            os.replace(self._tmp_path, self.buffer_path)
+        return ChunkStore(self.buffer_path, version, self._byte_offsets, self._char_starts, self._char_ends,
+                          self._source_ids, self._section_ids, self._sources, self._section_titles)
+
+
+def _mtime_or_zero(path: Path) -> float:
+    try:
+        return path.stat().st_mtime
+    except OSError:
+        # 他プロセスが先に削除した場合
+        return 0.0
+
+
+def prune_buffers(config: ChunkConfig, current: Path, keep: int = KEEP_BUFFERS, directory: Path = CHUNK_STORE_DIR):
+    """
+    チャンク設定が同じ古いバッファファイルを、新しいものからkeep個を残して削除する
+
+    currentと、このプロセスのキャッシュにあるストアのバッファは常に残す。POSIXでは削除したファイルを
+    メモリマップ中の他プロセスも引き続き読めるため、削除できない環境（Windows）でのみ失敗を無視して残す。
+    """
+    protected = {Path(current).resolve()} | {store.buffer_path.resolve() for store in _store_cache.values()}
+    buffers = sorted(directory.glob(f"*-{config_key(config)}.utf8"), key=_mtime_or_zero, reverse=True)
+    for path in [path for path in buffers if path.resolve() not in protected][max(0, keep - 1):]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+# (バージョン, 設定) -> ChunkStore
+_store_cache: Dict[Tuple[str, ChunkConfig], ChunkStore] = {}
+_store_cache_lock = threading.Lock()
+
+
+def get_chunk_store(knowledge_path: Path, config: ChunkConfig) -> ChunkStore:
+    """
+    ナレッジファイルのチャンクストアを取得する
+
+    ナレッジの内容または設定が変わった場合のみ再構築する。
+    """
+    version, chunks = get_chunks(knowledge_path, config)
+    key = (version, config)
+
+    store = _store_cache.get(key)
+    if store is not None:
+        return store
+
+    with _store_cache_lock:
+        store = _store_cache.get(key)
+        if store is None:
+            buffer_path = CHUNK_STORE_DIR / f"{version}-{config_key(config)}.utf8"
+            store = ChunkStore.build(version, chunks, buffer_path, source=str(knowledge_path))
+            # 古いバージョンのストアは参照が残っている可能性があるため、明示的にはcloseしない
+            for old_key in [k for k in _store_cache if k[1] == config]:
+                del _store_cache[old_key]
+            _store_cache[key] = store
+            # ナレッジを更新するたびにコーパス全体のコピーが増えないよう、古いバッファを削除する
+            prune_buffers(config, buffer_path)
+    return store
@@ -0,0 +1,149 @@
+"""
+セクション対応チャンカー
+`## ` 見出し構造を1回の線形走査で解析してチャンクに分割し、
+(ナレッジバージョン, チャンク設定) 単位で分割結果をキャッシュする
+"""
+
+import hashlib
+import threading
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Tuple
+
+from knowledge_base import load_knowledge, split_sections
+from metrics import observe_stage
+
+
+class ChunkConfig(NamedTuple):
+    """チャンク分割設定（キャッシュキーとして使用するためハッシュ可能）"""
+    chunk_size: int = 800
+    chunk_overlap: int = 150
+    # セクション内で分割位置として優先する区切り文字（優先度順）
+    separators: Tuple[str, ...] = ("\n\n", "\n", "。", "、", " ")
+
+
+class Chunk(NamedTuple):
+    """チャンク（オフセットはナレッジ全体に対する文字位置）"""
+    text: str
+    start: int
+    end: int
+    section: str
+    section_index: int
+
+
+# 各モードで使用するチャンク設定
+DEFAULT_CHUNK_CONFIG = ChunkConfig()
+FANCALL_CHUNK_CONFIG = ChunkConfig(chunk_size=500, chunk_overlap=50)
+
+# (バージョン, 設定) -> チャンクリスト
+_chunk_cache: Dict[Tuple[str, ChunkConfig], List[Chunk]] = {}
+_chunk_cache_lock = threading.Lock()
+_CHUNK_CACHE_SIZE = 8
+
+
+def _find_split_point(content: str, start: int, limit: int, separators: Tuple[str, ...]) -> int:
+    """[start, limit) の範囲で、優先度の高い区切り文字の直後となる最も後ろの分割位置を探す"""
+    # 極端に短いチャンクを避けるため、ウィンドウ後半のみを探索する
+    lower = start + (limit - start) // 2
+    for separator in separators:
+        pos = content.rfind(separator, lower, limit)
+        if pos != -1:
+            return pos + len(separator)
+    return limit
+
+
+def _find_overlap_start(content: str, cut: int, start: int, overlap: int, separators: Tuple[str, ...]) -> int:
+    """次のチャンクの開始位置を、オーバーラップ範囲内の区切り文字の直後に揃える"""
+    lower = max(cut - overlap, start + 1)
+    if lower >= cut:
+        return cut
+    for separator in separators:
+        pos = content.find(separator, lower, cut)
+        # 区切り文字の後ろが空白のみの場合は重複の意味がないため採用しない
+        if pos != -1 and content[pos + len(separator):cut].strip():
+            return pos + len(separator)
+    return lower
+
+
+def _strip_span(content: str, start: int, end: int) -> Tuple[int, int]:
+    """前後の空白を除いた範囲を返す（オフセットを元テキストと一致させたまま）"""
+    while start < end and content[start].isspace():
+        start += 1
+    while end > start and content[end - 1].isspace():
+        end -= 1
+    return start, end
+
+
+def chunk_text(content: str, config: ChunkConfig = DEFAULT_CHUNK_CONFIG) -> List[Chunk]:
+    """
+    ナレッジ内容をセクション境界を越えないチャンクに分割する
+
+    セクションが chunk_size 以下なら1チャンク、超える場合は区切り文字の優先度に従って
+    chunk_size 以内の位置で分割し、chunk_overlap 文字分を重複させる。
+
+    Args:
+        content: ナレッジ内容
+        config: チャンク分割設定
+
+    Returns:
+        文書順のチャンクリスト
+    """
+    chunks = []
+    for section_index, section in enumerate(split_sections(content)):
+        start, section_end = section.start, section.end
+        while start < section_end:
+            limit = start + config.chunk_size
+            if limit >= section_end:
+                cut = section_end
+            else:
+                cut = _find_split_point(content, start, limit, config.separators)
+
+            chunk_start, chunk_end = _strip_span(content, start, cut)
+            if chunk_start < chunk_end:
+                chunks.append(
+                    Chunk(text=content[chunk_start:chunk_end],
+                          start=chunk_start,
+                          end=chunk_end,
+                          section=section.title,
+                          section_index=section_index))
+
+            if cut >= section_end:
+                break
+            start = _find_overlap_start(content, cut, start, config.chunk_overlap, config.separators)
+    return chunks
+
+
+def config_key(config: ChunkConfig) -> str:
+    """チャンク設定をファイル名などに使える短い文字列に変換"""
+    separators_hash = hashlib.sha1(repr(config.separators).encode("utf-8")).hexdigest()[:8]
+    return f"{config.chunk_size}-{config.chunk_overlap}-{separators_hash}"
+
+
+def get_chunks(knowledge_path: Path, config: ChunkConfig = DEFAULT_CHUNK_CONFIG) -> Tuple[str, List[Chunk]]:
+    """
+    ナレッジファイルをチャンク分割した結果を取得する
+
+    ナレッジの内容または設定が変わった場合のみ再分割する。返却したリストは
+    リクエスト間で共有されるため、呼び出し側で変更しないこと。
+
+    Args:
+        knowledge_path: ナレッジファイルのパス
+        config: チャンク分割設定
+
+    Returns:
+        (ナレッジバージョン, 文書順のチャンクリスト)
+    """
+    content, version = load_knowledge(knowledge_path)
+    key = (version, config)
+
+    cached = _chunk_cache.get(key)
+    if cached is not None:
+        return version, cached
+
+    with observe_stage("split"):
+        chunks = chunk_text(content, config)
+
+    with _chunk_cache_lock:
+        while len(_chunk_cache) >= _CHUNK_CACHE_SIZE:
+            _chunk_cache.pop(next(iter(_chunk_cache)))
+        _chunk_cache[key] = chunks
+    return version, chunks
@@ -0,0 +1,157 @@
+"""
+抽出型のコンテキスト圧縮
+再ランキングで選んだチャンクを文（`。` と改行）に分割し、各文をクエリとの関連度でスコアリングして、
+トークン予算に収まる範囲で関連度の高い文だけを残す。残した文は元の順序（チャンク順・文順）で連結する。
+
+スコアリングには読み込み済みのモデルを使用する:
+    embedding: 検索用の埋め込みモデルでクエリと文のコサイン類似度（文ベクトルはLRUキャッシュで再利用）
+    cross_encoder: 再ランキング用のCrossEncoderで (クエリ, 文) のペアを採点（高精度だが文数に比例して遅い）
+"""
+
+import asyncio
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+from query_embedder import get_query_embedder
+from token_utils import count_tokens
+from vector_index import get_embeddings
+
+# 文末の `。` または改行までを1文とする（区切り文字は文に含めて、連結時に元の書式を保つ）
+_SENTENCE_RE = re.compile(r"[^。\n]*(?:。|\n|$)")
+
+# 文ベクトルのキャッシュ（同じチャンクは繰り返し選ばれるため、文の埋め込みを使い回す）
+_SENTENCE_CACHE_SIZE = 4096
+_sentence_vectors: "OrderedDict[str, np.ndarray]" = OrderedDict()
+_sentence_vectors_lock = threading.Lock()
+
+
+class CompressionResult(NamedTuple):
+    """コンテキスト圧縮の結果"""
+    context: str
+    original_tokens: int
+    compressed_tokens: int
+    total_sentences: int
+    kept_sentences: int
+    # 予算内に収まっていたため圧縮しなかった場合はFalse
+    applied: bool
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.original_tokens - self.compressed_tokens
+
+
+def get_compression_settings() -> Dict[str, Any]:
+    """環境変数からコンテキスト圧縮の設定を取得"""
+    return {
+        "enabled": os.getenv("CONTEXT_COMPRESSION_ENABLED", "true").lower() == "true",
+        "token_budget": int(os.getenv("CONTEXT_TOKEN_BUDGET", 600)),
+        "scorer": os.getenv("CONTEXT_COMPRESSION_SCORER", "embedding").lower()
+    }
+
+
+def split_sentences(text: str) -> List[str]:
+    """テキストを文に分割する（区切り文字を含むため、全要素を連結すると元のテキストに戻る）"""
+    return [sentence for sentence in _SENTENCE_RE.findall(text) if sentence]
+
+
+def _embed_sentences(sentences: List[str]) -> np.ndarray:
+    """文を埋め込み、正規化したベクトルを返す（キャッシュにない文だけをまとめて埋め込む）"""
+    unique_sentences = list(dict.fromkeys(sentences))
+    with _sentence_vectors_lock:
+        vectors = {sentence: _sentence_vectors[sentence] for sentence in unique_sentences if sentence in _sentence_vectors}
+        for sentence in vectors:
+            _sentence_vectors.move_to_end(sentence)
+
+    missing = [sentence for sentence in unique_sentences if sentence not in vectors]
+    if missing:
+        embedded = np.asarray(get_embeddings().embed_documents(missing), dtype="float32")
+        embedded /= np.maximum(np.linalg.norm(embedded, axis=1, keepdims=True), 1e-12)
+        vectors.update(zip(missing, embedded))
+        with _sentence_vectors_lock:
+            for sentence, vector in zip(missing, embedded):
+                _sentence_vectors[sentence] = vector
+            while len(_sentence_vectors) > _SENTENCE_CACHE_SIZE:
+                _sentence_vectors.popitem(last=False)
+
+    return np.stack([vectors[sentence] for sentence in sentences])
+
+
+def score_by_embedding(query_vector: Sequence[float], sentences: List[str]) -> List[float]:
+    """埋め込みモデルでクエリと各文のコサイン類似度を計算"""
+    query = np.asarray(query_vector, dtype="float32")
+    query = query / max(float(np.linalg.norm(query)), 1e-12)
+    return (_embed_sentences(sentences) @ query).tolist()
+
+
+def select_sentences(sentences: List[str], scores: List[float], token_budget: int) -> List[int]:
+    """
+    スコアの高い文からトークン予算に収まるだけ選び、元の順序で位置を返す
+
+    予算を超える文は飛ばして次の文を試す。最もスコアの高い文は予算を超えても必ず残す。
+    """
+    selected = []
+    used_tokens = 0
+    for position in sorted(range(len(sentences)), key=lambda i: scores[i], reverse=True):
+        tokens = count_tokens(sentences[position])
+        if used_tokens + tokens > token_budget and selected:
+            continue
+        selected.append(position)
+        used_tokens += tokens
+    return sorted(selected)
+
+
+async def compress_context(query: str,
+                           chunk_texts: List[str],
+                           token_budget: int,
+                           scorer: str = "embedding",
+                           cross_encoder_loader: Optional[Callable[[], Any]] = None) -> CompressionResult:
+    """
+    チャンク群を文単位で抽出圧縮する
+
+    Args:
+        query: 元の質問
+        chunk_texts: プロンプトに入れる順に並べたチャンクのテキスト
+        token_budget: 圧縮後のコンテキストのトークン上限
+        scorer: "embedding" または "cross_encoder"
+        cross_encoder_loader: scorer="cross_encoder" の場合にCrossEncoderを返す関数
+
+    Returns:
+        CompressionResult（チャンク間は空行で区切り、文を1つも残さなかったチャンクは除く）
+    """
+    original_context = "\n\n".join(chunk_texts)
+    original_tokens = count_tokens(original_context)
+    chunk_sentences = [split_sentences(text) for text in chunk_texts]
+    # 見出し・空行のみの文は採点対象外（見出しは文を残したチャンクにのみ付ける）
+    candidates = [(chunk_index, position, sentence)
+                  for chunk_index, sentences in enumerate(chunk_sentences)
+                  for position, sentence in enumerate(sentences)
+                  if sentence.strip() and not sentence.startswith("#")]
+
+    if original_tokens <= token_budget or not candidates:
+        return CompressionResult(original_context, original_tokens, original_tokens, len(candidates), len(candidates),
+                                 False)
+
+    sentences = [sentence.strip() for _, _, sentence in candidates]
+    if scorer == "cross_encoder" and cross_encoder_loader is not None:
+        reranker = cross_encoder_loader()
+        scores = await asyncio.to_thread(lambda: [float(score) for score in reranker.predict(
+            [[query, sentence] for sentence in sentences])])
+    else:
+        # クエリベクトルは検索時にキャッシュ済みのものを再利用する
+        query_vector = await get_query_embedder().embed(query)
+        scores = await asyncio.to_thread(score_by_embedding, query_vector, sentences)
+
+    kept = {(candidates[i][0], candidates[i][1]) for i in select_sentences(sentences, scores, token_budget)}
+    compressed_chunks = []
+    for chunk_index, chunk in enumerate(chunk_sentences):
+        if not any((chunk_index, position) in kept for position in range(len(chunk))):
+            continue
+        compressed_chunks.append("".join(sentence for position, sentence in enumerate(chunk)
+                                         if (chunk_index, position) in kept or sentence.startswith("#")).strip())
+
+    context = "\n\n".join(compressed_chunks)
+    return CompressionResult(context, original_tokens, count_tokens(context), len(candidates), len(kept), True)
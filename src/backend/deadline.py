@@ -0,0 +1,176 @@
+"""
+リクエストの期限（デッドライン）と段階的な機能縮退
+/process の各リクエストに期限（クライアント指定の timeout_seconds、未指定時はモードごとの既定値）を設定し、
+ContextVarで全段階に伝播する。残り時間が少なくなった段階では、次の順序で処理を縮退させる:
+
+    1. skip_expansion        クエリ拡張（LLM呼び出し1回）を省略
+    2. skip_rerank           CrossEncoderによる再ランキングを省略
+    3. shrink_context        プロンプトに入れるコンテキストを縮小
+    4. cap_agent_iterations  ツール呼び出しのターン数（エージェントの反復回数）を打ち切る
+
+各縮退は、その段階を実行するのに必要な残り時間（秒）を下回った場合に行う。必要な残り時間は
+先に縮退させるものほど大きく設定し（上の順序）、DEADLINE_MIN_REMAININGで変更できる。
+行った縮退はすべて記録し、レスポンスの degradations に含める。期限を過ぎた場合は504を返す。
+"""
+
+import asyncio
+import os
+import time
+from contextvars import ContextVar
+from typing import Any, Awaitable, Dict, List, Optional
+
+# モードごとの既定の期限（秒）
+DEFAULT_TIMEOUTS: Dict[str, float] = {
+    "llm_only": 30.0,
+    "prompt_stuffing": 45.0,
+    "rag_only": 30.0,
+    "rag_advanced": 45.0,
+    "function_calling": 60.0,
+    "rag_function_calling": 60.0,
+}
+
+# 縮退の順序と、縮退せずに実行するのに必要な残り時間（秒）
+DEGRADATION_ORDER = ("skip_expansion", "skip_rerank", "shrink_context", "cap_agent_iterations")
+DEFAULT_MIN_REMAINING: Dict[str, float] = {
+    "skip_expansion": 12.0,
+    "skip_rerank": 8.0,
+    "shrink_context": 5.0,
+    "cap_agent_iterations": 4.0,
+}
+
+# shrink_context時のコンテキストの上限（RAG系はチャンク数、プロンプトスタッフィングはトークン数）
+DEGRADED_CONTEXT_CHUNKS = 2
+DEGRADED_CONTEXT_TOKENS = 1500
+
+_DEGRADATION_DESCRIPTIONS = {
+    "skip_expansion": "クエリ拡張を省略",
+    "skip_rerank": "再ランキングを省略",
+    "shrink_context": "コンテキストを縮小",
+    "cap_agent_iterations": "ツール呼び出しのターン数を打ち切り",
+}
+
+# 現在のリクエストの期限
+_current_deadline: ContextVar[Optional["Deadline"]] = ContextVar("request_deadline", default=None)
+
+
+def get_default_timeout(mode: str) -> float:
+    """
+    モードの既定の期限（秒）を取得
+
+    REQUEST_TIMEOUTS="rag_advanced=30,function_calling=90" の形式（モード=秒）で既定値を上書きする。
+    """
+    timeouts = dict(DEFAULT_TIMEOUTS)
+    for item in os.getenv("REQUEST_TIMEOUTS", "").split(","):
+        if not item.strip():
+            continue
+        try:
+            item_mode, seconds = item.split("=", 1)
+            timeouts[item_mode.strip()] = float(seconds)
+        except ValueError:
+            print(f"警告: REQUEST_TIMEOUTSの設定 '{item}' を解釈できないため無視します（形式: モード=秒）")
+    return timeouts.get(mode, 30.0)
+
+
+def get_min_remaining() -> Dict[str, float]:
+    """
+    各縮退を行わずに実行するのに必要な残り時間（秒）を取得
+
+    DEADLINE_MIN_REMAINING="skip_expansion=15,skip_rerank=10" の形式で既定値を上書きする。
+    """
+    min_remaining = dict(DEFAULT_MIN_REMAINING)
+    for item in os.getenv("DEADLINE_MIN_REMAINING", "").split(","):
+        if not item.strip():
+            continue
+        try:
+            action, seconds = item.split("=", 1)
+            if action.strip() not in min_remaining:
+                raise ValueError(action)
+            min_remaining[action.strip()] = float(seconds)
+        except ValueError:
+            print(f"警告: DEADLINE_MIN_REMAININGの設定 '{item}' を解釈できないため無視します"
+                  f"（形式: 縮退={'/'.join(DEGRADATION_ORDER)}=秒）")
+    return min_remaining
+
+
+class DeadlineExceeded(Exception):
+    """リクエストの期限を過ぎた場合の例外"""
+
+    def __init__(self, deadline: "Deadline"):
+        self.budget_seconds = deadline.budget_seconds
+        self.degradations = list(deadline.degradations)
+        super().__init__(f"処理が期限（{deadline.budget_seconds:g}秒）内に完了しませんでした")
+
+
+class Deadline:
+    """1リクエストの期限と、行った縮退の記録"""
+
+    def __init__(self, budget_seconds: float, min_remaining: Optional[Dict[str, float]] = None):
+        self.budget_seconds = budget_seconds
+        self.started = time.monotonic()
+        self.expires_at = self.started + budget_seconds
+        self.min_remaining = min_remaining or get_min_remaining()
+        self.degradations: List[Dict[str, Any]] = []
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def should_degrade(self, action: str, detail: Optional[str] = None) -> bool:
+        """
+        残り時間が縮退の基準を下回っているか判定し、下回っていれば縮退として記録する
+
+        Args:
+            action: DEGRADATION_ORDERのいずれか
+            detail: 縮退の内容の補足（表示用）
+        """
+        remaining = self.remaining()
+        if remaining >= self.min_remaining[action]:
+            return False
+        self.degradations.append({
+            "action": action,
+            "description": _DEGRADATION_DESCRIPTIONS[action] + (f"（{detail}）" if detail else ""),
+            "remaining_ms": round(remaining * 1000, 1),
+            "elapsed_ms": round(self.elapsed() * 1000, 1)
+        })
+        return True
+
+    async def run(self, awaitable: Awaitable[Any]) -> Any:
+        """
+        期限までに完了しなければ打ち切って待つ
+
+        Raises:
+            DeadlineExceeded: 期限を過ぎた場合
+        """
+        try:
+            return await asyncio.wait_for(awaitable, self.remaining())
+        except asyncio.TimeoutError:
+            # 内部の別のタイムアウト（ツール呼び出しなど）はそのまま送出する（タイマーの誤差は許容する）
+            if self.remaining() > 0.01:
+                raise
+            raise DeadlineExceeded(self)
+
+
+def start_deadline(budget_seconds: float) -> Deadline:
+    """現在のコンテキストに期限を設定する（以降の段階はcurrent_deadlineで参照する）"""
+    deadline = Deadline(budget_seconds)
+    _current_deadline.set(deadline)
+    return deadline
+
+
+def current_deadline() -> Optional[Deadline]:
+    """現在のリクエストの期限（/process 以外から呼び出された場合はNone）"""
+    return _current_deadline.get()
+
+
+def should_degrade(action: str, detail: Optional[str] = None) -> bool:
+    """現在のリクエストの残り時間で縮退が必要か（期限が設定されていない場合は常にFalse）"""
+    deadline = _current_deadline.get()
+    return deadline is not None and deadline.should_degrade(action, detail)
+
+
+def remaining_seconds() -> Optional[float]:
+    """現在のリクエストの残り時間（期限が設定されていない場合はNone）"""
+    deadline = _current_deadline.get()
+    return deadline.remaining() if deadline is not None else None
@@ -5,7 +5,7 @@
 
 import os
 from pathlib import Path
-from typing import Optional
+from typing import Any, Callable, Dict, Optional
 
 from dotenv import load_dotenv
 
@@ -44,11 +44,20 @@ def find_project_root(current_path: Optional[Path] = None) -> Path:
     return Path.cwd()
 
 
+# setup_environment()は各処理モジュールのインポート時にも呼ばれるため、読み込みは1回だけ行う
+_environment_loaded = False
+
+
 def setup_environment():
     """
     環境変数を設定する
-    プロジェクトルートの.envファイルを自動検出して読み込む
+    プロジェクトルートの.envファイルを自動検出して読み込む（2回目以降の呼び出しは何もしない）
     """
+    global _environment_loaded
+    if _environment_loaded:
+        return
+    _environment_loaded = True
+
     try:
         project_root = find_project_root()
         env_path = project_root / '.env'
@@ -175,22 +184,58 @@ def create_mock_llm_if_needed():
     if not check_google_cloud_auth():
         print("\n⚠️  実際のVertex AIを使用するには認証が必要です")
         print("🔄 デモ用にモックレスポンスを使用することもできます")
-        print("   .envファイルでUSE_MOCK_LLM=trueに設定してください")
+        print("   .envファイルでLLM_BACKEND=mockに設定してください")
         return True
     return False
 
 
+def _create_mock_llm(model_name: str, temperature: float):
+    from mock_llm import create_mock_llm
+    return create_mock_llm(model_name, temperature)
+
+
+# LLMバックエンド名 -> (モデル名, 温度) からチャットモデルを作成する関数
+_llm_backends: Dict[str, Callable[[str, float], Any]] = {"mock": _create_mock_llm}
+
+
+def register_llm_backend(name: str, factory: Callable[[str, float], Any]):
+    """LLMバックエンドを登録する（LLM_BACKEND=name で選択できるようになる）"""
+    _llm_backends[name] = factory
+
+
+def get_llm_backend() -> str:
+    """
+    環境変数から使用するLLMバックエンドを取得
+
+    LLM_BACKENDが未設定の場合、USE_MOCK_LLM=trueならmock、それ以外はvertex。
+    """
+    backend = os.getenv("LLM_BACKEND", "").lower()
+    if not backend:
+        backend = "mock" if os.getenv("USE_MOCK_LLM", "false").lower() == "true" else "vertex"
+    if backend != "vertex" and backend not in _llm_backends:
+        print(f"警告: 未知のLLM_BACKEND '{backend}' のためvertexを使用します（指定可能: vertex, {', '.join(_llm_backends)}）")
+        return "vertex"
+    return backend
+
+
 def create_vertex_ai_llm(model_name: str = "gemini-2.5-flash", temperature: float = 0.1):
     """
     Vertex AI LLMを適切に初期化する共通関数
     
+    LLM_BACKEND（またはUSE_MOCK_LLM=true）でvertex以外が選択されている場合は、
+    登録されたバックエンド（既定ではネットワーク不要のモックLLM）のチャットモデルを返す。
+
     Args:
         model_name: 使用するモデル名
         temperature: 温度パラメータ
         
     Returns:
-        初期化されたChatVertexAIインスタンス
+        初期化されたChatVertexAIインスタンス（または選択されたバックエンドのチャットモデル）
     """
+    backend = get_llm_backend()
+    if backend != "vertex":
+        return _llm_backends[backend](model_name, temperature)
+
     from langchain_google_vertexai import ChatVertexAI
 
     project_id = get_google_cloud_project()
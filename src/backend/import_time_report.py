@@ -0,0 +1,125 @@
+"""
+インポート時間レポート (import_time_report.py)
+目的: `python -X importtime` の出力を集計し、バックエンドのコールドスタート時間
+（サーバー本体と各処理モードのモジュール読み込み）をパッケージ単位で把握する。
+
+各計測は新しいPythonプロセスで行うため、キャッシュ済みモジュールの影響を受けない。
+処理モードの計測値は、サーバー本体（main）を読み込んだ後に追加で必要になる時間である。
+
+使用例:
+    python import_time_report.py --top 15
+    python import_time_report.py --modes rag_only rag_advanced --output import_time.json
+"""
+
+import argparse
+import json
+import re
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from mode_registry import MODE_MODULES
+
+BACKEND_DIR = Path(__file__).parent
+
+# "import time:       123 |        456 |   package.module" 形式の行
+IMPORT_TIME_LINE = re.compile(r"^import time:\s*(\d+)\s*\|\s*(\d+)\s*\|(\s*)(\S+)")
+
+
+def measure_imports(statement: str, baseline: Optional[str] = None) -> Dict[str, Any]:
+    """
+    新しいプロセスで -X importtime を付けてstatementを実行し、インポート時間を集計する
+
+    Args:
+        statement: 計測するPython文（例: "import main"）
+        baseline: 計測前に実行しておくPython文（この中のインポートは集計から除く）
+    """
+    code = statement if baseline is None else f"{baseline}\nimport sys\nprint('---measure---', file=sys.stderr, flush=True)\n{statement}"
+    started = time.perf_counter()
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                               cwd=BACKEND_DIR,
+                               capture_output=True,
+                               text=True,
+                               encoding="utf-8",
+                               errors="replace")
+    wall_seconds = time.perf_counter() - started
+    if completed.returncode != 0:
+        error_lines = [line for line in completed.stderr.splitlines() if not line.startswith("import time:")]
+        raise RuntimeError(f"'{statement}' の実行に失敗しました:\n" + "\n".join(error_lines[-10:]))
+
+    lines = completed.stderr.splitlines()
+    if baseline is not None and "---measure---" in lines:
+        lines = lines[lines.index("---measure---") + 1:]
+
+    total_us = 0
+    by_package: Dict[str, int] = defaultdict(int)
+    modules = 0
+    for line in lines:
+        match = IMPORT_TIME_LINE.match(line)
+        if not match:
+            continue
+        self_us = int(match.group(1))
+        name = match.group(4)
+        total_us += self_us
+        by_package[name.split(".")[0]] += self_us
+        modules += 1
+
+    return {
+        "statement": statement,
+        "modules": modules,
+        "import_seconds": round(total_us / 1e6, 3),
+        "process_wall_seconds": round(wall_seconds, 3),
+        "packages": {name: round(us / 1e6, 3) for name, us in sorted(by_package.items(), key=lambda item: -item[1])}
+    }
+
+
+def _print_result(title: str, result: Dict[str, Any], top: int):
+    print(f"\n=== {title} ===")
+    print(f"インポート時間: {result['import_seconds']}秒 ({result['modules']}モジュール), "
+          f"プロセス全体: {result['process_wall_seconds']}秒")
+    for name, seconds in list(result["packages"].items())[:top]:
+        print(f"  {seconds:8.3f}秒  {name}")
+
+
+def main():
+    """直接実行用"""
+    parser = argparse.ArgumentParser(description="バックエンドのインポート時間レポート")
+    parser.add_argument("--modes", nargs="*", default=list(MODE_MODULES), help="計測する処理モード（既定: すべて）")
+    parser.add_argument("--top", type=int, default=10, help="表示するパッケージ数")
+    parser.add_argument("--output", type=Path, help="結果をJSONで保存するパス")
+    args = parser.parse_args()
+
+    report: Dict[str, Any] = {"python": sys.version.split()[0]}
+    report["main"] = measure_imports("import main")
+    _print_result("サーバー本体 (main)", report["main"], args.top)
+
+    report["modes"] = {}
+    for mode in args.modes:
+        if mode not in MODE_MODULES:
+            print(f"警告: 未知のモード '{mode}' をスキップします")
+            continue
+        result = measure_imports(f"import {MODE_MODULES[mode]}", baseline="import main")
+        report["modes"][mode] = result
+        _print_result(f"モード {mode} ({MODE_MODULES[mode]}) の追加分", result, args.top)
+
+    summary: List[Dict[str, Any]] = [{
+        "mode": mode,
+        "cold_start_seconds": round(report["main"]["import_seconds"] + result["import_seconds"], 3)
+    } for mode, result in report["modes"].items()]
+    report["summary"] = summary
+
+    print("\n=== 初回リクエストまでのインポート時間（main + モード） ===")
+    for row in summary:
+        print(f"  {row['cold_start_seconds']:8.3f}秒  {row['mode']}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=4)
+        print(f"\n結果を保存しました: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
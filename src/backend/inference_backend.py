@@ -0,0 +1,130 @@
+"""
+埋め込みモデル・CrossEncoderの推論バックエンド選択モジュール
+INFERENCE_BACKEND=onnx を設定すると、モデルをONNXへエクスポートしてint8動的量子化し、
+ONNX Runtime（CPU）で推論する。既定はPyTorch（torch）。
+"""
+
+import os
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+BACKENDS = ("torch", "onnx")
+
+# 量子化済みONNXモデルの保存先
+ONNX_MODEL_DIR = Path(os.getenv("ONNX_MODEL_DIR", Path(__file__).parent.parent.parent / "cache" / "onnx_models"))
+
+
+def get_inference_backend() -> str:
+    """環境変数から推論バックエンドを取得"""
+    backend = os.getenv("INFERENCE_BACKEND", "torch").lower()
+    if backend not in BACKENDS:
+        print(f"警告: 未知のINFERENCE_BACKEND '{backend}' のためtorchを使用します（指定可能: {', '.join(BACKENDS)}）")
+        return "torch"
+    return backend
+
+
+def get_quantization_config() -> str:
+    """
+    int8動的量子化の命令セット設定を取得
+
+    sentence-transformersの設定名（avx2 / avx512 / avx512_vnni / arm64）を指定する。
+    """
+    return os.getenv("ONNX_QUANTIZATION", "avx2")
+
+
+def _session_options():
+    """スレッド数を調整したONNX Runtimeのセッション設定を作成"""
+    import onnxruntime
+
+    options = onnxruntime.SessionOptions()
+    options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+    # 1リクエスト内の演算並列度。ワーカープロセスを複数起動する場合は コア数/ワーカー数 程度にする
+    options.intra_op_num_threads = int(os.getenv("ONNX_INTRA_OP_THREADS", os.cpu_count() or 1))
+    options.inter_op_num_threads = int(os.getenv("ONNX_INTER_OP_THREADS", 1))
+    return options
+
+
+def _quantized_file_name(quantization_config: str) -> str:
+    return f"onnx/model_qint8_{quantization_config}.onnx"
+
+
+def export_quantized_model(model_name: str, model_class: Any, quantization_config: str) -> Path:
+    """
+    モデルをONNXへエクスポートしてint8動的量子化し、ローカルに保存する
+
+    既に量子化済みファイルがある場合は何もしない。
+
+    Args:
+        model_name: Hugging Faceのモデル名
+        model_class: SentenceTransformer または CrossEncoder
+        quantization_config: 量子化設定名
+
+    Returns:
+        量子化済みモデルを含むローカルディレクトリ
+    """
+    from sentence_transformers import export_dynamic_quantized_onnx_model
+
+    local_dir = ONNX_MODEL_DIR / model_name.replace("/", "__")
+    if (local_dir / _quantized_file_name(quantization_config)).exists():
+        return local_dir
+
+    print(f"🔧 {model_name} をONNXへエクスポートし、int8量子化しています ({quantization_config})...")
+    model = model_class(model_name, backend="onnx")
+    model.save_pretrained(str(local_dir))
+    export_dynamic_quantized_onnx_model(model, quantization_config, str(local_dir))
+    print(f"✅ 量子化済みモデルを保存しました: {local_dir}")
+    return local_dir
+
+
+def get_embedding_model_args(model_name: str, backend: Optional[str] = None) -> Tuple[str, Dict[str, Any]]:
+    """
+    SentenceTransformer / HuggingFaceEmbeddingsに渡す (モデル名またはパス, model_kwargs) を取得
+
+    onnxバックエンドの場合は量子化済みモデルのローカルパスとONNX Runtime用の設定を返す。
+
+    Args:
+        model_name: Hugging Faceのモデル名
+        backend: torch / onnx（未指定時は環境変数から取得）
+    """
+    backend = backend or get_inference_backend()
+    if backend != "onnx":
+        return model_name, {}
+
+    from sentence_transformers import SentenceTransformer
+
+    quantization_config = get_quantization_config()
+    local_dir = export_quantized_model(model_name, SentenceTransformer, quantization_config)
+    return str(local_dir), {
+        "backend": "onnx",
+        "model_kwargs": {
+            "file_name": _quantized_file_name(quantization_config),
+            "provider": "CPUExecutionProvider",
+            "session_options": _session_options()
+        }
+    }
+
+
+def load_cross_encoder(model_name: str, backend: Optional[str] = None):
+    """
+    CrossEncoderを指定バックエンドで読み込む
+
+    Args:
+        model_name: Hugging Faceのモデル名
+        backend: torch / onnx（未指定時は環境変数から取得）
+    """
+    from sentence_transformers import CrossEncoder
+
+    backend = backend or get_inference_backend()
+    if backend != "onnx":
+        return CrossEncoder(model_name)
+
+    quantization_config = get_quantization_config()
+    local_dir = export_quantized_model(model_name, CrossEncoder, quantization_config)
+    return CrossEncoder(str(local_dir),
+                        backend="onnx",
+                        model_kwargs={
+                            "file_name": _quantized_file_name(quantization_config),
+                            "provider": "CPUExecutionProvider",
+                            "session_options": _session_options()
+                        })
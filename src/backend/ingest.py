@@ -0,0 +1,210 @@
+"""
+ディレクトリ型ナレッジベースの並列取り込みパイプライン (ingest.py)
+目的: ディレクトリ配下の多数のファイルをセクション単位でストリーミング読み込みし、
+チャンク分割と埋め込みをプロセスプールで並列実行してチャンクストアとインデックスを構築する。
+
+使用例:
+    python ingest.py ../../data/manuals --workers 4 --section-batch 32 --embed-batch 64
+"""
+
+import argparse
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+from chunk_store import CHUNK_STORE_DIR, ChunkStoreWriter, prune_buffers
+from chunker import DEFAULT_CHUNK_CONFIG, Chunk, ChunkConfig, chunk_text, config_key
+from knowledge_base import get_knowledge_version, iter_file_sections, iter_knowledge_files
+from vector_index import (IncrementalIndexBuilder, IndexConfig, RetrievalIndex, get_embeddings, get_index_config)
+
+# (元ファイルパス, ファイル内セクション番号, セクション開始文字オフセット, セクションテキスト)
+SectionItem = Tuple[str, int, int, str]
+
+
+def get_ingest_settings() -> Tuple[int, int, int]:
+    """環境変数から (ワーカー数, タスクあたりのセクション数, 埋め込みバッチサイズ) を取得"""
+    workers = int(os.getenv("INGEST_WORKERS", min(4, os.cpu_count() or 1)))
+    section_batch = int(os.getenv("INGEST_SECTION_BATCH", 32))
+    embed_batch = int(os.getenv("INGEST_EMBED_BATCH", 64))
+    return workers, section_batch, embed_batch
+
+
+def _init_worker(workers: int):
+    """ワーカープロセスの初期化：スレッド数をコア数/ワーカー数に抑え、埋め込みモデルを読み込む"""
+    try:
+        import torch
+        torch.set_num_threads(max(1, (os.cpu_count() or 1) // max(1, workers)))
+    except ImportError:
+        pass
+    get_embeddings()
+
+
+def _chunk_and_embed(items: List[SectionItem], config: ChunkConfig,
+                     embed_batch: int) -> Tuple[List[Tuple[str, Chunk]], np.ndarray]:
+    """セクション群をチャンク分割して埋め込む（ワーカープロセスで実行）"""
+    records = []
+    for source, section_index, offset, text in items:
+        for chunk in chunk_text(text, config):
+            # セクション内のオフセットをファイル全体のオフセットに変換
+            records.append((source,
+                            chunk._replace(start=chunk.start + offset,
+                                           end=chunk.end + offset,
+                                           section_index=section_index)))
+
+    embeddings = get_embeddings()
+    batches = []
+    for batch_start in range(0, len(records), embed_batch):
+        texts = [chunk.text for _, chunk in records[batch_start:batch_start + embed_batch]]
+        batches.append(np.asarray(embeddings.embed_documents(texts), dtype="float32"))
+    vectors = np.concatenate(batches) if batches else np.zeros((0, 0), dtype="float32")
+    return records, vectors
+
+
+def _iter_section_batches(knowledge_dir: Path, section_batch: int) -> Iterator[List[SectionItem]]:
+    """ファイルをストリーミングで読み、セクションをタスク単位にまとめて返す"""
+    batch: List[SectionItem] = []
+    for file_path in iter_knowledge_files(knowledge_dir):
+        source = str(file_path)
+        for section_index, (offset, text) in enumerate(iter_file_sections(file_path)):
+            batch.append((source, section_index, offset, text))
+            if len(batch) >= section_batch:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def peak_rss_mb() -> Optional[float]:
+    """プロセスのピークRSS（MB）を取得（取得できない環境ではNone）"""
+    try:
+        import resource
+        import sys
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # macOSはバイト、Linuxはキロバイト単位
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    except ImportError:
+        return None
+
+
+def ingest_directory(knowledge_dir: Path,
+                     config: ChunkConfig = DEFAULT_CHUNK_CONFIG,
+                     index_config: Optional[IndexConfig] = None,
+                     workers: Optional[int] = None,
+                     section_batch: Optional[int] = None,
+                     embed_batch: Optional[int] = None) -> RetrievalIndex:
+    """
+    ディレクトリ配下のナレッジファイルを取り込み、検索インデックスを構築する
+
+    親プロセスはファイルをセクション単位で読みながらタスクを投入し、結果を投入順に
+    チャンクストアへ追記する。同時に処理中のタスク数を制限するため、取り込むファイル数が
+    増えても親プロセスが保持するテキストは一定量に抑えられる。
+
+    Args:
+        knowledge_dir: ナレッジディレクトリ
+        config: チャンク分割設定
+        index_config: FAISSインデックス設定（未指定時は環境変数から取得）
+        workers: ワーカープロセス数（0の場合は親プロセスで逐次処理）
+        section_batch: 1タスクにまとめるセクション数
+        embed_batch: 埋め込みのバッチサイズ
+
+    Returns:
+        構築した検索インデックス（ingest_statsに取り込み統計を含む）
+    """
+    default_workers, default_section_batch, default_embed_batch = get_ingest_settings()
+    workers = default_workers if workers is None else workers
+    section_batch = section_batch or default_section_batch
+    embed_batch = embed_batch or default_embed_batch
+    index_config = index_config or get_index_config()
+
+    started = time.perf_counter()
+    version = get_knowledge_version(knowledge_dir)
+    writer = ChunkStoreWriter(CHUNK_STORE_DIR / f"{version}-{config_key(config)}.utf8")
+    index_builder = IncrementalIndexBuilder(index_config)
+    source_ids = {}
+    dimension = 0
+
+    def consume(result: Tuple[List[Tuple[str, Chunk]], np.ndarray]):
+        nonlocal dimension
+        records, vectors = result
+        for source, chunk in records:
+            source_id = source_ids.get(source)
+            if source_id is None:
+                source_id = source_ids[source] = writer.add_source(source)
+            writer.add(chunk, source_id)
+        if len(vectors):
+            dimension = vectors.shape[1]
+            index_builder.add(vectors)
+
+    print(f"📥 ナレッジディレクトリを取り込み中: {knowledge_dir} (ワーカー数: {workers})")
+    if workers > 0:
+        max_in_flight = workers * 2
+        pending: deque = deque()
+        # サーバー（スレッド・torchを読み込み済み）から呼ばれるため、forkではなくspawnでワーカーを起動する
+        with ProcessPoolExecutor(max_workers=workers,
+                                 mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_init_worker,
+                                 initargs=(workers,)) as executor:
+            for batch in _iter_section_batches(knowledge_dir, section_batch):
+                if len(pending) >= max_in_flight:
+                    consume(pending.popleft().result())
+                future: Future = executor.submit(_chunk_and_embed, batch, config, embed_batch)
+                pending.append(future)
+            while pending:
+                consume(pending.popleft().result())
+    else:
+        for batch in _iter_section_batches(knowledge_dir, section_batch):
+            consume(_chunk_and_embed(batch, config, embed_batch))
+
+    store = writer.finish(version)
+    prune_buffers(config, store.buffer_path)
+    if not dimension:
+        dimension = len(get_embeddings().embed_query(""))
+    index, resolved_config = index_builder.finish(dimension)
+
+    elapsed = time.perf_counter() - started
+    stats = {
+        "files": len(source_ids),
+        "chunks": len(store),
+        "seconds": round(elapsed, 3),
+        "chunks_per_second": round(len(store) / elapsed, 1) if elapsed > 0 else 0.0,
+        "workers": workers,
+        "section_batch": section_batch,
+        "embed_batch": embed_batch,
+        "index_type": resolved_config.index_type,
+        "peak_rss_mb": peak_rss_mb()
+    }
+    print(f"✅ 取り込み完了: {stats['files']}ファイル / {stats['chunks']}チャンク / "
+          f"{stats['seconds']}秒 ({stats['chunks_per_second']} chunks/s)")
+    return RetrievalIndex(store, index, resolved_config, ingest_stats=stats)
+
+
+def main():
+    """直接実行用"""
+    parser = argparse.ArgumentParser(description="ナレッジディレクトリの並列取り込み")
+    parser.add_argument("knowledge_dir", type=Path)
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--section-batch", type=int)
+    parser.add_argument("--embed-batch", type=int)
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_CONFIG.chunk_size)
+    parser.add_argument("--chunk-overlap", type=int, default=DEFAULT_CHUNK_CONFIG.chunk_overlap)
+    args = parser.parse_args()
+
+    config = DEFAULT_CHUNK_CONFIG._replace(chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap)
+    retrieval_index = ingest_directory(args.knowledge_dir,
+                                       config,
+                                       workers=args.workers,
+                                       section_batch=args.section_batch,
+                                       embed_batch=args.embed_batch)
+
+    print("=== 取り込み統計 ===")
+    for key, value in retrieval_index.ingest_stats.items():
+        print(f"{key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""
+ナレッジベース読み込み用のユーティリティモジュール
+ナレッジファイルの内容とバージョン（内容ハッシュ）をキャッシュし、`## ` 見出し単位のセクション構造を提供する
+エラーコード・安全規定番号などの識別子の抽出も、全処理モードで共通のこのモジュールで行う
+"""
+
+import hashlib
+import os
+import re
+import threading
+import time
+import unicodedata
+from pathlib import Path
+from typing import Dict, Iterator, List, NamedTuple, Tuple
+
+SECTION_PREFIX = "## "
+
+# ディレクトリ型ナレッジベースで読み込むファイルの拡張子
+KNOWLEDGE_FILE_SUFFIXES = (".txt", ".md")
+
+
+class Section(NamedTuple):
+    """`## ` 見出しで区切られたセクション"""
+    title: str
+    start: int  # ナレッジ全体における開始文字オフセット
+    end: int  # ナレッジ全体における終了文字オフセット（排他的）
+    text: str
+
+
+# 英字で始まり、ハイフン・アンダースコアで英数字が続く識別子（E-101、S-01、CoolFlow-W3、SET_WELD など）
+_IDENTIFIER_RE = re.compile(r"[A-Za-z][A-Za-z0-9]*(?:[-_][A-Za-z0-9]+)+")
+
+# パス -> ((mtime_ns, size), 内容, バージョン)
+_content_cache: Dict[str, Tuple[Tuple[int, int], str, str]] = {}
+_cache_lock = threading.Lock()
+
+# ディレクトリのパス -> (計算した時刻, バージョン)
+_directory_version_cache: Dict[str, Tuple[float, str]] = {}
+
+
+def compute_version(content: str) -> str:
+    """ナレッジ内容からバージョン文字列（SHA-256の先頭16桁）を計算"""
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()[:16]
+
+
+def load_knowledge(knowledge_path: Path) -> Tuple[str, str]:
+    """
+    ナレッジファイルを読み込む
+
+    ファイルのmtimeとサイズが変わらない限り、読み込み結果とバージョンを再利用する。
+
+    Args:
+        knowledge_path: ナレッジファイルのパス
+
+    Returns:
+        (ナレッジ内容, バージョン文字列)
+    """
+    path = Path(knowledge_path)
+    stat = path.stat()
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    key = str(path.resolve())
+
+    cached = _content_cache.get(key)
+    if cached is not None and cached[0] == stamp:
+        return cached[1], cached[2]
+
+    with open(path, "r", encoding="utf-8") as f:
+        content = f.read()
+    version = compute_version(content)
+
+    with _cache_lock:
+        _content_cache[key] = (stamp, content, version)
+    return content, version
+
+
+def iter_knowledge_files(knowledge_dir: Path) -> Iterator[Path]:
+    """ディレクトリ配下のナレッジファイルをパス順に列挙"""
+    for path in sorted(Path(knowledge_dir).rglob("*")):
+        if path.is_file() and path.suffix.lower() in KNOWLEDGE_FILE_SUFFIXES:
+            yield path
+
+
+def get_knowledge_version(knowledge_path: Path) -> str:
+    """
+    ナレッジの現在のバージョンを取得
+
+    ファイルの場合は内容ハッシュ、ディレクトリの場合は配下ファイルの
+    (相対パス, サイズ, mtime) から計算する（ディレクトリ全体は読み込まない）。
+    ディレクトリの変更は最大でKNOWLEDGE_DIR_VERSION_TTL秒遅れて反映される。
+    """
+    path = Path(knowledge_path)
+    if not path.is_dir():
+        return load_knowledge(path)[1]
+
+    # 配下の全ファイルのstatはリクエストごとに行うには重いため、KNOWLEDGE_DIR_VERSION_TTL秒だけ結果を再利用する
+    key = str(path.resolve())
+    ttl = float(os.getenv("KNOWLEDGE_DIR_VERSION_TTL", 2.0))
+    cached = _directory_version_cache.get(key)
+    if cached is not None and time.monotonic() - cached[0] < ttl:
+        return cached[1]
+
+    version = _compute_directory_version(path)
+    with _cache_lock:
+        _directory_version_cache[key] = (time.monotonic(), version)
+    return version
+
+
+def _compute_directory_version(path: Path) -> str:
+    """ディレクトリ配下のファイルの (相対パス, サイズ, mtime) からバージョンを計算"""
+    digest = hashlib.sha256()
+    for file_path in iter_knowledge_files(path):
+        stat = file_path.stat()
+        digest.update(f"{file_path.relative_to(path).as_posix()}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def iter_file_sections(file_path: Path) -> Iterator[Tuple[int, str]]:
+    """
+    ファイルを1行ずつ読み、`## ` 見出し単位で (開始文字オフセット, セクションテキスト) を返す
+
+    ファイル全体をメモリに載せないため、巨大なファイルでも1セクション分のメモリで処理できる。
+    """
+    offset = 0
+    section_start = 0
+    lines: List[str] = []
+    with open(file_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.startswith(SECTION_PREFIX) and lines:
+                yield section_start, "".join(lines)
+                lines = []
+                section_start = offset
+            lines.append(line)
+            offset += len(line)
+    if lines:
+        yield section_start, "".join(lines)
+
+
+def split_sections(content: str) -> List[Section]:
+    """
+    ナレッジ内容を `## ` 見出し単位のセクションに分割する
+
+    最初の `## ` より前の部分（文書タイトルなど）は、空でなければ先頭セクションとして扱う。
+    `### ` 以下の小見出しは親セクションに含める。
+
+    Args:
+        content: ナレッジ内容
+
+    Returns:
+        文書順のセクションリスト
+    """
+    # 行頭の `## ` の位置を1回の走査で収集
+    starts = []
+    pos = 0
+    length = len(content)
+    while pos < length:
+        if content.startswith(SECTION_PREFIX, pos):
+            starts.append(pos)
+        newline = content.find("\n", pos)
+        if newline == -1:
+            break
+        pos = newline + 1
+
+    boundaries = [0] + starts if not starts or starts[0] != 0 else starts
+    sections = []
+    for i, start in enumerate(boundaries):
+        end = boundaries[i + 1] if i + 1 < len(boundaries) else length
+        text = content[start:end]
+        if not text.strip():
+            continue
+        first_line = text.split("\n", 1)[0]
+        if first_line.startswith(SECTION_PREFIX):
+            title = first_line[len(SECTION_PREFIX):].strip()
+        else:
+            title = first_line.lstrip("#").strip()
+        sections.append(Section(title=title, start=start, end=end, text=text))
+    return sections
+
+
+def extract_identifiers(text: str) -> List[str]:
+    """
+    テキスト中のエラーコード・安全規定番号・型番などの識別子を出現順に抽出する
+
+    全角英数字は半角に正規化し、数字または `_` を含むものだけを識別子とする（ハイフンを含む英単語は除く）。
+    処理モードによって識別子の扱いが変わらないよう、識別子の検出はすべてこの関数で行う。
+    """
+    identifiers = _IDENTIFIER_RE.findall(unicodedata.normalize("NFKC", text))
+    return list(dict.fromkeys(
+        identifier for identifier in identifiers if "_" in identifier or any(c.isdigit() for c in identifier)))
+
+
+def contains_identifier(text: str, identifier: str) -> bool:
+    """テキストが識別子を単独のトークンとして含むか（E-40はE-404に一致しない。英字の大小は区別しない）"""
+    pattern = rf"(?<![A-Za-z0-9]){re.escape(identifier)}(?![A-Za-z0-9])"
+    return re.search(pattern, unicodedata.normalize("NFKC", text), re.IGNORECASE) is not None
@@ -7,27 +7,38 @@ import json
 import logging
 import os
 import time
+from contextlib import asynccontextmanager, nullcontext
 from datetime import datetime
 from enum import Enum
 from pathlib import Path
-from typing import Dict, List, Optional
+from types import ModuleType
+from typing import Dict, Hashable, List, Optional, Tuple
 
 import structlog
-import tiktoken
 import uvicorn
-from env_utils import (check_google_cloud_auth, get_google_cloud_project, setup_environment)
+from adaptive_pipeline import get_adaptive_stats
+from admission import AdmissionRejected, get_admission_controller
+from auth_status import get_auth_status_cache
+from deadline import (DEGRADED_CONTEXT_TOKENS, DeadlineExceeded, current_deadline, get_default_timeout,
+                      remaining_seconds, should_degrade, start_deadline)
+from env_utils import (get_google_cloud_project, setup_environment)
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse, Response
+from knowledge_base import get_knowledge_version
 from logger_config import setup_logging
-from pydantic import BaseModel
-from run_function_calling_only import process_function_calling_only
-# 各処理モジュールをインポート
-from run_llm_only import process_llm_only
-from run_prompt_stuffing import process_prompt_stuffing
-from run_rag_advanced import process_rag_advanced
-from run_rag_only import process_rag_only
-from run_rag_plus_fancall import process_rag_plus_function_calling
+from metrics import (CONTENT_TYPE_LATEST, ERRORS, IN_FLIGHT, REQUEST_LATENCY, REQUESTS, TOKENS, mark_worker_exit,
+                     render_metrics, start_request)
+# 各処理モジュールは重い依存を含むため、モードごとに初回利用時に読み込む
+from mode_registry import (ModeDisabledError, get_enabled_modes, get_mode_module, get_mode_status)
+from profiling import RequestProfiler, find_profile, should_profile
+from pydantic import BaseModel, Field
+from query_embedder import get_query_embedder
+from router import get_router_stats, route_query
+from singleflight import get_single_flight, is_single_flight_enabled, normalize_query
+from token_utils import count_tokens
+from tool_cache import get_tool_result_cache
+from warmup import readiness, warm_up_modes
 
 # 環境変数を読み込み
 setup_environment()
@@ -46,7 +57,24 @@ if not project_id:
 setup_logging()
 logger = structlog.get_logger()
 
-app = FastAPI(title="RAG比較システム API", description="LLMに外部情報を与える5つの手法を比較するシステム", version="1.0.0")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """起動時に有効なモードのウォームアップをバックグラウンドで開始する（ライブネスは即座に応答可能）"""
+    # 認証状況の初回確認もバックグラウンドで開始しておく
+    get_auth_status_cache().refresh_in_background()
+    modes = get_enabled_modes()
+    warmup_task = asyncio.create_task(
+        warm_up_modes(modes, {mode: get_knowledge_path(mode) for mode in modes}, run_warmup_query))
+    yield
+    warmup_task.cancel()
+    mark_worker_exit()
+
+
+app = FastAPI(title="RAG比較システム API",
+              description="LLMに外部情報を与える5つの手法を比較するシステム",
+              version="1.0.0",
+              lifespan=lifespan)
 
 # CORS設定
 app.add_middleware(
@@ -66,6 +94,9 @@ LOGS_DIR = BASE_DIR / "logs"
 DATA_DIR.mkdir(exist_ok=True)
 LOGS_DIR.mkdir(exist_ok=True)
 
+# RAG系モードの検索対象（KNOWLEDGE_DIRを設定するとディレクトリ配下の全ファイルを取り込む）
+RAG_KNOWLEDGE_SOURCE = Path(os.environ["KNOWLEDGE_DIR"]) if os.getenv("KNOWLEDGE_DIR") else DATA_DIR / "knowledge.txt"
+
 
 class ProcessingMode(str, Enum):
     LLM_ONLY = "llm_only"
@@ -74,12 +105,20 @@ class ProcessingMode(str, Enum):
     RAG_ADVANCED = "rag_advanced"
     FUNCTION_CALLING = "function_calling"
     RAG_FUNCTION_CALLING = "rag_function_calling"
+    # 質問の意図から、回答に十分な最も安価なモードを自動で選ぶ
+    AUTO = "auto"
 
 
 class ProcessRequest(BaseModel):
     query: str
     mode: ProcessingMode
     demo_mode: bool = False
+    # プロンプトスタッフィング時のナレッジ部分のトークン上限（未指定時は全文を埋め込む）
+    max_context_tokens: Optional[int] = Field(default=None, gt=0)
+    # プロファイルを取得する（ENABLE_PROFILING=trueの場合のみ有効）
+    profile: bool = False
+    # 処理の期限（秒）。未指定時はモードごとの既定値（REQUEST_TIMEOUTS）
+    timeout_seconds: Optional[float] = Field(default=None, gt=0, le=600)
 
 
 class ProcessResponse(BaseModel):
@@ -90,6 +129,14 @@ class ProcessResponse(BaseModel):
     total_tokens: int
     intermediate_steps: List[Dict]
     log_file: str
+    profile_file: Optional[str] = None
+    # 処理中の同一リクエストの結果を共有した場合はTrue
+    coalesced: bool = False
+    # 処理の期限（秒）と、残り時間が不足したために行った縮退
+    timeout_seconds: Optional[float] = None
+    degradations: List[Dict] = []
+    # autoモードで選んだ処理モードと選択理由
+    route: Optional[Dict] = None
 
 
 class StatusResponse(BaseModel):
@@ -103,22 +150,24 @@ class KnowledgeContent(BaseModel):
     content: str
 
 
-# トークンカウンター
-def count_tokens(text: str, model: str = "gpt-3.5-turbo") -> int:
-    """テキストのトークン数をカウント"""
-    try:
-        encoding = tiktoken.encoding_for_model(model)
-        return len(encoding.encode(text))
-    except:
-        # フォールバック: 文字数の1/4を概算トークン数とする
-        return len(text) // 4
-
-
 @app.get("/")
 async def root():
     return {"message": "RAG比較システム API", "version": "1.0.0"}
 
 
+@app.get("/health/live")
+async def health_live():
+    """ライブネス：プロセスが応答可能であれば常に200"""
+    return {"status": "alive"}
+
+
+@app.get("/health/ready")
+async def health_ready():
+    """レディネス：有効な全モードのモデル・インデックス・LLMクライアントの初期化とウォームアップが完了していれば200"""
+    state = readiness.to_dict()
+    return JSONResponse(status_code=200 if state["ready"] else 503, content=state)
+
+
 @app.get("/knowledge", response_class=FileResponse)
 async def get_knowledge_file():
     """knowledge.txtファイルをダウンロード"""
@@ -177,13 +226,132 @@ async def update_knowledge_content(request: KnowledgeContent):
             f.write(request.content)
 
         logger.info("Knowledge content updated", size=len(request.content))
-        return {"message": "Knowledge content updated successfully"}
+        response = {"message": "Knowledge content updated successfully"}
+
+        # SHARED_INDEX=trueの場合、RAG系モードは公開済みのスナップショットを参照するため、更新後の内容を公開し直す
+        if os.getenv("SHARED_INDEX", "false").lower() == "true" and RAG_KNOWLEDGE_SOURCE == knowledge_path:
+            from shared_index import publish_all
+            try:
+                snapshots = await asyncio.to_thread(publish_all, knowledge_path)
+                logger.info("Shared index republished", snapshots=[str(path) for path in snapshots])
+                response["shared_index"] = {"published": [path.name for path in snapshots]}
+            except Exception as e:
+                logger.error("Failed to republish shared index", error=str(e))
+                response["shared_index"] = {
+                    "published": [],
+                    "warning": "共有インデックスの公開に失敗したため、RAG系モードは更新前の内容で回答します。"
+                               f"python shared_index.py publish を実行してください（{e}）"
+                }
+        return response
 
     except Exception as e:
         logger.error("Failed to update knowledge content", error=str(e))
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def run_mode(module: ModuleType, request: ProcessRequest) -> Dict:
+    """処理モードの実装モジュールでリクエストを処理する（/processと起動時ウォームアップで共通）"""
+    if request.mode == ProcessingMode.LLM_ONLY:
+        return await module.process_llm_only(request.query, demo_mode=request.demo_mode)
+
+    elif request.mode == ProcessingMode.PROMPT_STUFFING:
+        max_context_tokens = request.max_context_tokens
+        # 残り時間が少ない場合は、ナレッジ全文ではなく質問に関連するセクションだけを埋め込む
+        if (max_context_tokens is None or max_context_tokens > DEGRADED_CONTEXT_TOKENS) and should_degrade(
+                "shrink_context", f"ナレッジを{DEGRADED_CONTEXT_TOKENS}トークン以内に制限"):
+            max_context_tokens = DEGRADED_CONTEXT_TOKENS
+
+        if max_context_tokens:
+            return await module.process_prompt_stuffing_budgeted(request.query,
+                                                                 DATA_DIR / "knowledge.txt",
+                                                                 max_context_tokens=max_context_tokens,
+                                                                 demo_mode=request.demo_mode)
+        return await module.process_prompt_stuffing(request.query,
+                                                    DATA_DIR / "knowledge.txt",
+                                                    demo_mode=request.demo_mode)
+
+    elif request.mode == ProcessingMode.RAG_ONLY:
+        return await module.process_rag_only(request.query,
+                                             RAG_KNOWLEDGE_SOURCE,
+                                             demo_mode=request.demo_mode)
+
+    elif request.mode == ProcessingMode.RAG_ADVANCED:
+        return await module.process_rag_advanced(
+            request.query,
+            RAG_KNOWLEDGE_SOURCE,
+            demo_mode=request.demo_mode,
+            # ADAPTIVE_RAG_ENABLED=true（既定）の場合、1回目の検索で答えが明らかなら以下を省略する
+            enable_query_expansion=True,  # クエリ拡張を有効化（差別化要因）
+            enable_reranking=True)  # 再ランキングは有効（これが差別化要因）
+
+    elif request.mode == ProcessingMode.FUNCTION_CALLING:
+        return await module.process_function_calling_only(request.query, demo_mode=request.demo_mode)
+
+    elif request.mode == ProcessingMode.RAG_FUNCTION_CALLING:
+        return await module.process_rag_plus_function_calling(request.query,
+                                                              RAG_KNOWLEDGE_SOURCE,
+                                                              demo_mode=request.demo_mode)
+
+    else:
+        raise ValueError(f"Unknown processing mode: {request.mode}")
+
+
+def get_knowledge_path(mode: str) -> Path:
+    """モードが参照するナレッジのパス"""
+    if mode in (ProcessingMode.LLM_ONLY, ProcessingMode.PROMPT_STUFFING, ProcessingMode.FUNCTION_CALLING):
+        return DATA_DIR / "knowledge.txt"
+    return RAG_KNOWLEDGE_SOURCE
+
+
+async def run_warmup_query(mode: str, query: str) -> Dict:
+    """ウォームアップ用の合成クエリを通常のリクエストと同じ経路で処理する"""
+    request = ProcessRequest(query=query, mode=ProcessingMode(mode))
+    start_request(mode)
+    return await run_mode(get_mode_module(mode), request)
+
+
+async def get_single_flight_key(request: ProcessRequest, profiler: Optional[RequestProfiler],
+                                budget_seconds: float) -> Optional[Hashable]:
+    """
+    相乗りの判定キー（正規化したクエリ・モード・ナレッジのバージョン・期限など）。相乗りしない場合はNone
+
+    期限（秒）が同じリクエストだけを相乗りさせる。後から来たリクエストの期限はリーダーより後になるため、
+    リーダーの期限で打ち切った結果（縮退・504）をそれより長い期限のリクエストに返すことはない。
+    """
+    # プロファイル取得時はそのリクエスト自身の処理を記録する必要があるため相乗りしない
+    if profiler is not None or not is_single_flight_enabled():
+        return None
+    # ナレッジが更新された後のリクエストは、更新前のナレッジで処理中の結果を共有しない
+    version = await asyncio.to_thread(get_knowledge_version, get_knowledge_path(request.mode))
+    return (normalize_query(request.query), request.mode.value, version, request.demo_mode, request.max_context_tokens,
+            budget_seconds)
+
+
+async def run_admitted(module: ModuleType, request: ProcessRequest,
+                       profiler: Optional[RequestProfiler]) -> Tuple[Dict, float, List[Dict]]:
+    """
+    受付制御の処理枠を確保して処理モードを実行する
+
+    Returns:
+        (処理結果, 処理枠の空きを待った秒数, 期限に応じて行った縮退)
+
+    Raises:
+        AdmissionRejected: 待ち行列が満杯、または待ち時間が上限を超えた場合
+    """
+    # モードごとの処理枠を確保（満杯なら待ち行列で待ち、待てない場合は即座に拒否）
+    limiter = get_admission_controller().limiter(request.mode.value)
+    queue_wait = await limiter.acquire(timeout=remaining_seconds())
+    service_started = time.perf_counter()
+    try:
+        with profiler or nullcontext():
+            result = await run_mode(module, request)
+    finally:
+        limiter.release(time.perf_counter() - service_started)
+    # 相乗りしたリクエストにも、実際に処理したリクエストの期限で行った縮退を返す
+    deadline = current_deadline()
+    return result, queue_wait, list(deadline.degradations) if deadline else []
+
+
 @app.post("/process", response_model=ProcessResponse)
 async def process_query(request: ProcessRequest):
     """クエリを処理して結果を返す"""
@@ -194,48 +362,50 @@ async def process_query(request: ProcessRequest):
     log_filename = f"{timestamp}_llm-rag-exp.jsonl"
     log_path = LOGS_DIR / log_filename
 
+    # autoモード：質問の意図から処理モードを選び、以降は選んだモードとして処理する（LLMは呼び出さない）
+    route = None
+    if request.mode == ProcessingMode.AUTO:
+        route = route_query(request.query, get_enabled_modes())._asdict()
+        request = request.model_copy(update={"mode": ProcessingMode(route["mode"])})
+
     # 入力トークン数計算
     input_tokens = count_tokens(request.query)
 
     logger.info("Processing started",
                 query=request.query,
                 mode=request.mode,
+                route=route,
                 demo_mode=request.demo_mode,
                 input_tokens=input_tokens)
 
     try:
-        # 各処理モードに応じて処理を実行
-        if request.mode == ProcessingMode.LLM_ONLY:
-            result = await process_llm_only(request.query, demo_mode=request.demo_mode)
-
-        elif request.mode == ProcessingMode.PROMPT_STUFFING:
-            result = await process_prompt_stuffing(request.query,
-                                                   DATA_DIR / "knowledge.txt",
-                                                   demo_mode=request.demo_mode)
-
-        elif request.mode == ProcessingMode.RAG_ONLY:
-            result = await process_rag_only(request.query,
-                                            DATA_DIR / "knowledge.txt",
-                                            demo_mode=request.demo_mode)
-
-        elif request.mode == ProcessingMode.RAG_ADVANCED:
-            result = await process_rag_advanced(
-                request.query,
-                DATA_DIR / "knowledge.txt",
-                demo_mode=request.demo_mode,
-                enable_query_expansion=True,  # クエリ拡張を有効化（差別化要因）
-                enable_reranking=True)  # 再ランキングは有効（これが差別化要因）
-
-        elif request.mode == ProcessingMode.FUNCTION_CALLING:
-            result = await process_function_calling_only(request.query, demo_mode=request.demo_mode)
-
-        elif request.mode == ProcessingMode.RAG_FUNCTION_CALLING:
-            result = await process_rag_plus_function_calling(request.query,
-                                                             DATA_DIR / "knowledge.txt",
-                                                             demo_mode=request.demo_mode)
-
+        # モードの実装モジュールを取得（初回のみインポート。重いインポートでイベントループを止めないようスレッドで実行）
+        module = await asyncio.to_thread(get_mode_module, request.mode.value)
+    except ModeDisabledError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    mode = request.mode.value
+    stage_timings = start_request(mode)
+    started = time.perf_counter()
+    # 処理の期限（受付制御の待ち時間を含めて、以降の全段階に伝播する）
+    deadline = start_deadline(request.timeout_seconds or get_default_timeout(mode))
+
+    # プロファイリング（無効時はNoneで、処理への影響はない）
+    profiler = RequestProfiler() if should_profile(request.profile) else None
+    IN_FLIGHT.labels(mode=mode).inc()
+    coalesced = False
+    try:
+        # 各処理モードに応じて処理を実行（処理中の同一リクエストがあれば、その結果を共有する）
+        key = await get_single_flight_key(request, profiler, deadline.budget_seconds)
+        if key is None:
+            result, queue_wait, degradations = await deadline.run(run_admitted(module, request, profiler))
         else:
-            raise ValueError(f"Unknown processing mode: {request.mode}")
+            single_flight = get_single_flight()
+            coalesced = single_flight.is_in_flight(key)
+            # 期限は共有する処理の内側で適用する（期限を過ぎたら処理ごと打ち切り、処理枠を解放する）。
+            # 相乗りしたリクエストは期限が同じでリーダーより後に始まるため、リーダーの期限までに必ず結果を受け取れる
+            result, queue_wait, degradations = await single_flight.do(
+                key, lambda: deadline.run(run_admitted(module, request, profiler)), mode=mode)
 
         execution_time = time.time() - start_time
 
@@ -245,6 +415,9 @@ async def process_query(request: ProcessRequest):
         output_tokens = count_tokens(result["response"])
         total_tokens = input_tokens + output_tokens
 
+        # プロファイルをログファイルの隣に保存
+        profile_file = profiler.save(log_path) if profiler else None
+
         # ログ出力（詳細な情報を含む）
         log_entry = {
             "timestamp": datetime.now().isoformat(),
@@ -257,15 +430,33 @@ async def process_query(request: ProcessRequest):
             "total_tokens": total_tokens,
             "execution_time": execution_time,
             "intermediate_steps": result.get("intermediate_steps", []),
+            # 段階ごとの処理時間（単調増加クロックで計測）
+            "stage_timings_ms": {stage: round(seconds * 1000, 1) for stage, seconds in stage_timings.items()},
+            # 受付制御の待ち行列で処理枠の空きを待った時間（相乗りした場合は共有元の値）
+            "queue_wait_ms": round(queue_wait * 1000, 1),
+            # 処理中の同一リクエストの結果を共有したか（共有した場合、段階ごとの処理時間は記録されない）
+            "coalesced": coalesced,
+            # 処理の期限と、残り時間が不足したために行った縮退
+            "timeout_seconds": deadline.budget_seconds,
+            "degradations": degradations,
+            # autoモードで選んだ処理モードと選択理由
+            "route": route,
+            "profile_file": profile_file,
             "demo_mode": request.demo_mode,
             "status": "success",
             "error_message": None
         }
+        if profiler and profiler.skipped_reason:
+            log_entry["profile_skipped"] = profiler.skipped_reason
 
         # JSONLファイルに保存（インデント付きで見やすく）
         with open(log_path, "w", encoding="utf-8") as f:
             f.write(json.dumps(log_entry, ensure_ascii=False, indent=4) + "\n")
 
+        REQUESTS.labels(mode=mode, status="success").inc()
+        TOKENS.labels(mode=mode, direction="input").inc(input_tokens)
+        TOKENS.labels(mode=mode, direction="output").inc(output_tokens)
+
         logger.info("Processing completed",
                     execution_time=execution_time,
                     output_tokens=output_tokens,
@@ -277,11 +468,29 @@ async def process_query(request: ProcessRequest):
                                output_tokens=output_tokens,
                                total_tokens=total_tokens,
                                intermediate_steps=result.get("intermediate_steps", []),
-                               log_file=log_filename)
+                               log_file=log_filename,
+                               profile_file=profile_file,
+                               coalesced=coalesced,
+                               timeout_seconds=deadline.budget_seconds,
+                               degradations=degradations,
+                               route=route)
+
+    except AdmissionRejected as e:
+        REQUESTS.labels(mode=mode, status="rejected").inc()
+        logger.warning("Request rejected by admission control", mode=mode, reason=e.reason, retry_after=e.retry_after)
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers={"Retry-After": str(e.retry_after)})
 
     except Exception as e:
         error_message = str(e)
         execution_time = time.time() - start_time
+        REQUESTS.labels(mode=mode, status="timeout" if isinstance(e, DeadlineExceeded) else "error").inc()
+        ERRORS.labels(mode=mode, error_type=type(e).__name__).inc()
+
+        error_log_filename = f"{timestamp}_{request.mode.value}-error.jsonl"
+        error_log_path = LOGS_DIR / error_log_filename
+
+        # エラー時もプロファイルを保存（どこで時間を使って失敗したかを確認できる）
+        profile_file = profiler.save(error_log_path) if profiler else None
 
         # エラーログを記録
         error_log_entry = {
@@ -295,19 +504,25 @@ async def process_query(request: ProcessRequest):
             "total_tokens": input_tokens,
             "execution_time": execution_time,
             "intermediate_steps": [],
+            "profile_file": profile_file,
+            "coalesced": coalesced,
+            "timeout_seconds": deadline.budget_seconds,
+            "degradations": e.degradations if isinstance(e, DeadlineExceeded) else list(deadline.degradations),
+            "route": route,
             "demo_mode": request.demo_mode,
             "status": "error",
             "error_message": error_message
         }
 
         # エラーログもファイルに保存（インデント付き）
-        error_log_filename = f"{timestamp}_{request.mode.value}-error.jsonl"
-        error_log_path = LOGS_DIR / error_log_filename
         with open(error_log_path, "w", encoding="utf-8") as f:
             f.write(json.dumps(error_log_entry, ensure_ascii=False, indent=4) + "\n")
 
         logger.error("Processing failed", error=error_message)
 
+        if isinstance(e, DeadlineExceeded):
+            raise HTTPException(status_code=504, detail=error_message)
+
         # Google Cloud認証関連のエラーの場合、より詳細な情報を提供
         if "DefaultCredentialsError" in error_message or "was not found" in error_message:
             detailed_error = (f"Google Cloud認証エラー: {error_message}\n\n"
@@ -322,6 +537,10 @@ async def process_query(request: ProcessRequest):
 
         raise HTTPException(status_code=500, detail=error_message)
 
+    finally:
+        IN_FLIGHT.labels(mode=mode).dec()
+        REQUEST_LATENCY.labels(mode=mode).observe(time.perf_counter() - started)
+
 
 @app.get("/logs")
 async def list_logs():
@@ -348,6 +567,8 @@ async def list_logs():
                             log_content.get("total_tokens", 0),
                         "error_message":
                             log_content.get("error_message"),
+                        "profile_file":
+                            log_content.get("profile_file"),
                         "query":
                             log_content.get("query", "")[:100] +
                             ("..." if len(log_content.get("query", "")) > 100 else "")
@@ -383,6 +604,18 @@ async def get_log_file(filename: str):
     return FileResponse(path=log_path, filename=filename, media_type="application/json")
 
 
+@app.get("/logs/{filename}/profile")
+async def get_log_profile(filename: str):
+    """ログファイルに対応するプロファイル（.html: pyinstrument / .prof: cProfile）を取得"""
+    profile_path = find_profile(LOGS_DIR / filename)
+
+    if profile_path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+
+    media_type = "text/html" if profile_path.suffix == ".html" else "application/octet-stream"
+    return FileResponse(path=profile_path, filename=profile_path.name, media_type=media_type)
+
+
 @app.delete("/logs/{filename}")
 async def delete_log_file(filename: str):
     """特定のログファイルを削除"""
@@ -392,6 +625,9 @@ async def delete_log_file(filename: str):
             raise HTTPException(status_code=404, detail="ログファイルが見つかりません")
 
         log_path.unlink()
+        profile_path = find_profile(log_path)
+        if profile_path is not None:
+            profile_path.unlink()
         logger.info(f"ログファイルを削除しました: {filename}")
         return {"message": f"ログファイル '{filename}' を削除しました"}
 
@@ -406,6 +642,9 @@ async def delete_all_logs():
     try:
         deleted_count = 0
         for log_file in LOGS_DIR.glob("*.jsonl"):
+            profile_path = find_profile(log_file)
+            if profile_path is not None:
+                profile_path.unlink()
             log_file.unlink()
             deleted_count += 1
 
@@ -419,14 +658,17 @@ async def delete_all_logs():
 
 @app.get("/auth/status")
 async def check_auth_status():
-    """Google Cloud認証状況を確認"""
+    """Google Cloud認証状況を確認（キャッシュ済みの結果を返し、期限切れならバックグラウンドで再確認）"""
     try:
-        auth_available = check_google_cloud_auth()
-        project_id = get_google_cloud_project()
+        auth_status = await get_auth_status_cache().get()
+        auth_available = auth_status["authenticated"]
 
         return {
             "authenticated": auth_available,
-            "project_id": project_id,
+            "project_id": auth_status["project_id"],
+            "method": auth_status["method"],
+            "checked_at": auth_status["checked_at"],
+            "stale": auth_status["stale"],
             "status": "認証済み" if auth_available else "認証が必要",
             "message": "Vertex AIを使用できます" if auth_available else "認証設定が必要です"
         }
@@ -439,5 +681,53 @@ async def check_auth_status():
         }
 
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus形式のメトリクス"""
+    return Response(content=render_metrics(), media_type=CONTENT_TYPE_LATEST)
+
+
+@app.get("/modes")
+async def list_modes():
+    """各処理モードの有効・読み込み状況を取得"""
+    return get_mode_status()
+
+
+@app.get("/stats/query-embedding")
+async def get_query_embedding_stats():
+    """クエリ埋め込みのバッチサイズ分布とキャッシュヒット率を取得"""
+    return get_query_embedder().get_stats()
+
+
+@app.get("/stats/tool-cache")
+async def get_tool_cache_stats():
+    """ツール結果キャッシュのヒット率を取得"""
+    return get_tool_result_cache().get_stats()
+
+
+@app.get("/stats/admission")
+async def get_admission_stats():
+    """モードごとの処理枠・待ち行列の状況と拒否数を取得"""
+    return get_admission_controller().get_stats()
+
+
+@app.get("/stats/adaptive-rag")
+async def get_adaptive_rag_stats():
+    """高度なRAGで高速経路（クエリ拡張・再ランキングを省略）を通ったリクエストの割合を取得"""
+    return get_adaptive_stats().get_stats()
+
+
+@app.get("/stats/router")
+async def get_routing_stats():
+    """autoモードで選んだ処理モード・意図の件数と、分類にかかった時間を取得"""
+    return get_router_stats().get_stats()
+
+
+@app.get("/stats/single-flight")
+async def get_single_flight_stats():
+    """同一リクエストの相乗り数と、失敗した処理を共有した件数を取得"""
+    return get_single_flight().get_stats()
+
+
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True, log_level="info")
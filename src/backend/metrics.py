@@ -0,0 +1,88 @@
+"""
+Prometheus形式のメトリクス
+処理モード別のパイプライン段階（load / split / embed / retrieve / expand / rerank / generate / tool_call など）の
+レイテンシヒストグラムと、リクエスト・エラー・トークン・キャッシュヒットのカウンタ、処理中リクエスト数のゲージ、
+受付制御（処理枠の待ち時間・待ち行列の長さ・拒否数）と同一リクエストの相乗り数のメトリクスを提供する。
+段階の計測にはtime.perf_counter()（単調増加クロック）を使用する。
+複数ワーカー構成（PROMETHEUS_MULTIPROC_DIRを設定）では、全ワーカーの値を集計して出力する。
+"""
+
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, Optional
+
+from prometheus_client import (CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest,
+                               multiprocess)
+
+# 段階レイテンシ用のバケット（秒）：埋め込み・検索の数ミリ秒からLLM生成の数十秒まで
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+REQUESTS = Counter("rag_requests_total", "処理したリクエスト数", ["mode", "status"])
+ERRORS = Counter("rag_request_errors_total", "失敗したリクエスト数", ["mode", "error_type"])
+TOKENS = Counter("rag_tokens_total", "入出力トークン数", ["mode", "direction"])
+CACHE_HITS = Counter("rag_cache_hits_total", "キャッシュヒット数", ["cache"])
+CACHE_MISSES = Counter("rag_cache_misses_total", "キャッシュミス数", ["cache"])
+# ゲージは複数ワーカー構成では生存中のワーカーの合計を出力する
+IN_FLIGHT = Gauge("rag_requests_in_flight", "処理中のリクエスト数", ["mode"], multiprocess_mode="livesum")
+REQUEST_LATENCY = Histogram("rag_request_duration_seconds", "リクエスト全体の処理時間", ["mode"], buckets=STAGE_BUCKETS)
+STAGE_LATENCY = Histogram("rag_stage_duration_seconds", "パイプライン段階ごとの処理時間", ["mode", "stage"], buckets=STAGE_BUCKETS)
+QUEUE_WAIT = Histogram("rag_admission_queue_wait_seconds", "処理枠が空くまでの待ち時間", ["mode"], buckets=STAGE_BUCKETS)
+QUEUE_DEPTH = Gauge("rag_admission_queued", "処理枠の空きを待っているリクエスト数", ["mode"], multiprocess_mode="livesum")
+REJECTED = Counter("rag_admission_rejected_total", "受付制御で拒否したリクエスト数", ["mode", "reason"])
+COALESCED = Counter("rag_singleflight_coalesced_total", "処理中の同一リクエストに相乗りしたリクエスト数", ["mode"])
+
+# 現在のリクエストの処理モード（段階のラベルに使用）
+_current_mode: ContextVar[str] = ContextVar("metrics_mode", default="none")
+# 現在のリクエストの段階ごとの累積時間（秒）
+_stage_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("metrics_stage_timings", default=None)
+
+
+def start_request(mode: str) -> Dict[str, float]:
+    """現在のコンテキストに処理モードを設定し、段階ごとの計測結果を記録する辞書を返す"""
+    _current_mode.set(mode)
+    timings: Dict[str, float] = {}
+    _stage_timings.set(timings)
+    return timings
+
+
+@contextmanager
+def observe_stage(stage: str) -> Iterator[None]:
+    """
+    パイプライン段階の処理時間を計測する
+
+    使用例:
+        with observe_stage("retrieve"):
+            ids = retrieval_index.search(query, k)
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_LATENCY.labels(mode=_current_mode.get(), stage=stage).observe(elapsed)
+        timings = _stage_timings.get()
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + elapsed
+
+
+def record_cache(cache: str, hit: bool):
+    """キャッシュのヒット・ミスを記録"""
+    (CACHE_HITS if hit else CACHE_MISSES).labels(cache=cache).inc()
+
+
+def render_metrics() -> bytes:
+    """Prometheusのテキスト形式でメトリクスを出力（複数ワーカー構成では全ワーカーの集計）"""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest()
+
+
+def mark_worker_exit():
+    """ワーカー終了時に呼び出し、そのワーカーのゲージを集計から外す（複数ワーカー構成のみ）"""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(os.getpid())
+
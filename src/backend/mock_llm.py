@@ -0,0 +1,236 @@
+"""
+ネットワーク不要の代替LLM（モック）
+LLM_BACKEND=mock（またはUSE_MOCK_LLM=true）の場合にcreate_vertex_ai_llm()が返すLangChain互換のチャットモデル。
+
+- 決定的な応答: 同じ入力には常に同じ応答を返す（質問中の識別子を含むコンテキスト行を引用する）
+- ツール呼び出し: ツールがバインドされていれば最初のターンで検索ツールを呼び出す（エージェントモードも動作する）
+- ストリーミング: トークン単位でチャンクを返す
+- レイテンシ: 最初のトークンまでの時間（TTFT、対数正規分布）と生成速度（tokens/sec）で応答時間を再現する
+- エラー注入: 指定した確率で呼び出しを失敗させる
+負荷試験やベンチマーク、オフラインでの動作確認に使用する。
+"""
+
+import asyncio
+import json
+import math
+import os
+import random
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Sequence
+
+from knowledge_base import contains_identifier, extract_identifiers
+from langchain_core.callbacks import (AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun)
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import (AIMessage, AIMessageChunk, BaseMessage, HumanMessage, SystemMessage, ToolMessage)
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+# ストリーミング時の1トークンあたりの文字数（日本語の概算）
+_CHARS_PER_TOKEN = 2
+
+
+class MockLLMError(Exception):
+    """エラー注入で発生させる例外"""
+
+
+def get_mock_llm_settings() -> Dict[str, Any]:
+    """環境変数からモックLLMの設定を取得"""
+    return {
+        "ttft_ms": float(os.getenv("MOCK_LLM_TTFT_MS", 0)),
+        "ttft_sigma": float(os.getenv("MOCK_LLM_TTFT_SIGMA", 0.3)),
+        "tokens_per_second": float(os.getenv("MOCK_LLM_TOKENS_PER_SEC", 0)),
+        "error_rate": float(os.getenv("MOCK_LLM_ERROR_RATE", 0.0)),
+        "seed": int(os.getenv("MOCK_LLM_SEED", 0))
+    }
+
+
+def _message_text(message: BaseMessage) -> str:
+    return message.content if isinstance(message.content, str) else str(message.content)
+
+
+def _extract_question(text: str) -> str:
+    """統一プロンプト形式（=== 質問 ===）から質問部分を取り出す"""
+    marker = "=== 質問 ==="
+    if marker in text:
+        return text.split(marker, 1)[1].split("===", 1)[0].strip()
+    return text.strip()
+
+
+class MockChatModel(BaseChatModel):
+    """決定的な応答とレイテンシ分布を持つ代替チャットモデル"""
+
+    model_name: str = "mock-llm"
+    # 最初のトークンまでの時間の中央値（ミリ秒）と対数正規分布のばらつき
+    ttft_ms: float = 0.0
+    ttft_sigma: float = 0.3
+    # 生成速度（0の場合は生成時間を加算しない）
+    tokens_per_second: float = 0.0
+    # 呼び出しを失敗させる確率
+    error_rate: float = 0.0
+    seed: int = 0
+
+    _rng: Any = None
+    _rng_lock: Any = None
+
+    def model_post_init(self, context: Any):
+        super().model_post_init(context)
+        self._rng = random.Random(self.seed)
+        self._rng_lock = threading.Lock()
+
+    @property
+    def _llm_type(self) -> str:
+        return "mock-chat"
+
+    def bind_tools(self, tools: Sequence[Any], **kwargs: Any):
+        """ツール定義をバインドする（呼び出し時にtools引数として渡される）"""
+        return self.bind(tools=[convert_to_openai_tool(tool) for tool in tools], **kwargs)
+
+    # ---- 応答の作成 ----
+
+    def _respond(self, messages: List[BaseMessage], tools: Optional[List[Dict[str, Any]]]) -> AIMessage:
+        """メッセージとツール定義から決定的な応答を作成"""
+        human_texts = [_message_text(message) for message in messages if isinstance(message, HumanMessage)]
+        text = human_texts[-1] if human_texts else ""
+        question = _extract_question(text)
+        tool_results = [_message_text(message) for message in messages if isinstance(message, ToolMessage)]
+
+        # ツールがあり、まだツール結果を受け取っていなければツールを呼び出す
+        if tools and not tool_results:
+            functions = [tool["function"] for tool in tools]
+            # queryパラメータを持つ検索ツールを優先
+            function = next((f for f in functions if "query" in f.get("parameters", {}).get("properties", {})),
+                            functions[0])
+            properties = function.get("parameters", {}).get("properties", {})
+            args = {"query": question} if "query" in properties else {}
+            return AIMessage(content="", tool_calls=[{"name": function["name"], "args": args, "id": "mock-call-1"}])
+
+        # クエリ拡張のプロンプトには番号付きの検索クエリを返す
+        if "検索クエリ" in text:
+            return AIMessage(content=f"1. {question} 手順\n2. {question} 詳細")
+
+        # コンテキスト（プロンプト本文・ツール結果）から質問に関係する行を引用する
+        context = "\n".join(tool_results + [text] +
+                            [_message_text(message) for message in messages if isinstance(message, SystemMessage)])
+        evidence = self._find_evidence(question, context)
+        answer = f"（モック応答）「{question}」についての回答です。"
+        if evidence:
+            answer += f"\n取扱説明書によると: {evidence}"
+        return AIMessage(content=answer)
+
+    @staticmethod
+    def _find_evidence(question: str, context: str) -> str:
+        """質問中の識別子、なければ質問と共通する文字が最も多い行を返す"""
+        lines = [line.strip() for line in context.split("\n") if line.strip() and "===" not in line]
+        lines = [line for line in lines if question not in line]
+        if not lines:
+            return ""
+        # 識別子は実際の検索経路と同じ関数で抽出・照合する
+        for identifier in extract_identifiers(question):
+            for line in lines:
+                if contains_identifier(line, identifier):
+                    return line
+        question_chars = set(question)
+        best = max(lines, key=lambda line: len(question_chars & set(line)))
+        return best if question_chars & set(best) else ""
+
+    # ---- レイテンシとエラー注入 ----
+
+    def _sample_ttft(self) -> float:
+        """TTFT（秒）を対数正規分布からサンプリング"""
+        if self.ttft_ms <= 0:
+            return 0.0
+        with self._rng_lock:
+            return self.ttft_ms / 1000 * math.exp(self._rng.gauss(0, self.ttft_sigma))
+
+    def _maybe_fail(self):
+        if self.error_rate <= 0:
+            return
+        with self._rng_lock:
+            failed = self._rng.random() < self.error_rate
+        if failed:
+            raise MockLLMError("モックLLMの注入エラー: 503 Service Unavailable")
+
+    def _generation_seconds(self, message: AIMessage) -> float:
+        if self.tokens_per_second <= 0:
+            return 0.0
+        tokens = max(1, len(_message_text(message)) // _CHARS_PER_TOKEN)
+        return tokens / self.tokens_per_second
+
+    @staticmethod
+    def _split_tokens(content: str) -> List[str]:
+        return [content[i:i + _CHARS_PER_TOKEN] for i in range(0, len(content), _CHARS_PER_TOKEN)]
+
+    def _tool_call_chunk(self, message: AIMessage) -> AIMessageChunk:
+        return AIMessageChunk(content="",
+                              tool_call_chunks=[{
+                                  "name": call["name"],
+                                  "args": json.dumps(call["args"], ensure_ascii=False),
+                                  "id": call["id"],
+                                  "index": i
+                              } for i, call in enumerate(message.tool_calls)])
+
+    # ---- LangChainのインターフェース ----
+
+    def _generate(self,
+                  messages: List[BaseMessage],
+                  stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None,
+                  **kwargs: Any) -> ChatResult:
+        self._maybe_fail()
+        message = self._respond(messages, kwargs.get("tools"))
+        time.sleep(self._sample_ttft() + self._generation_seconds(message))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self,
+                         messages: List[BaseMessage],
+                         stop: Optional[List[str]] = None,
+                         run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+                         **kwargs: Any) -> ChatResult:
+        self._maybe_fail()
+        message = self._respond(messages, kwargs.get("tools"))
+        await asyncio.sleep(self._sample_ttft() + self._generation_seconds(message))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self,
+                messages: List[BaseMessage],
+                stop: Optional[List[str]] = None,
+                run_manager: Optional[CallbackManagerForLLMRun] = None,
+                **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        self._maybe_fail()
+        message = self._respond(messages, kwargs.get("tools"))
+        time.sleep(self._sample_ttft())
+        if message.tool_calls:
+            yield ChatGenerationChunk(message=self._tool_call_chunk(message))
+            return
+        per_token = 1 / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+        for i, token in enumerate(self._split_tokens(message.content)):
+            if i and per_token:
+                time.sleep(per_token)
+            if run_manager:
+                run_manager.on_llm_new_token(token)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+    async def _astream(self,
+                       messages: List[BaseMessage],
+                       stop: Optional[List[str]] = None,
+                       run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+                       **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        self._maybe_fail()
+        message = self._respond(messages, kwargs.get("tools"))
+        await asyncio.sleep(self._sample_ttft())
+        if message.tool_calls:
+            yield ChatGenerationChunk(message=self._tool_call_chunk(message))
+            return
+        per_token = 1 / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+        for i, token in enumerate(self._split_tokens(message.content)):
+            if i and per_token:
+                await asyncio.sleep(per_token)
+            if run_manager:
+                await run_manager.on_llm_new_token(token)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+
+def create_mock_llm(model_name: str = "mock-llm", temperature: float = 0.0) -> MockChatModel:
+    """環境変数の設定（MOCK_LLM_*）でモックLLMを作成（temperatureは応答に影響しない）"""
+    return MockChatModel(model_name=model_name, **get_mock_llm_settings())
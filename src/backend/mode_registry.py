@@ -0,0 +1,91 @@
+"""
+処理モードのレジストリ
+各処理モードの実装モジュール（LangChain・FAISS・sentence-transformers・torchなどの重い依存を含む）を
+初回利用時に遅延インポートする。ENABLED_MODESで有効にするモードを限定できる。
+"""
+
+import importlib
+import os
+import threading
+import time
+from types import ModuleType
+from typing import Any, Dict, List
+
+# モード名 -> 実装モジュール名
+MODE_MODULES: Dict[str, str] = {
+    "llm_only": "run_llm_only",
+    "prompt_stuffing": "run_prompt_stuffing",
+    "rag_only": "run_rag_only",
+    "rag_advanced": "run_rag_advanced",
+    "function_calling": "run_function_calling_only",
+    "rag_function_calling": "run_rag_plus_fancall",
+}
+
+
+class ModeDisabledError(Exception):
+    """ENABLED_MODESで無効化されたモードが要求された場合の例外"""
+
+
+def get_enabled_modes() -> List[str]:
+    """
+    環境変数ENABLED_MODES（カンマ区切り）から有効なモードを取得
+
+    未設定または"all"の場合はすべてのモードを有効にする。
+    """
+    value = os.getenv("ENABLED_MODES", "").strip()
+    if not value or value.lower() == "all":
+        return list(MODE_MODULES)
+
+    modes = []
+    for mode in (item.strip() for item in value.split(",")):
+        if not mode:
+            continue
+        if mode not in MODE_MODULES:
+            print(f"警告: ENABLED_MODESの未知のモード '{mode}' を無視します（指定可能: {', '.join(MODE_MODULES)}）")
+            continue
+        modes.append(mode)
+    return modes
+
+
+# モード名 -> インポート済みモジュール
+_loaded_modules: Dict[str, ModuleType] = {}
+# モード名 -> インポートにかかった秒数
+_import_seconds: Dict[str, float] = {}
+_import_lock = threading.Lock()
+
+
+def get_mode_module(mode: str) -> ModuleType:
+    """
+    モードの実装モジュールを取得（初回のみインポート）
+
+    Raises:
+        ModeDisabledError: モードが無効化されている場合
+    """
+    module = _loaded_modules.get(mode)
+    if module is not None:
+        return module
+
+    if mode not in get_enabled_modes():
+        raise ModeDisabledError(f"モード '{mode}' はこのデプロイメントで無効化されています")
+
+    with _import_lock:
+        module = _loaded_modules.get(mode)
+        if module is None:
+            started = time.perf_counter()
+            module = importlib.import_module(MODE_MODULES[mode])
+            _import_seconds[mode] = time.perf_counter() - started
+            _loaded_modules[mode] = module
+            print(f"📦 モード '{mode}' のモジュールを読み込みました ({_import_seconds[mode]:.2f}秒)")
+    return module
+
+
+def get_mode_status() -> Dict[str, Dict[str, Any]]:
+    """各モードの有効・読み込み状況とインポート時間を取得"""
+    enabled = set(get_enabled_modes())
+    return {
+        mode: {
+            "enabled": mode in enabled,
+            "loaded": mode in _loaded_modules,
+            "import_seconds": round(_import_seconds[mode], 3) if mode in _import_seconds else None
+        } for mode in MODE_MODULES
+    }
@@ -0,0 +1,128 @@
+"""
+リクエスト単位のプロファイリング（オプトイン）
+管理設定ENABLE_PROFILINGが有効な場合に限り、リクエストのprofileフラグ、またはPROFILING_SAMPLE_RATEによる
+サンプリングで選ばれたリクエストの処理をプロファイラ下で実行し、結果をログファイルの隣に保存する。
+pyinstrumentがインストールされていればサンプリングプロファイラ（非同期コンテキスト対応、HTML出力）を、
+なければcProfile（決定的プロファイラ、.prof出力）を使用する。無効時のオーバーヘッドは判定1回のみ。
+"""
+
+import os
+import random
+import threading
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+PROFILERS = ("auto", "pyinstrument", "cprofile")
+
+# 同時に動かせるプロファイラは1つのみ（cProfile・pyinstrumentともにスレッドあたり1つの制約がある）
+_active_lock = threading.Lock()
+
+
+def get_profiling_settings() -> Dict[str, Any]:
+    """環境変数からプロファイリング設定を取得"""
+    profiler = os.getenv("PROFILER", "auto").lower()
+    if profiler not in PROFILERS:
+        print(f"警告: 未知のPROFILER '{profiler}' のためautoを使用します（指定可能: {', '.join(PROFILERS)}）")
+        profiler = "auto"
+    return {
+        "enabled": os.getenv("ENABLE_PROFILING", "false").lower() == "true",
+        "sample_rate": float(os.getenv("PROFILING_SAMPLE_RATE", 0.0)),
+        "profiler": profiler
+    }
+
+
+def should_profile(requested: bool) -> bool:
+    """このリクエストをプロファイルするかどうか（管理設定で無効なら常にFalse）"""
+    settings = get_profiling_settings()
+    if not settings["enabled"]:
+        return False
+    return requested or (settings["sample_rate"] > 0 and random.random() < settings["sample_rate"])
+
+
+def _pyinstrument_available() -> bool:
+    try:
+        import pyinstrument  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class RequestProfiler:
+    """
+    1リクエストの処理をプロファイルするコンテキストマネージャ
+
+    使用例:
+        profiler = RequestProfiler()
+        with profiler:
+            result = await run_mode(module, request)
+        profile_file = profiler.save(log_path)
+    """
+
+    def __init__(self, profiler: Optional[str] = None):
+        profiler = profiler or get_profiling_settings()["profiler"]
+        if profiler == "auto":
+            profiler = "pyinstrument" if _pyinstrument_available() else "cprofile"
+        self.kind = profiler
+        self.skipped_reason: Optional[str] = None
+        self._profiler = None
+        self._acquired = False
+
+    def __enter__(self):
+        # 他のリクエストをプロファイル中の場合はスキップ（処理自体は通常通り実行）
+        self._acquired = _active_lock.acquire(blocking=False)
+        if not self._acquired:
+            self.skipped_reason = "他のリクエストをプロファイル中のためスキップしました"
+            return self
+
+        if self.kind == "pyinstrument":
+            from pyinstrument import Profiler
+
+            # async_mode="enabled" で現在のタスクのコンテキストのみを記録する
+            self._profiler = Profiler(interval=0.001, async_mode="enabled")
+            self._profiler.start()
+        else:
+            import cProfile
+
+            # イベントループのスレッド全体を記録する（同時に処理中の他リクエストも含まれる）
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if not self._acquired:
+            return False
+        try:
+            if self.kind == "pyinstrument":
+                self._profiler.stop()
+            else:
+                self._profiler.disable()
+        finally:
+            _active_lock.release()
+        return False
+
+    def save(self, log_path: Path) -> Optional[str]:
+        """
+        プロファイルをログファイルと同じ名前（拡張子違い）で保存する
+
+        Returns:
+            保存したファイル名（プロファイルを取得していない場合はNone）
+        """
+        if self._profiler is None:
+            return None
+
+        if self.kind == "pyinstrument":
+            profile_path = log_path.with_suffix(".html")
+            profile_path.write_text(self._profiler.output_html(), encoding="utf-8")
+        else:
+            profile_path = log_path.with_suffix(".prof")
+            self._profiler.dump_stats(str(profile_path))
+        return profile_path.name
+
+
+def find_profile(log_path: Path) -> Optional[Path]:
+    """ログファイルに対応するプロファイルを探す"""
+    for suffix in (".html", ".prof"):
+        profile_path = log_path.with_suffix(suffix)
+        if profile_path.exists():
+            return profile_path
+    return None
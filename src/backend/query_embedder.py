@@ -0,0 +1,175 @@
+"""
+クエリ埋め込みサービス
+同時に処理中の全リクエストからクエリを短い時間窓で集め、1回のバッチで埋め込む。
+直近のクエリベクトルはLRUキャッシュに保持し、実際に達成したバッチサイズを統計として記録する。
+"""
+
+import asyncio
+import os
+import threading
+from collections import Counter, OrderedDict
+from typing import Callable, Dict, List, Optional
+
+from metrics import record_cache
+
+Vector = List[float]
+
+
+def _embed_texts(texts: List[str]) -> List[Vector]:
+    """埋め込みモデルでテキスト群をまとめて埋め込む"""
+    from vector_index import get_embeddings
+    return get_embeddings().embed_documents(texts)
+
+
+class QueryEmbeddingService:
+    """クエリ埋め込みのバッチ集約とLRUキャッシュ"""
+
+    def __init__(self,
+                 embed_batch: Callable[[List[str]], List[Vector]] = _embed_texts,
+                 window_ms: float = 5.0,
+                 max_batch: int = 32,
+                 cache_size: int = 1024):
+        self._embed_batch = embed_batch
+        self._window = window_ms / 1000
+        self._max_batch = max_batch
+        self._cache_size = cache_size
+
+        self._cache: "OrderedDict[str, Vector]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+        # イベントループ上でのみ操作する待ち行列（テキスト -> 結果を待つFuture）
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+
+        self._stats_lock = threading.Lock()
+        self._batch_sizes: Counter = Counter()
+        self._cache_hits = 0
+        self._cache_misses = 0
+
+    def _cache_get(self, text: str) -> Optional[Vector]:
+        with self._cache_lock:
+            vector = self._cache.get(text)
+            if vector is not None:
+                self._cache.move_to_end(text)
+            return vector
+
+    def _cache_put(self, text: str, vector: Vector):
+        with self._cache_lock:
+            self._cache[text] = vector
+            self._cache.move_to_end(text)
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+
+    def _record_lookup(self, hit: bool):
+        record_cache("query_embedding", hit)
+        with self._stats_lock:
+            if hit:
+                self._cache_hits += 1
+            else:
+                self._cache_misses += 1
+
+    def _record_batch(self, size: int):
+        with self._stats_lock:
+            self._batch_sizes[size] += 1
+
+    async def embed(self, text: str) -> Vector:
+        """
+        クエリを埋め込む
+
+        キャッシュにあれば即座に返し、なければ時間窓内の他のクエリとまとめて埋め込む。
+        同じ時間窓内の同一クエリは1回だけ埋め込む。
+        """
+        vector = self._cache_get(text)
+        self._record_lookup(vector is not None)
+        if vector is not None:
+            return vector
+
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # 別のイベントループから呼ばれた場合は待ち行列を作り直す
+            self._loop = loop
+            self._pending = {}
+            self._flush_handle = None
+
+        future = self._pending.get(text)
+        if future is None:
+            future = loop.create_future()
+            self._pending[text] = future
+            if len(self._pending) >= self._max_batch:
+                self._flush()
+            elif self._flush_handle is None:
+                self._flush_handle = loop.call_later(self._window, self._flush)
+        return await asyncio.shield(future)
+
+    def _flush(self):
+        """待ち行列のクエリをまとめて埋め込むタスクを起動"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, {}
+        if batch:
+            self._loop.create_task(self._run_batch(batch))
+
+    async def _run_batch(self, batch: Dict[str, asyncio.Future]):
+        texts = list(batch)
+        self._record_batch(len(texts))
+        try:
+            # 推論はスレッドで実行し、イベントループをブロックしない
+            vectors = await asyncio.to_thread(self._embed_batch, texts)
+        except Exception as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for text, vector in zip(texts, vectors):
+            self._cache_put(text, vector)
+            future = batch[text]
+            if not future.done():
+                future.set_result(vector)
+
+    def embed_sync(self, text: str) -> Vector:
+        """同期コンテキスト（ツール関数など）からクエリを埋め込む（キャッシュは共有）"""
+        vector = self._cache_get(text)
+        self._record_lookup(vector is not None)
+        if vector is None:
+            vector = self._embed_batch([text])[0]
+            self._record_batch(1)
+            self._cache_put(text, vector)
+        return vector
+
+    def get_stats(self) -> Dict:
+        """達成したバッチサイズの分布とキャッシュヒット率を取得"""
+        with self._stats_lock:
+            batches = sum(self._batch_sizes.values())
+            embedded = sum(size * count for size, count in self._batch_sizes.items())
+            lookups = self._cache_hits + self._cache_misses
+            return {
+                "batches": batches,
+                "embedded_queries": embedded,
+                "mean_batch_size": round(embedded / batches, 2) if batches else 0.0,
+                "max_batch_size": max(self._batch_sizes) if self._batch_sizes else 0,
+                "batch_size_histogram": dict(sorted(self._batch_sizes.items())),
+                "cache_hits": self._cache_hits,
+                "cache_misses": self._cache_misses,
+                "cache_hit_rate": round(self._cache_hits / lookups, 3) if lookups else 0.0,
+                "cache_entries": len(self._cache)
+            }
+
+
+# サービスをグローバルに初期化してキャッシュ
+_query_embedder = None
+_query_embedder_lock = threading.Lock()
+
+
+def get_query_embedder() -> QueryEmbeddingService:
+    """クエリ埋め込みサービスをシングルトンパターンで取得"""
+    global _query_embedder
+    if _query_embedder is None:
+        with _query_embedder_lock:
+            if _query_embedder is None:
+                _query_embedder = QueryEmbeddingService(window_ms=float(os.getenv("QUERY_EMBED_WINDOW_MS", 5)),
+                                                        max_batch=int(os.getenv("QUERY_EMBED_MAX_BATCH", 32)),
+                                                        cache_size=int(os.getenv("QUERY_EMBED_CACHE_SIZE", 1024)))
+    return _query_embedder
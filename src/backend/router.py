@@ -0,0 +1,190 @@
+"""
+質問の意図による処理モードの自動選択（autoモード）
+LLMを呼び出さずに、ルール・識別子の検出・ラベル付きの例文との類似度で質問を分類し、
+回答に十分な処理モードのうち最も安価なものを選ぶ。1件の分類は1ミリ秒未満で完了する。
+
+分類の順序:
+    1. ルール: シリアル番号の問い合わせ → rag_function_calling（シリアル番号の取得ツールを持つ唯一のモード）
+    2. 識別子: エラーコード・安全規定・型番など（E-101、S-01、M-101）→ rag_only（識別子を含むチャンクを直接検索できる）
+    3. 例文との類似度: 文字n-gram（2〜3文字）のベクトルと、意図ごとの例文の重心とのコサイン類似度が最大の意図
+    4. いずれにも該当しない場合 → rag_only
+
+類似度には埋め込みモデルではなく文字n-gramを使用する（モデルの推論は1ミリ秒に収まらないため）。
+選んだモードがENABLED_MODESで無効な場合は、より高機能なモードの順に有効なものへ切り替える。
+"""
+
+import math
+import threading
+import time
+import unicodedata
+from collections import Counter
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from knowledge_base import extract_identifiers
+
+# 意図 -> (処理モード, ラベル付きの例文)
+INTENT_PROTOTYPES: Dict[str, Dict[str, Any]] = {
+    "small_talk": {
+        "mode": "llm_only",
+        "examples": ["こんにちは", "ありがとうございます", "あなたは誰ですか", "今日の天気は", "よろしくお願いします", "テスト"]
+    },
+    "manual_lookup": {
+        "mode": "rag_only",
+        "examples": [
+            "溶接電流の範囲を教えてください", "最大可搬重量は何kgですか", "冷却水の交換頻度は", "メンテナンスの手順を教えて",
+            "電源が入らないときの対処方法", "保護メガネは必要ですか", "定期点検の項目は何ですか", "推奨される設置環境は"
+        ]
+    },
+    "complex_reasoning": {
+        "mode": "rag_advanced",
+        "examples": [
+            "過熱と電流異常の違いを比較して説明してください", "安全規定をすべて一覧にして要約してください",
+            "なぜ溶接品質が安定しないのか原因を複数挙げてください", "設置から運用開始までの全体の流れを整理してください",
+            "状況に応じてどの設定を選ぶべきか判断基準を教えてください"
+        ]
+    },
+    "device_state": {
+        "mode": "rag_function_calling",
+        "examples": ["このロボットの現在の状態を確認して", "今使っている機体の情報を調べて", "接続中のロボットについて教えて"]
+    },
+}
+
+# シリアル番号の問い合わせを示す語
+SERIAL_KEYWORDS = ("シリアル番号", "シリアルナンバー", "製造番号", "serial")
+
+# 例文との類似度がこの値未満の場合は既定のモードにする
+MIN_PROTOTYPE_SIMILARITY = 0.15
+DEFAULT_MODE = "rag_only"
+
+# 選んだモードが無効な場合の切り替え先（代わりに回答できる見込みが高い順）
+MODE_FALLBACKS: Dict[str, List[str]] = {
+    "llm_only": ["rag_only", "prompt_stuffing", "rag_advanced", "rag_function_calling", "function_calling"],
+    "rag_only": ["rag_advanced", "prompt_stuffing", "rag_function_calling", "function_calling", "llm_only"],
+    "rag_advanced": ["rag_function_calling", "rag_only", "prompt_stuffing", "function_calling", "llm_only"],
+    "rag_function_calling": ["function_calling", "rag_advanced", "rag_only", "prompt_stuffing", "llm_only"],
+}
+
+
+class Route(NamedTuple):
+    """自動選択の結果"""
+    mode: str
+    intent: str
+    reason: str
+    score: Optional[float]
+    latency_ms: float
+
+
+def _char_ngrams(text: str) -> Counter:
+    """正規化したテキストの文字2-gram・3-gramの出現数"""
+    text = "".join(unicodedata.normalize("NFKC", text).lower().split())
+    return Counter(text[i:i + n] for n in (2, 3) for i in range(len(text) - n + 1))
+
+
+def _normalize(vector: Counter) -> Dict[str, float]:
+    norm = math.sqrt(sum(value * value for value in vector.values())) or 1.0
+    return {key: value / norm for key, value in vector.items()}
+
+
+def _build_centroids() -> Dict[str, Dict[str, float]]:
+    """意図ごとに例文の正規化ベクトルの重心を計算"""
+    centroids = {}
+    for intent, prototype in INTENT_PROTOTYPES.items():
+        total: Counter = Counter()
+        for example in prototype["examples"]:
+            total.update(_normalize(_char_ngrams(example)))
+        centroids[intent] = _normalize(total)
+    return centroids
+
+
+_CENTROIDS = _build_centroids()
+
+
+def classify_by_prototypes(query: str) -> List[Tuple[str, float]]:
+    """例文の重心との類似度を (意図, 類似度) の降順で返す"""
+    vector = _normalize(_char_ngrams(query))
+    scores = [(intent, sum(weight * centroid.get(ngram, 0.0) for ngram, weight in vector.items()))
+              for intent, centroid in _CENTROIDS.items()]
+    return sorted(scores, key=lambda item: item[1], reverse=True)
+
+
+def _resolve_enabled(mode: str, enabled_modes: Optional[List[str]]) -> str:
+    """モードが無効な場合は切り替え先のうち有効なものを返す"""
+    if enabled_modes is None or mode in enabled_modes:
+        return mode
+    for fallback in MODE_FALLBACKS.get(mode, []):
+        if fallback in enabled_modes:
+            return fallback
+    return enabled_modes[0] if enabled_modes else mode
+
+
+def route_query(query: str, enabled_modes: Optional[List[str]] = None) -> Route:
+    """
+    質問を分類し、回答に十分な最も安価な処理モードを選ぶ
+
+    Args:
+        query: ユーザーの質問
+        enabled_modes: 選択可能なモード（Noneの場合はすべて）
+    """
+    started = time.perf_counter()
+    normalized = unicodedata.normalize("NFKC", query).lower()
+    score: Optional[float] = None
+
+    if any(keyword in normalized for keyword in SERIAL_KEYWORDS):
+        intent, mode, reason = "serial_number", "rag_function_calling", "シリアル番号の問い合わせ"
+    elif identifiers := extract_identifiers(query):
+        intent, mode, reason = "identifier_lookup", "rag_only", f"識別子（{', '.join(identifiers)}）の検索"
+    else:
+        best_intent, score = classify_by_prototypes(query)[0]
+        if score >= MIN_PROTOTYPE_SIMILARITY:
+            intent, mode, reason = best_intent, INTENT_PROTOTYPES[best_intent]["mode"], "例文との類似度"
+        else:
+            intent, mode, reason = "unknown", DEFAULT_MODE, "該当する意図なし（既定）"
+
+    resolved = _resolve_enabled(mode, enabled_modes)
+    if resolved != mode:
+        reason += f"、{mode}が無効のため{resolved}に切り替え"
+    latency_ms = (time.perf_counter() - started) * 1000
+    route = Route(resolved, intent, reason, round(score, 4) if score is not None else None, round(latency_ms, 4))
+    get_router_stats().record(route)
+    return route
+
+
+class RouterStats:
+    """選択したモード・意図の件数と、分類にかかった時間の集計"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.total = 0
+        self.modes: Counter = Counter()
+        self.intents: Counter = Counter()
+        self.total_latency_ms = 0.0
+        self.max_latency_ms = 0.0
+
+    def record(self, route: Route):
+        with self._lock:
+            self.total += 1
+            self.modes[route.mode] += 1
+            self.intents[route.intent] += 1
+            self.total_latency_ms += route.latency_ms
+            self.max_latency_ms = max(self.max_latency_ms, route.latency_ms)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "total": self.total,
+                "modes": dict(self.modes),
+                "intents": dict(self.intents),
+                "avg_latency_ms": round(self.total_latency_ms / self.total, 4) if self.total else 0.0,
+                "max_latency_ms": round(self.max_latency_ms, 4)
+            }
+
+
+_router_stats: Optional[RouterStats] = None
+
+
+def get_router_stats() -> RouterStats:
+    """共有の自動選択の集計を取得"""
+    global _router_stats
+    if _router_stats is None:
+        _router_stats = RouterStats()
+    return _router_stats
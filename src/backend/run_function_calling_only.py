@@ -4,17 +4,40 @@
 """
 
 import asyncio
+import os
+import time
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Tuple
 
+from deadline import should_degrade
 from env_utils import create_vertex_ai_llm, setup_environment
+from knowledge_base import get_knowledge_version
 from langchain.tools import tool
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, ToolMessage
+from metrics import observe_stage
+from tool_cache import cached_tool, start_tool_cache_trace
 
 # 環境変数を読み込み
 setup_environment()
 
+# ツール実行ループの最大ターン数と、ツール1件あたりのタイムアウト（秒）
+MAX_TOOL_TURNS = int(os.getenv("FUNCTION_CALLING_MAX_TURNS", 4))
+TOOL_TIMEOUT_SECONDS = float(os.getenv("FUNCTION_CALLING_TOOL_TIMEOUT", 10))
+
+# search_manualの検索対象
+MANUAL_PATH = Path(__file__).parent.parent.parent / "data" / "knowledge.txt"
+
+
+def _manual_version() -> str:
+    """検索対象ファイルのナレッジバージョン（ツール結果キャッシュのキーに使用）"""
+    try:
+        return get_knowledge_version(MANUAL_PATH)
+    except FileNotFoundError:
+        return "missing"
+
 
 @tool
+@cached_tool(version_fn=_manual_version)
 def search_manual(query: str) -> str:
     """製品取扱説明書内でテキスト検索を行います。
     
@@ -25,8 +48,7 @@ def search_manual(query: str) -> str:
         検索結果として見つかった関連する情報
     """
     # knowledge.txtから関連情報を検索
-    # 相対パスではなく、適切なパスを使用
-    knowledge_path = Path(__file__).parent.parent.parent / "data" / "knowledge.txt"
+    knowledge_path = MANUAL_PATH
 
     try:
         with open(knowledge_path, "r", encoding="utf-8") as f:
@@ -48,8 +70,74 @@ def search_manual(query: str) -> str:
         return f"'{query}'に関する情報は見つかりませんでした。"
 
 
+# ツール名 -> ツール
+TOOLS = {manual_tool.name: manual_tool for manual_tool in [search_manual]}
+
+
+def warm_up(knowledge_path: Path) -> Dict[str, Any]:
+    """起動時のウォームアップ：LLMクライアントにツールをバインドし、検索対象ファイルを確認する"""
+    create_vertex_ai_llm().bind_tools(list(TOOLS.values()))
+    return {"manual_version": _manual_version(), "tools": list(TOOLS), "llm": "initialized"}
+
+
+async def _run_tool_call(tool_call: Dict[str, Any], timeout: float) -> Tuple[ToolMessage, Dict[str, Any]]:
+    """
+    ツール呼び出しを1件実行し、(ツールメッセージ, 実行記録) を返す
+
+    ツールはスレッドで実行し、タイムアウトや例外はエラー文字列としてLLMに返す。
+    """
+    tool_name = tool_call["name"]
+    tool_args = tool_call["args"]
+    started = time.perf_counter()
+    status = "ok"
+    # gatherで各呼び出しは別タスク（別コンテキスト）になるため、呼び出しごとに記録できる
+    cache_trace = start_tool_cache_trace()
+
+    selected_tool = TOOLS.get(tool_name)
+    if selected_tool is None:
+        result = f"エラー: 未知のツール '{tool_name}' が呼び出されました"
+        status = "unknown_tool"
+    else:
+        try:
+            with observe_stage("tool_call"):
+                result = await asyncio.wait_for(asyncio.to_thread(selected_tool.invoke, tool_args), timeout=timeout)
+        except asyncio.TimeoutError:
+            result = f"エラー: ツール '{tool_name}' が{timeout}秒以内に完了しませんでした"
+            status = "timeout"
+        except Exception as e:
+            result = f"エラー: ツール '{tool_name}' の実行に失敗しました: {str(e)}"
+            status = "error"
+
+    record = {
+        "tool": tool_name,
+        "args": tool_args,
+        "status": status,
+        "cache_hit": any(entry["cache_hit"] for entry in cache_trace),
+        "latency_ms": round((time.perf_counter() - started) * 1000, 1),
+        "result_preview": f"{result[:100]}..." if len(result) > 100 else result
+    }
+    return ToolMessage(content=result, tool_call_id=tool_call["id"], name=tool_name), record
+
+
+def _format_conversation(messages: List[BaseMessage]) -> str:
+    """LLMに渡した会話履歴をログ表示用のテキストに整形"""
+    parts = []
+    for message in messages:
+        if isinstance(message, HumanMessage):
+            parts.append(f"=== ユーザー ===\n{message.content}")
+        elif isinstance(message, ToolMessage):
+            parts.append(f"=== ツール結果 ({message.name}) ===\n{message.content}")
+        elif isinstance(message, AIMessage) and message.tool_calls:
+            calls = ", ".join(f"{call['name']}({call['args']})" for call in message.tool_calls)
+            parts.append(f"=== ツール呼び出し ===\n{calls}")
+    return "\n\n".join(parts)
+
+
 async def process_function_calling_only(user_query: str, demo_mode: bool = False) -> Dict[str, Any]:
     """Function Callingのみのモードで処理を実行する
+
+    LLMが要求したツール呼び出しをターンごとにすべて並行実行し、結果をツールメッセージとして
+    返す処理を、LLMが直接回答するか最大ターン数に達するまで繰り返す。
     
     Args:
         user_query: ユーザーからの質問
@@ -67,101 +155,95 @@ async def process_function_calling_only(user_query: str, demo_mode: bool = False
 
     # LLMを初期化し、ツールをバインド
     llm = create_vertex_ai_llm()
-    llm_with_tools = llm.bind_tools([search_manual])
+    llm_with_tools = llm.bind_tools(list(TOOLS.values()))
 
     intermediate_steps.append({"step": 1, "action": "LLM初期化完了", "details": "LLMにツールをバインドしました"})
 
-    # 最初のLLM呼び出し（ツール使用判断）
-    if demo_mode:
-        print("1. LLMがツール使用を判断中...")
-
-    response = llm_with_tools.invoke(user_query)
-    actual_prompt = user_query  # 初期プロンプト
-
-    intermediate_steps.append({
-        "step":
-            2,
-        "action":
-            "初回LLM呼び出し",
-        "details":
-            f"ツール呼び出し判断: {'あり' if hasattr(response, 'tool_calls') and response.tool_calls else 'なし'}"
-    })
-
-    # ツール呼び出しが含まれているかチェック
-    if hasattr(response, 'tool_calls') and response.tool_calls:
-        if demo_mode:
-            print("2. LLMがツール呼び出しを決定しました")
+    messages: List[BaseMessage] = [HumanMessage(content=user_query)]
+    final_answer = None
+    # ツール実行を終えたターン数（期限で打ち切った場合は最大ターン数より少ない）
+    completed_turns = 0
 
-        # ツール実行
-        tool_call = response.tool_calls[0]
-        tool_name = tool_call['name']
-        tool_args = tool_call['args']
+    for turn in range(1, MAX_TOOL_TURNS + 1):
+        # 期限までの残り時間が少ない場合は、ここまでのツール結果で回答させる
+        if turn > 1 and should_degrade("cap_agent_iterations", f"{completed_turns}ターンで打ち切り"):
+            break
 
         if demo_mode:
-            print(f"   ツール名: {tool_name}")
-            print(f"   引数: {tool_args}")
-
-        intermediate_steps.append({
-            "step": 3,
-            "action": "ツール呼び出し決定",
-            "details": f"ツール: {tool_name}, 引数: {tool_args}"
-        })
+            print(f"{turn}. LLMがツール使用を判断中...")
 
-        # 実際にツールを実行
-        if tool_name == "search_manual":
-            tool_result = search_manual.invoke(tool_args)
-
-            if demo_mode:
-                print(f"3. ツール実行結果:")
-                print(f"   {tool_result}")
+        llm_started = time.perf_counter()
+        with observe_stage("generate"):
+            response = await llm_with_tools.ainvoke(messages)
+        llm_latency_ms = round((time.perf_counter() - llm_started) * 1000, 1)
+        messages.append(response)
 
+        tool_calls = getattr(response, "tool_calls", None) or []
+        if not tool_calls:
+            final_answer = response.content
             intermediate_steps.append({
-                "step":
-                    4,
-                "action":
-                    "ツール実行完了",
-                "details":
-                    f"検索結果: {tool_result[:100]}..." if len(tool_result) > 100 else tool_result
+                "step": len(intermediate_steps) + 1,
+                "action": "直接回答" if turn == 1 else "最終回答生成",
+                "details": "LLMはツールを使用せずに直接回答しました" if turn == 1 else "ツール結果を基に最終回答を生成しました",
+                "turn": turn,
+                "llm_latency_ms": llm_latency_ms,
+                "turn_latency_ms": llm_latency_ms
             })
+            break
 
-            # ツール結果を含めて再度LLMに問い合わせ
-            final_prompt = f"""以下の製品取扱説明書（検索結果）を参考にして、質問に答えてください。
-
-=== 製品取扱説明書（検索結果） ===
-{tool_result}
-
-=== 質問 ===
-{user_query}
-
-=== 回答 ===
-製品取扱説明書の内容に基づいて、正確な情報を提供してください。"""
+        if demo_mode:
+            for tool_call in tool_calls:
+                print(f"   ツール名: {tool_call['name']}, 引数: {tool_call['args']}")
 
-            actual_prompt = final_prompt  # 実際に使用されたプロンプトを更新
+        # このターンのツール呼び出しをすべて並行実行（結果は呼び出し順で返す）
+        tools_started = time.perf_counter()
+        results = await asyncio.gather(*(_run_tool_call(tool_call, TOOL_TIMEOUT_SECONDS) for tool_call in tool_calls))
+        tools_latency_ms = round((time.perf_counter() - tools_started) * 1000, 1)
+        messages.extend(tool_message for tool_message, _ in results)
+        records = [record for _, record in results]
 
-            if demo_mode:
-                print("4. ツール結果を基に最終回答を生成中...")
+        if demo_mode:
+            for record in records:
+                print(f"   {record['tool']} ({record['status']}, {record['latency_ms']}ms): {record['result_preview']}")
 
-            final_response = llm.invoke(final_prompt)
-            final_answer = final_response.content
+        intermediate_steps.append({
+            "step": len(intermediate_steps) + 1,
+            "action": "ツール実行完了",
+            "details": f"ターン{turn}: {len(tool_calls)}件のツールを並行実行（" +
+                       ", ".join(f"{record['tool']}{' [キャッシュ]' if record['cache_hit'] else ''}" for record in records) + "）",
+            "turn": turn,
+            "llm_latency_ms": llm_latency_ms,
+            "tools_latency_ms": tools_latency_ms,
+            "turn_latency_ms": round(llm_latency_ms + tools_latency_ms, 1),
+            "tool_calls": records
+        })
+        completed_turns = turn
 
-            intermediate_steps.append({
-                "step": 5,
-                "action": "最終回答生成",
-                "details": "ツール結果を基に最終回答を生成しました"
-            })
-        else:
-            final_answer = f"未知のツール '{tool_name}' が呼び出されました"
-            intermediate_steps.append({
-                "step": 3,
-                "action": "エラー",
-                "details": f"未知のツール: {tool_name}"
-            })
-    else:
+    if final_answer is None:
+        # 最大ターン数に達した（または期限で打ち切った）場合は、ここまでのツール結果で回答させる
         if demo_mode:
-            print("2. LLMは直接回答を選択しました")
+            print("最大ターン数に達したため、ツール結果を基に最終回答を生成中...")
+
+        messages.append(HumanMessage(content="これ以上ツールは使用せず、ここまでのツール結果に基づいて質問に回答してください。"))
+        llm_started = time.perf_counter()
+        # ツールをバインドしないLLMで呼び出し、さらにツール呼び出しを返して回答が空になるのを防ぐ
+        with observe_stage("generate"):
+            final_response = await llm.ainvoke(messages)
+        llm_latency_ms = round((time.perf_counter() - llm_started) * 1000, 1)
+        messages.append(final_response)
+        final_answer = final_response.content or "最大ツール呼び出し回数に達したため、回答を生成できませんでした。"
+        intermediate_steps.append({
+            "step": len(intermediate_steps) + 1,
+            "action": "最終回答生成",
+            "details": (f"最大ターン数（{MAX_TOOL_TURNS}）に達したため" if completed_turns == MAX_TOOL_TURNS else
+                        f"期限までの残り時間が少ないため{completed_turns}ターンで打ち切り") + "、ツール結果を基に最終回答を生成しました",
+            "turn": completed_turns + 1,
+            "llm_latency_ms": llm_latency_ms,
+            "turn_latency_ms": llm_latency_ms
+        })
 
-        final_answer = response.content
-        intermediate_steps.append({"step": 3, "action": "直接回答", "details": "LLMはツールを使用せずに直接回答しました"})
+    # 実際にLLMに渡した会話（質問・ツール呼び出し・ツール結果）
+    actual_prompt = _format_conversation(messages)
 
     if demo_mode:
         print("\n最終回答:")
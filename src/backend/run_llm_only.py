@@ -5,14 +5,22 @@
 
 import asyncio
 import time
+from pathlib import Path
 from typing import Any, Dict
 
 from env_utils import create_vertex_ai_llm, setup_environment
+from metrics import observe_stage
 
 # 環境変数を読み込み
 setup_environment()
 
 
+def warm_up(knowledge_path: Path) -> Dict[str, Any]:
+    """起動時のウォームアップ：LLMクライアントを初期化する"""
+    create_vertex_ai_llm()
+    return {"llm": "initialized"}
+
+
 async def process_llm_only(query: str, demo_mode: bool = False) -> Dict[str, Any]:
     """LLM単体処理"""
 
@@ -46,7 +54,8 @@ async def process_llm_only(query: str, demo_mode: bool = False) -> Dict[str, Any
 === 回答 ===
 製品取扱説明書の内容に基づいて、正確な情報を提供してください。"""
 
-    response = llm.invoke(formatted_prompt)
+    with observe_stage("generate"):
+        response = await llm.ainvoke(formatted_prompt)
 
     if demo_mode:
         await asyncio.sleep(0.5)
@@ -4,15 +4,35 @@
 """
 
 import asyncio
+import math
+import re
+import threading
 import time
 from pathlib import Path
-from typing import Any, Dict
+from typing import Any, Dict, List, Set, Tuple
 
 from env_utils import create_vertex_ai_llm, setup_environment
+from knowledge_base import Section, extract_identifiers, load_knowledge, split_sections
+from metrics import observe_stage
+from token_utils import count_tokens
 
 # 環境変数を読み込み
 setup_environment()
 
+# バージョン -> (セクション, トークン数, 文字バイグラム集合, 識別子集合)
+_section_index_cache: Dict[str, Tuple[List[Section], List[int], List[Set[str]], List[Set[str]]]] = {}
+_section_index_lock = threading.Lock()
+_SECTION_INDEX_CACHE_SIZE = 4  # 保持するナレッジバージョン数の上限
+
+_IGNORED_CHARS = re.compile(r"[\s、。，．,.!?！？「」『』（）()\[\]:：*#\-]+")
+
+
+def warm_up(knowledge_path: Path) -> Dict[str, Any]:
+    """起動時のウォームアップ：ナレッジとセクション索引を読み込み、LLMクライアントを初期化する"""
+    version, sections = _get_section_index(knowledge_path)[:2]
+    create_vertex_ai_llm()
+    return {"knowledge_version": version, "sections": len(sections), "llm": "initialized"}
+
 
 async def process_prompt_stuffing(query: str,
                                   knowledge_path: Path,
@@ -29,8 +49,9 @@ async def process_prompt_stuffing(query: str,
         await asyncio.sleep(0.5)
 
     # knowledge.txtの全内容を読み込み
-    with open(knowledge_path, "r", encoding="utf-8") as f:
-        knowledge_content = f.read()
+    with observe_stage("load"):
+        with open(knowledge_path, "r", encoding="utf-8") as f:
+            knowledge_content = f.read()
 
     intermediate_steps.append({
         "step": "load_knowledge",
@@ -65,7 +86,8 @@ async def process_prompt_stuffing(query: str,
     # ChatVertexAIをgemini-2.5-flashモデルで初期化
     llm = create_vertex_ai_llm()
 
-    response = llm.invoke(prompt)
+    with observe_stage("generate"):
+        response = await llm.ainvoke(prompt)
 
     intermediate_steps.append({"step": "complete", "description": "処理完了", "timestamp": time.time()})
 
@@ -76,6 +98,161 @@ async def process_prompt_stuffing(query: str,
     }
 
 
+def _char_bigrams(text: str) -> Set[str]:
+    """空白・句読点を除いた文字バイグラム集合（日本語向けの軽量な語彙表現）"""
+    normalized = _IGNORED_CHARS.sub("", text.lower())
+    return {normalized[i:i + 2] for i in range(len(normalized) - 1)}
+
+
+def _get_section_index(knowledge_path: Path) -> Tuple[str, List[Section], List[int], List[Set[str]], List[Set[str]]]:
+    """ナレッジのセクション分割・トークン数・スコアリング用特徴量をバージョン単位でキャッシュして取得"""
+    content, version = load_knowledge(knowledge_path)
+
+    cached = _section_index_cache.get(version)
+    if cached is not None:
+        return (version,) + cached
+
+    sections = split_sections(content)
+    token_counts = [count_tokens(section.text.strip()) for section in sections]
+    bigrams = [_char_bigrams(section.text) for section in sections]
+    identifiers = [_identifier_set(section.text) for section in sections]
+
+    with _section_index_lock:
+        while len(_section_index_cache) >= _SECTION_INDEX_CACHE_SIZE:
+            _section_index_cache.pop(next(iter(_section_index_cache)))
+        _section_index_cache[version] = (sections, token_counts, bigrams, identifiers)
+    return version, sections, token_counts, bigrams, identifiers
+
+
+def _identifier_set(text: str) -> Set[str]:
+    """識別子の集合（英字の大小は区別しない）"""
+    return {identifier.lower() for identifier in extract_identifiers(text)}
+
+
+def _score_sections(query: str, sections: List[Section], bigrams: List[Set[str]],
+                    identifiers: List[Set[str]]) -> List[float]:
+    """クエリとの文字バイグラム一致（IDF重み付き）と識別子一致で各セクションをスコアリング"""
+    query_bigrams = _char_bigrams(query)
+    query_identifiers = _identifier_set(query)
+    section_count = len(sections)
+
+    # IDF: 多くのセクションに出現するバイグラムほど重みを下げる
+    idf = {}
+    for bigram in query_bigrams:
+        df = sum(1 for section_bigrams in bigrams if bigram in section_bigrams)
+        if df:
+            idf[bigram] = math.log(1 + section_count / df)
+
+    scores = []
+    for section, section_bigrams, section_identifiers in zip(sections, bigrams, identifiers):
+        score = sum(weight for bigram, weight in idf.items() if bigram in section_bigrams)
+        # 見出しに一致するバイグラムは追加で加点
+        title_bigrams = _char_bigrams(section.title)
+        score += sum(weight for bigram, weight in idf.items() if bigram in title_bigrams)
+        # エラーコードなどの識別子が一致するセクションを最優先
+        score += 100.0 * len(query_identifiers & section_identifiers)
+        scores.append(score)
+    return scores
+
+
+async def process_prompt_stuffing_budgeted(query: str,
+                                           knowledge_path: Path,
+                                           max_context_tokens: int,
+                                           demo_mode: bool = False) -> Dict[str, Any]:
+    """トークン予算付きプロンプトスタッフィング処理
+
+    `## ` セクション単位でクエリとの関連度順に並べ、予算内に収まるセクションだけを
+    元の文書順でプロンプトに埋め込む。
+    """
+
+    intermediate_steps = [{
+        "step": "initialize",
+        "description": "エンジンを初期化（トークン予算付き）",
+        "timestamp": time.time()
+    }]
+
+    if demo_mode:
+        await asyncio.sleep(0.5)
+
+    with observe_stage("load"):
+        version, sections, token_counts, bigrams, identifiers = _get_section_index(knowledge_path)
+
+    intermediate_steps.append({
+        "step": "load_knowledge",
+        "description": f"ナレッジを{len(sections)}個のセクションとして読み込み (バージョン: {version})",
+        "timestamp": time.time()
+    })
+
+    # 関連度順（同点は文書順）に予算内へ詰め込む
+    scores = _score_sections(query, sections, bigrams, identifiers)
+    ranked = sorted(range(len(sections)), key=lambda i: (-scores[i], i))
+
+    selected = []
+    used_tokens = 0
+    for i in ranked:
+        if used_tokens + token_counts[i] <= max_context_tokens:
+            selected.append(i)
+            used_tokens += token_counts[i]
+    selected.sort()
+
+    selected_set = set(selected)
+    dropped = [i for i in range(len(sections)) if i not in selected_set]
+    total_tokens = sum(token_counts)
+    knowledge_content = "\n\n".join(sections[i].text.strip() for i in selected)
+
+    intermediate_steps.append({
+        "step": "pack_sections",
+        "description": f"トークン予算{max_context_tokens}内に{len(selected)}/{len(sections)}個のセクションを選択",
+        "budget_stats": {
+            "max_context_tokens": max_context_tokens,
+            "knowledge_version": version,
+            "total_sections": len(sections),
+            "included_sections": len(selected),
+            "dropped_sections": len(dropped),
+            "total_tokens": total_tokens,
+            "included_tokens": used_tokens,
+            "dropped_tokens": total_tokens - used_tokens,
+            "dropped_ratio": round((total_tokens - used_tokens) / total_tokens, 3) if total_tokens else 0.0,
+            "included_titles": [sections[i].title for i in selected],
+            "dropped_titles": [sections[i].title for i in dropped]
+        },
+        "timestamp": time.time()
+    })
+
+    if demo_mode:
+        await asyncio.sleep(1.0)
+
+    # プロンプト作成（通常のプロンプトスタッフィングと同じ形式）
+    prompt = f"""以下の製品取扱説明書を参考にして、質問に答えてください。
+
+=== 製品取扱説明書 ===
+{knowledge_content}
+
+=== 質問 ===
+{query}
+
+=== 回答 ===
+製品取扱説明書の内容に基づいて、正確な情報を提供してください。"""
+
+    intermediate_steps.append({
+        "step": "create_prompt",
+        "description": "選択したセクションを含むプロンプトを作成",
+        "timestamp": time.time()
+    })
+
+    if demo_mode:
+        await asyncio.sleep(1.0)
+
+    llm = create_vertex_ai_llm()
+
+    with observe_stage("generate"):
+        response = await llm.ainvoke(prompt)
+
+    intermediate_steps.append({"step": "complete", "description": "処理完了", "timestamp": time.time()})
+
+    return {"response": response.content, "intermediate_steps": intermediate_steps, "actual_prompt": prompt}
+
+
 def main():
     """直接実行時のテスト用"""
     import asyncio
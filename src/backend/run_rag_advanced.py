@@ -7,22 +7,36 @@ import asyncio
 import re
 import time
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
 
+from adaptive_pipeline import decide_retrieval, describe_decision, get_adaptive_settings, get_adaptive_stats
+from chunk_store import ChunkStore
+from chunker import DEFAULT_CHUNK_CONFIG
+from context_compression import compress_context, get_compression_settings
+from deadline import DEGRADED_CONTEXT_CHUNKS, should_degrade
 from env_utils import create_vertex_ai_llm, setup_environment
+from inference_backend import load_cross_encoder
 from langchain.prompts import ChatPromptTemplate
 from langchain.schema.output_parser import StrOutputParser
 from langchain.schema.runnable import RunnablePassthrough
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import TextLoader
 from langchain_community.document_transformers import LongContextReorder
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_community.vectorstores import FAISS
-from sentence_transformers import CrossEncoder
+from metrics import observe_stage
+from vector_index import get_retrieval_index
 
 # 環境変数を読み込み
 setup_environment()
 
+CROSS_ENCODER_MODEL_NAME = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+
+# 検索・再ランキングのパラメータ（sweep_retrieval.pyで評価して決定する）
+# 拡張クエリごとに取得するチャンク数（再ランキング用に多めに取得）
+RETRIEVAL_K = 12
+# 再ランキングするチャンク数の上限と、最終的に使用するチャンク数
+RERANK_MAX_CANDIDATES = 20
+RERANK_TOP_K = 4
+# 再ランキング時にCrossEncoderへ渡すチャンクの最大文字数
+RERANK_MAX_CHARS = 800
+
 # CrossEncoderを グローバルに初期化してキャッシュ
 _cross_encoder = None
 
@@ -31,10 +45,24 @@ def get_cross_encoder():
     """CrossEncoderをシングルトンパターンで取得"""
     global _cross_encoder
     if _cross_encoder is None:
-        _cross_encoder = CrossEncoder('cross-encoder/ms-marco-MiniLM-L-6-v2')
+        # INFERENCE_BACKEND=onnx の場合は量子化済みONNXモデルをONNX Runtimeで実行する
+        _cross_encoder = load_cross_encoder(CROSS_ENCODER_MODEL_NAME)
     return _cross_encoder
 
 
+def warm_up(knowledge_path: Path) -> Dict[str, Any]:
+    """起動時のウォームアップ：インデックスとCrossEncoderを読み込み、LLMクライアントを初期化する"""
+    retrieval_index = get_retrieval_index(knowledge_path, DEFAULT_CHUNK_CONFIG)
+    get_cross_encoder()
+    create_vertex_ai_llm()
+    return {
+        "knowledge_version": retrieval_index.store.version,
+        "chunks": len(retrieval_index.store),
+        "cross_encoder": CROSS_ENCODER_MODEL_NAME,
+        "llm": "initialized"
+    }
+
+
 async def _generate_queries_optimized(question: str, llm: Any) -> List[str]:
     """最適化されたクエリ拡張（より短いプロンプト）"""
     expansion_prompt = ChatPromptTemplate.from_template("元の質問: {query}\n\n"
@@ -57,34 +85,33 @@ async def _generate_queries_optimized(question: str, llm: Any) -> List[str]:
     return expanded_queries[:3]  # 元のクエリ + 最大2つの追加クエリ（計3つに削減）
 
 
-def _rerank_documents_optimized(query: str, documents: List[Any], top_k: int = 4) -> List[Any]:
+def rerank_chunk_ids(query: str,
+                     chunk_ids: List[int],
+                     store: ChunkStore,
+                     top_k: int = RERANK_TOP_K,
+                     max_candidates: int = RERANK_MAX_CANDIDATES) -> List[int]:
     """CrossEncoderによる高精度再ランキング（高度RAGの核心機能）"""
-    if not documents:
-        return documents
+    if not chunk_ids:
+        return chunk_ids
 
     # キャッシュされたCrossEncoderを取得
     reranker = get_cross_encoder()
 
     # ドキュメント数を制限してパフォーマンス向上
-    max_candidates = min(20, len(documents))  # より多くの候補から選択
-    documents = documents[:max_candidates]
+    chunk_ids = chunk_ids[:max_candidates]
 
     # クエリとドキュメントのペアを作成
-    query_doc_pairs = []
-    for doc in documents:
-        content = doc.page_content if hasattr(doc, 'page_content') else str(doc)
-        # より多くのコンテンツを使用して精度向上（500→800）
-        content = content[:800] if len(content) > 800 else content
-        query_doc_pairs.append([query, content])
+    # より多くのコンテンツを使用して精度向上（500→800）
+    query_doc_pairs = [[query, store.text(chunk_id, max_chars=RERANK_MAX_CHARS)] for chunk_id in chunk_ids]
 
     # CrossEncoderでスコアを計算（これがベーシック版との違い）
     scores = reranker.predict(query_doc_pairs)
 
     # スコアでソートして上位を選択
-    scored_docs = list(zip(documents, scores))
-    scored_docs.sort(key=lambda x: x[1], reverse=True)
+    scored_ids = list(zip(chunk_ids, scores))
+    scored_ids.sort(key=lambda x: x[1], reverse=True)
 
-    return [doc for doc, _ in scored_docs[:top_k]]
+    return [chunk_id for chunk_id, _ in scored_ids[:top_k]]
 
 
 def _apply_long_context_reorder(documents: List[Any]) -> List[Any]:
@@ -109,8 +136,14 @@ async def process_rag_advanced(query: str,
                                knowledge_path: Path,
                                demo_mode: bool = False,
                                enable_query_expansion: bool = True,
-                               enable_reranking: bool = True) -> Dict[str, Any]:
-    """高度なRAG処理：Query Expansion + Re-ranking + Context Compression（最適化版）"""
+                               enable_reranking: bool = True,
+                               adaptive: Optional[bool] = None) -> Dict[str, Any]:
+    """
+    高度なRAG処理：Query Expansion + Re-ranking + Context Compression（最適化版）
+
+    adaptive=True（未指定時はADAPTIVE_RAG_ENABLED）の場合、元の質問での1回目の検索結果から
+    クエリ拡張・再ランキングの要否を判定し、不要なものを省略する（有効化フラグは上限として扱う）。
+    """
 
     intermediate_steps = [{
         "step": "initialize",
@@ -124,32 +157,59 @@ async def process_rag_advanced(query: str,
     # LLMを初期化（クエリ拡張で使用）
     llm = create_vertex_ai_llm()
 
-    # 1. ナレッジベース準備
-    loader = TextLoader(str(knowledge_path), encoding="utf-8")
-    documents = loader.load()
-
-    # テキスト分割
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=800, chunk_overlap=150, separators=["## ", "\n\n", "\n", "。", "、", " ", ""])
-    splits = text_splitter.split_documents(documents)
+    # 1. ナレッジベース準備（セクション単位のチャンク分割とベクトルインデックス、キャッシュ済みの結果を再利用）
+    with observe_stage("load"):
+        # 初回・ナレッジ変更後の構築でイベントループを止めないようスレッドで取得する
+        retrieval_index = await asyncio.to_thread(get_retrieval_index, knowledge_path, DEFAULT_CHUNK_CONFIG)
+    store = retrieval_index.store
 
     intermediate_steps.append({
         "step": "setup_vectorstore",
-        "description": f"ドキュメントを{len(splits)}個のチャンクに分割し、ベクトルストアを構築",
+        "description": f"ドキュメントを{len(store)}個のチャンクに分割し、ベクトルストアを構築",
         "timestamp": time.time()
     })
 
     if demo_mode:
         await asyncio.sleep(1.0)
 
-    # 2. ベクトルストア構築（検索数を調整）
-    embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-    vectorstore = FAISS.from_documents(splits, embeddings)
-    retriever = vectorstore.as_retriever(search_kwargs={"k": 12})  # 再ランキング用に多めに取得
+    # 2. 適応的なパイプライン制御：元の質問で1回目の検索を行い、クエリ拡張・再ランキングの要否を判定
+    adaptive_settings = get_adaptive_settings()
+    adaptive = adaptive_settings.enabled if adaptive is None else adaptive
+    first_pass: Optional[List[int]] = None
+    decision = None
+    # クエリ拡張・再ランキングを省略した理由（intermediate_stepsの表示用）
+    expansion_skip_reason = rerank_skip_reason = "高速モード"
+    if adaptive:
+        first_pass_scored = await retrieval_index.asearch_with_distances(query, RETRIEVAL_K)
+        first_pass = [chunk_id for chunk_id, _ in first_pass_scored]
+        decision = decide_retrieval(query, first_pass_scored, store, adaptive_settings)
+        get_adaptive_stats().record(decision)
+        enable_query_expansion = enable_query_expansion and decision.expand
+        enable_reranking = enable_reranking and decision.rerank
+        expansion_skip_reason = rerank_skip_reason = "高速経路"
+
+        intermediate_steps.append({
+            "step": "adaptive_decision",
+            "description": (f"{describe_decision(decision)}のため、"
+                            f"クエリ拡張を{'実行' if decision.expand else '省略'}・"
+                            f"再ランキングを{'実行' if decision.rerank else '省略'}"),
+            "decision": {
+                **decision._asdict(), "fast_path": decision.fast_path,
+                "top_score": round(decision.top_score, 4) if decision.top_score is not None else None,
+                "margin": round(decision.margin, 4) if decision.margin is not None else None
+            },
+            "timestamp": time.time()
+        })
+
+    # 期限までの残り時間が少ない場合はクエリ拡張を省略する（縮退の1段階目）
+    if enable_query_expansion and should_degrade("skip_expansion"):
+        enable_query_expansion = False
+        expansion_skip_reason = "期限による縮退"
 
     # 3. クエリ拡張（条件付き最適化版）
     if enable_query_expansion:
-        expanded_queries = await _generate_queries_optimized(query, llm)
+        with observe_stage("expand"):
+            expanded_queries = await _generate_queries_optimized(query, llm)
         intermediate_steps.append({
             "step": "query_expansion",
             "description": f"クエリを{len(expanded_queries)}個に拡張（最適化）",
@@ -160,7 +220,7 @@ async def process_rag_advanced(query: str,
         expanded_queries = [query]  # 元のクエリのみ
         intermediate_steps.append({
             "step": "query_expansion_skipped",
-            "description": "クエリ拡張をスキップ（高速モード）",
+            "description": f"クエリ拡張をスキップ（{expansion_skip_reason}）",
             "timestamp": time.time()
         })
 
@@ -168,56 +228,99 @@ async def process_rag_advanced(query: str,
         await asyncio.sleep(0.3)
 
     # 4. 複数クエリでドキュメント検索（検索数を削減）
-    all_retrieved_docs = []
-    seen_content = set()
-
-    for exp_query in expanded_queries:
-        docs = retriever.get_relevant_documents(exp_query)
-        for doc in docs:
+    # チャンクIDで受け渡し、テキストは再ランキングとプロンプト作成時にのみ取得する
+    all_retrieved_ids = []
+    seen_ids = set()
+
+    # 拡張クエリはまとめて投げ、他リクエストのクエリと同じバッチで埋め込む（1回目の検索済みの元の質問は再検索しない）
+    pending_queries = [exp_query for exp_query in expanded_queries if first_pass is None or exp_query != query]
+    results_per_query = await asyncio.gather(
+        *(retrieval_index.asearch(exp_query, RETRIEVAL_K) for exp_query in pending_queries))
+    if first_pass is not None:
+        results_per_query = [first_pass, *results_per_query]
+    for retrieved_ids in results_per_query:
+        for chunk_id in retrieved_ids:
             # 重複を除去
-            if doc.page_content not in seen_content:
-                all_retrieved_docs.append(doc)
-                seen_content.add(doc.page_content)
+            if chunk_id not in seen_ids:
+                all_retrieved_ids.append(chunk_id)
+                seen_ids.add(chunk_id)
 
     intermediate_steps.append({
         "step": "multi_query_retrieval",
-        "description": f"検索で{len(all_retrieved_docs)}個の候補ドキュメントを取得",
+        "description": f"検索で{len(all_retrieved_ids)}個の候補ドキュメントを取得",
         "timestamp": time.time()
     })
 
     if demo_mode:
         await asyncio.sleep(0.3)
 
+    # 期限までの残り時間が少ない場合は再ランキングを省略する（縮退の2段階目）
+    if enable_reranking and len(all_retrieved_ids) > 3 and should_degrade("skip_rerank"):
+        enable_reranking = False
+        rerank_skip_reason = "期限による縮退"
+
     # 5. CrossEncoderによる再ランキング（これが高度版の核心機能）
-    if enable_reranking and len(all_retrieved_docs) > 3:
-        reranked_docs = _rerank_documents_optimized(query, all_retrieved_docs, top_k=4)
+    if enable_reranking and len(all_retrieved_ids) > 3:
+        # CrossEncoderの推論はスレッドで実行する（イベントループを止めず、期限による打ち切りも効くようにする）
+        with observe_stage("rerank"):
+            reranked_ids = await asyncio.to_thread(rerank_chunk_ids, query, all_retrieved_ids, store)
         intermediate_steps.append({
             "step":
                 "reranking",
             "description":
-                f"CrossEncoderで{len(all_retrieved_docs)}個から上位{len(reranked_docs)}個を厳選（高度RAG）",
+                f"CrossEncoderで{len(all_retrieved_ids)}個から上位{len(reranked_ids)}個を厳選（高度RAG）",
             "timestamp":
                 time.time()
         })
     else:
-        reranked_docs = all_retrieved_docs[:4]  # 再ランキング無効時は上位4件
+        reranked_ids = all_retrieved_ids[:RERANK_TOP_K]  # 再ランキング無効時は検索順の上位
         intermediate_steps.append({
             "step": "reranking_skipped",
-            "description": f"再ランキングをスキップ、上位{len(reranked_docs)}個を選択（高速モード）",
+            "description": f"再ランキングをスキップ、上位{len(reranked_ids)}個を選択（{rerank_skip_reason}）",
             "timestamp": time.time()
         })
 
     if demo_mode:
         await asyncio.sleep(0.3)
 
-    # 6. Long Context Reorder（コンテキスト圧縮）
-    final_docs = _apply_long_context_reorder(reranked_docs)
-    context = "\n\n".join([doc.page_content for doc in final_docs])
+    # 6. Long Context Reorder + 抽出型のコンテキスト圧縮（関連度の高い文だけをトークン予算内で残す）
+    # 期限までの残り時間が少ない場合は使用するチャンク数を絞る（縮退の3段階目）
+    if len(reranked_ids) > DEGRADED_CONTEXT_CHUNKS and should_degrade(
+            "shrink_context", f"上位{DEGRADED_CONTEXT_CHUNKS}チャンクのみ使用"):
+        reranked_ids = reranked_ids[:DEGRADED_CONTEXT_CHUNKS]
+    final_ids = _apply_long_context_reorder(reranked_ids)
+    compression_settings = get_compression_settings()
+    if compression_settings["enabled"]:
+        with observe_stage("compress"):
+            compression = await compress_context(query,
+                                                 store.texts(final_ids),
+                                                 compression_settings["token_budget"],
+                                                 scorer=compression_settings["scorer"],
+                                                 cross_encoder_loader=get_cross_encoder)
+        context = compression.context
+        compression_stats = {
+            "applied": compression.applied,
+            "scorer": compression_settings["scorer"],
+            "token_budget": compression_settings["token_budget"],
+            "original_tokens": compression.original_tokens,
+            "compressed_tokens": compression.compressed_tokens,
+            "tokens_saved": compression.tokens_saved,
+            "total_sentences": compression.total_sentences,
+            "kept_sentences": compression.kept_sentences
+        }
+        description = (f"最適配置で{len(final_ids)}個のチャンクから{compression.kept_sentences}/{compression.total_sentences}文を抽出し、"
+                       f"{compression.original_tokens}→{compression.compressed_tokens}トークンに圧縮"
+                       if compression.applied else f"最適配置で{len(final_ids)}個のチャンクを使用（トークン予算内のため圧縮なし）")
+    else:
+        context = "\n\n".join(store.texts(final_ids))
+        compression_stats = None
+        description = f"最適配置で最終的に{len(final_ids)}個のチャンクを使用"
 
     intermediate_steps.append({
         "step": "context_compression",
-        "description": f"最適配置で最終的に{len(final_docs)}個のチャンクを使用",
-        "final_chunks_preview": [doc.page_content[:80] + "..." for doc in final_docs[:2]],
+        "description": description,
+        "final_chunks_preview": [store.text(chunk_id, max_chars=80) + "..." for chunk_id in final_ids[:2]],
+        "compression": compression_stats,
         "timestamp": time.time()
     })
 
@@ -246,7 +349,7 @@ async def process_rag_advanced(query: str,
         "step": "generate",
         "description": "最適化されたRAGパイプラインで回答を生成",
         "context_stats": {
-            "total_chunks": len(final_docs),
+            "total_chunks": len(final_ids),
             "total_characters": len(context),
             "expansion_queries_used": len(expanded_queries)
         },
@@ -256,8 +359,9 @@ async def process_rag_advanced(query: str,
     if demo_mode:
         await asyncio.sleep(0.3)
 
-    # 8. 回答生成
-    response = rag_chain.invoke(query)
+    # 8. 回答生成（期限で打ち切れるよう非同期で呼び出す）
+    with observe_stage("generate"):
+        response = await rag_chain.ainvoke(query)
 
     intermediate_steps.append({
         "step": "complete",
@@ -272,11 +376,14 @@ async def process_rag_advanced(query: str,
         "advanced_rag_stats": {
             "original_query": query,
             "expanded_queries": expanded_queries,
-            "initial_candidates": len(all_retrieved_docs),
-            "final_chunks": len(final_docs),
-            "reranking_applied": enable_reranking and len(all_retrieved_docs) > 3,
+            "initial_candidates": len(all_retrieved_ids),
+            "final_chunks": len(final_ids),
+            "reranking_applied": enable_reranking and len(all_retrieved_ids) > 3,
             "query_expansion_applied": enable_query_expansion,
             "context_reordering_applied": True,
+            "context_compression": compression_stats,
+            "adaptive_decision": decision.reason if decision else None,
+            "fast_path": decision.fast_path if decision else False,
             "optimization_mode": "high_performance"
         }
     }
@@ -8,18 +8,28 @@ import time
 from pathlib import Path
 from typing import Any, Dict
 
+from chunker import DEFAULT_CHUNK_CONFIG
+from deadline import DEGRADED_CONTEXT_CHUNKS, should_degrade
 from env_utils import create_vertex_ai_llm, setup_environment
 from langchain.prompts import ChatPromptTemplate
 from langchain.schema.output_parser import StrOutputParser
 from langchain.schema.runnable import RunnablePassthrough
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import TextLoader
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_community.vectorstores import FAISS
+from metrics import observe_stage
+from vector_index import get_retrieval_index
 
 # 環境変数を読み込み
 setup_environment()
 
+# 検索で取得するチャンク数（sweep_retrieval.pyで評価して決定する）
+RETRIEVAL_K = 5
+
+
+def warm_up(knowledge_path: Path) -> Dict[str, Any]:
+    """起動時のウォームアップ：埋め込みモデル・チャンクストア・インデックスを構築し、LLMクライアントを初期化する"""
+    retrieval_index = get_retrieval_index(knowledge_path, DEFAULT_CHUNK_CONFIG)
+    create_vertex_ai_llm()
+    return {"knowledge_version": retrieval_index.store.version, "chunks": len(retrieval_index.store), "llm": "initialized"}
+
 
 async def process_rag_only(query: str,
                            knowledge_path: Path,
@@ -36,36 +46,29 @@ async def process_rag_only(query: str,
         await asyncio.sleep(0.5)
 
     # 1. ナレッジベース準備
-    loader = TextLoader(str(knowledge_path), encoding="utf-8")
-    documents = loader.load()
-
-    # テキスト分割 - セクション境界を考慮し、より大きなチャンクサイズを使用
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=800,  # チャンクサイズを大きくしてコンテキストを保持
-        chunk_overlap=150,  # オーバーラップを増やして情報の断片化を防ぐ
-        separators=["## ", "\n\n", "\n", "。", "、", " ", ""]  # セクションヘッダーを優先
-    )
-    splits = text_splitter.split_documents(documents)
+    # セクション境界で分割し、大きめのチャンク（800文字/オーバーラップ150文字）でコンテキストを保持
+    # チャンクストアとベクトルインデックスはナレッジの内容が変わるまでキャッシュされる
+    with observe_stage("load"):
+        # 初回・ナレッジ変更後の構築でイベントループを止めないようスレッドで取得する
+        retrieval_index = await asyncio.to_thread(get_retrieval_index, knowledge_path, DEFAULT_CHUNK_CONFIG)
+        store = retrieval_index.store
 
     intermediate_steps.append({
         "step": "setup_vectorstore",
-        "description": f"ドキュメントを{len(splits)}個のチャンクに分割し、ベクトルストアを構築",
+        "description": f"ドキュメントを{len(store)}個のチャンクに分割し、ベクトルストアを構築",
         "timestamp": time.time()
     })
 
     if demo_mode:
         await asyncio.sleep(1.5)
 
-    # 2. ベクトルストア構築
-    embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-    vectorstore = FAISS.from_documents(splits, embeddings)
-    # 検索結果を増やして検索精度を向上（最大5つのチャンクを取得）
-    max_chunks = min(5, len(splits))
-    retriever = vectorstore.as_retriever(search_kwargs={"k": max_chunks})
+    # 2. 検索数の決定
+    # 検索結果を増やして検索精度を向上（最大RETRIEVAL_K個のチャンクを取得）
+    max_chunks = min(RETRIEVAL_K, len(store))
 
     # 3. 検索実行（改良版ハイブリッド検索）
-    # ベクトル検索を実行
-    retrieved_docs = retriever.get_relevant_documents(query)
+    # ベクトル検索を実行（以降はチャンクIDで受け渡し、テキストはプロンプト作成時にのみ取得）
+    retrieved_ids = await retrieval_index.asearch(query, max_chunks)
 
     # クエリに「メンテナンス」「定期」などのキーワードが含まれる場合の特別処理
     maintenance_keywords = ["メンテナンス", "定期", "保守", "点検", "交換", "清掃"]
@@ -73,17 +76,14 @@ async def process_rag_only(query: str,
 
     if is_maintenance_query:
         # メンテナンス関連のチャンクを明示的に検索
-        maintenance_docs = []
-        for doc in splits:
-            if any(keyword in doc.page_content for keyword in maintenance_keywords):
-                maintenance_docs.append(doc)
+        maintenance_ids = store.find_containing(maintenance_keywords)
 
         # メンテナンス関連チャンクの中から最も関連性の高いものを追加
-        existing_content = {doc.page_content for doc in retrieved_docs}
-        for doc in maintenance_docs:
-            if doc.page_content not in existing_content:
-                retrieved_docs.append(doc)
-                if len(retrieved_docs) >= max_chunks:
+        existing_ids = set(retrieved_ids)
+        for chunk_id in maintenance_ids:
+            if chunk_id not in existing_ids:
+                retrieved_ids.append(chunk_id)
+                if len(retrieved_ids) >= max_chunks:
                     break
 
     # キーワード検索も実行（特定のエラーコードを探す場合）
@@ -91,27 +91,27 @@ async def process_rag_only(query: str,
     error_codes = re.findall(r'E-\d+', query)
     if error_codes:
         # エラーコードが含まれるチャンクを明示的に検索
-        keyword_docs = []
-        for doc in splits:
-            for error_code in error_codes:
-                if error_code in doc.page_content:
-                    keyword_docs.append(doc)
-                    break
+        keyword_ids = store.find_containing(error_codes)
 
         # キーワード検索の結果をベクトル検索結果に追加（重複を避ける）
-        existing_content = {doc.page_content for doc in retrieved_docs}
-        for doc in keyword_docs:
-            if doc.page_content not in existing_content:
-                retrieved_docs.append(doc)
-                if len(retrieved_docs) >= max_chunks:
+        existing_ids = set(retrieved_ids)
+        for chunk_id in keyword_ids:
+            if chunk_id not in existing_ids:
+                retrieved_ids.append(chunk_id)
+                if len(retrieved_ids) >= max_chunks:
                     break
 
-    context = "\n\n".join([doc.page_content for doc in retrieved_docs])
+    # 期限までの残り時間が少ない場合は使用するチャンク数を絞る
+    if len(retrieved_ids) > DEGRADED_CONTEXT_CHUNKS and should_degrade(
+            "shrink_context", f"上位{DEGRADED_CONTEXT_CHUNKS}チャンクのみ使用"):
+        retrieved_ids = retrieved_ids[:DEGRADED_CONTEXT_CHUNKS]
+
+    context = "\n\n".join(store.texts(retrieved_ids))
 
     # デバッグ情報を追加
-    search_debug_info = f"検索されたチャンク: {len(retrieved_docs)}個"
-    if retrieved_docs:
-        search_debug_info += f", 最初のチャンク内容の一部: {retrieved_docs[0].page_content[:100]}..."
+    search_debug_info = f"検索されたチャンク: {len(retrieved_ids)}個"
+    if retrieved_ids:
+        search_debug_info += f", 最初のチャンク内容の一部: {store.text(retrieved_ids[0], max_chars=100)}..."
     if error_codes:
         search_debug_info += f", 検索されたエラーコード: {', '.join(error_codes)}"
     if is_maintenance_query:
@@ -119,7 +119,7 @@ async def process_rag_only(query: str,
 
     intermediate_steps.append({
         "step": "retrieve",
-        "description": f"関連する{len(retrieved_docs)}個のチャンクを検索",
+        "description": f"関連する{len(retrieved_ids)}個のチャンクを検索",
         "debug_info": search_debug_info,
         "retrieved_content_preview": context[:200] + "..." if len(context) > 200 else context,
         "timestamp": time.time()
@@ -158,8 +158,9 @@ async def process_rag_only(query: str,
     if demo_mode:
         await asyncio.sleep(1.0)
 
-    # 5. 回答生成
-    response = rag_chain.invoke(query)
+    # 5. 回答生成（期限で打ち切れるよう非同期で呼び出す）
+    with observe_stage("generate"):
+        response = await rag_chain.ainvoke(query)
 
     intermediate_steps.append({"step": "complete", "description": "処理完了", "timestamp": time.time()})
 
@@ -4,76 +4,66 @@
 """
 
 import asyncio
+import threading
+import time
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, Dict, List, NamedTuple, Optional
 
+from chunker import FANCALL_CHUNK_CONFIG
+from deadline import should_degrade
 from env_utils import create_vertex_ai_llm, setup_environment
 from langchain.agents import AgentExecutor, create_tool_calling_agent
+from langchain.callbacks import StdOutCallbackHandler
 from langchain.prompts import ChatPromptTemplate
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.tools import tool
-from langchain_community.document_loaders import TextLoader
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_community.vectorstores import FAISS
+from langchain.tools import BaseTool, tool
+from metrics import observe_stage
+from tool_cache import cached_tool, start_tool_cache_trace
+from vector_index import RetrievalIndex, get_retrieval_index
 
 # 環境変数を読み込み
 setup_environment()
 
-# グローバル変数でretrieverを保持
-retriever = None
+# 検索ツールが返すチャンク数（sweep_retrieval.pyで評価して決定する）
+RETRIEVAL_K = 3
 
+# 期限までの残り時間が少ない場合のエージェントの最大反復回数（ツール呼び出し1回 + 回答）
+DEGRADED_MAX_ITERATIONS = 2
 
-def setup_rag_retriever(knowledge_file: Path):
-    """RAG用のretrieverを設定"""
-    global retriever
+SYSTEM_PROMPT = ("あなたは製品「Auto-Welder V3」の技術サポート担当者です。"
+                 "利用可能なツールを使用して、製品取扱説明書の内容に基づいて正確で有用な回答を提供してください。"
+                 "質問に関連する情報をツールで検索し、その内容を参考にして回答してください。"
+                 "必要に応じて複数のツールを組み合わせて使用することができます。")
 
-    print("   RAG Retrieverを準備中...")
 
-    # ドキュメント読み込み
-    loader = TextLoader(str(knowledge_file), encoding="utf-8")
-    documents = loader.load()
+def make_search_knowledge_base(retrieval_index: RetrievalIndex) -> BaseTool:
+    """指定した検索インデックスに束縛されたナレッジ検索ツールを作成"""
 
-    # テキスト分割
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=500,
-                                                   chunk_overlap=50,
-                                                   separators=["\n\n", "\n", "。", "、", " ", ""])
-    splits = text_splitter.split_documents(documents)
-
-    # ベクトルストア構築
-    embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-    vectorstore = FAISS.from_documents(splits, embeddings)
-    retriever = vectorstore.as_retriever(search_kwargs={"k": 3})
-
-    print(f"   RAG準備完了（{len(splits)}個のチャンク）")
-    return len(splits)
-
-
-@tool
-def search_knowledge_base(query: str) -> str:
-    """製品取扱説明書のナレッジベースを高度な意味検索で検索します。
-    
-    Args:
-        query: 検索したい内容を表すクエリ
+    @tool
+    @cached_tool(version_fn=lambda: retrieval_index.store.version)
+    def search_knowledge_base(query: str) -> str:
+        """製品取扱説明書のナレッジベースを高度な意味検索で検索します。
         
-    Returns:
-        関連する情報のテキスト
-    """
-    global retriever
+        Args:
+            query: 検索したい内容を表すクエリ
+            
+        Returns:
+            関連する情報のテキスト
+        """
+        # RAGの検索インデックスを使用して検索
+        with observe_stage("tool_call"):
+            chunk_ids = retrieval_index.search(query, RETRIEVAL_K)
 
-    if retriever is None:
-        return "エラー: ナレッジベースが初期化されていません"
+        if chunk_ids:
+            result = "\n\n".join(retrieval_index.store.texts(chunk_ids))
+            return f"検索結果:\n{result}"
+        else:
+            return f"'{query}'に関する情報は見つかりませんでした。"
 
-    # RAGのretrieverを使用して検索
-    docs = retriever.invoke(query)
-
-    if docs:
-        result = "\n\n".join([doc.page_content for doc in docs])
-        return f"検索結果:\n{result}"
-    else:
-        return f"'{query}'に関する情報は見つかりませんでした。"
+    return search_knowledge_base
 
 
 @tool
+@cached_tool()
 def get_robot_serial_number() -> str:
     """ロボットのシリアル番号を取得します。
     
@@ -84,6 +74,76 @@ def get_robot_serial_number() -> str:
     return "AW3-2024-001255"
 
 
+class AgentSnapshot(NamedTuple):
+    """ナレッジの1バージョンに束縛された、構築済みで不変のエージェント一式"""
+    version: str
+    retrieval_index: RetrievalIndex
+    tools: List[BaseTool]
+    agent_executor: AgentExecutor
+    build_seconds: float
+
+
+def build_agent_snapshot(retrieval_index: RetrievalIndex) -> AgentSnapshot:
+    """検索インデックスからツール・プロンプト・エージェントを構築"""
+    started = time.perf_counter()
+
+    # LLMを初期化
+    llm = create_vertex_ai_llm()
+
+    # ツールリストを定義（検索ツールはこのスナップショットの検索インデックスに束縛）
+    tools = [make_search_knowledge_base(retrieval_index), get_robot_serial_number]
+
+    # エージェント用のプロンプトテンプレート
+    prompt = ChatPromptTemplate.from_messages([("system", SYSTEM_PROMPT), ("placeholder", "{chat_history}"),
+                                               ("human", "{input}"), ("placeholder", "{agent_scratchpad}")])
+    # ツール呼び出しエージェントを作成
+    agent = create_tool_calling_agent(llm, tools, prompt)
+    agent_executor = AgentExecutor(agent=agent, tools=tools)
+
+    return AgentSnapshot(version=retrieval_index.store.version,
+                         retrieval_index=retrieval_index,
+                         tools=tools,
+                         agent_executor=agent_executor,
+                         build_seconds=time.perf_counter() - started)
+
+
+# 現在のエージェントスナップショット（参照の差し替えのみで更新し、読み取り側はロックを取らない）
+_current_snapshot: Optional[AgentSnapshot] = None
+_build_lock = threading.Lock()
+
+
+def get_agent_snapshot(knowledge_file: Path) -> AgentSnapshot:
+    """
+    現在のナレッジに対応するエージェントスナップショットを取得
+
+    ナレッジが変わっていなければ構築済みのスナップショットをそのまま返す。
+    変わっていれば新しいスナップショットを構築して参照を差し替える。実行中のリクエストは
+    取得済みのスナップショット（旧インデックス）を最後まで使い続ける。
+    """
+    global _current_snapshot
+
+    # チャンク分割とベクトルインデックス構築（ナレッジが変わるまでキャッシュ済みの結果を再利用）
+    retrieval_index = get_retrieval_index(knowledge_file, FANCALL_CHUNK_CONFIG)
+    snapshot = _current_snapshot
+    if snapshot is not None and snapshot.retrieval_index is retrieval_index:
+        return snapshot
+
+    with _build_lock:
+        snapshot = _current_snapshot
+        if snapshot is None or snapshot.retrieval_index is not retrieval_index:
+            print("   RAG + Function Callingエージェントを構築中...")
+            snapshot = build_agent_snapshot(retrieval_index)
+            _current_snapshot = snapshot
+            print(f"   エージェント構築完了（{len(retrieval_index.store)}個のチャンク, {snapshot.build_seconds:.2f}秒）")
+    return snapshot
+
+
+def warm_up(knowledge_path: Path) -> Dict[str, Any]:
+    """起動時のウォームアップ：検索インデックスとエージェントスナップショットを構築する"""
+    snapshot = get_agent_snapshot(knowledge_path)
+    return {"knowledge_version": snapshot.version, "chunks": len(snapshot.retrieval_index.store), "llm": "initialized"}
+
+
 async def process_rag_plus_function_calling(user_query: str,
                                             knowledge_file: Path,
                                             demo_mode: bool = False) -> Dict[str, Any]:
@@ -102,46 +162,24 @@ async def process_rag_plus_function_calling(user_query: str,
     if demo_mode:
         print("=== 実装5: RAG + Function Calling ===")
 
-    # 1. RAG Retrieverの準備
+    # 1. エージェントスナップショットの取得（ナレッジ更新時のみ構築）
     if demo_mode:
-        print("1. RAG Retrieverを準備中...")
+        print("1. エージェントスナップショットを取得中...")
 
-    chunk_count = setup_rag_retriever(knowledge_file)
+    # 初回・ナレッジ変更後の構築でイベントループを止めないようスレッドで取得する
+    snapshot = await asyncio.to_thread(get_agent_snapshot, knowledge_file)
     intermediate_steps.append({
         "step": 1,
         "action": "RAG Retriever準備完了",
-        "details": f"ナレッジベースを{chunk_count}個のチャンクに分割"
+        "details": f"ナレッジベースを{len(snapshot.retrieval_index.store)}個のチャンクに分割"
+                   f"（ナレッジバージョン: {snapshot.version}）"
     })
 
-    # 2. エージェントの構築
-    if demo_mode:
-        print("2. エージェントを構築中...")
-
-    # LLMを初期化
-    llm = create_vertex_ai_llm()
-
-    # ツールリストを定義
-    tools = [search_knowledge_base, get_robot_serial_number]
-
-    # エージェント用のプロンプトテンプレート
-    prompt = ChatPromptTemplate.from_messages([("system", "あなたは製品「Auto-Welder V3」の技術サポート担当者です。"
-                                                "利用可能なツールを使用して、製品取扱説明書の内容に基づいて正確で有用な回答を提供してください。"
-                                                "質問に関連する情報をツールで検索し、その内容を参考にして回答してください。"
-                                                "必要に応じて複数のツールを組み合わせて使用することができます。"),
-                                               ("placeholder", "{chat_history}"),
-                                               ("human", "{input}"),
-                                               ("placeholder", "{agent_scratchpad}")])
-    # ツール呼び出しエージェントを作成
-    agent = create_tool_calling_agent(llm, tools, prompt)
-    agent_executor = AgentExecutor(agent=agent, tools=tools, verbose=demo_mode)
-
-    if demo_mode:
-        print("   エージェントの構築が完了しました")
-
+    # 2. エージェントは構築済みのものを再利用
     intermediate_steps.append({
         "step": 2,
-        "action": "エージェント構築完了",
-        "details": f"ツール数: {len(tools)}, プロンプトテンプレート設定完了"
+        "action": "エージェント準備完了",
+        "details": f"ツール数: {len(snapshot.tools)}, 構築済みエージェントを再利用（構築時間: {snapshot.build_seconds:.2f}秒）"
     })
 
     # 3. 質問実行
@@ -149,8 +187,17 @@ async def process_rag_plus_function_calling(user_query: str,
         print(f"\n質問: {user_query}")
         print("-" * 70)
 
-    # エージェントで実行
-    response = agent_executor.invoke({"input": user_query})
+    # ツール結果キャッシュの参照をこのリクエスト分だけ記録
+    cache_trace = start_tool_cache_trace()
+
+    # エージェントで実行（共有のエージェントは変更せず、デモモードの詳細出力はリクエスト単位のコールバックで行う）
+    config = {"callbacks": [StdOutCallbackHandler()]} if demo_mode else None
+    agent_executor = snapshot.agent_executor
+    # 期限までの残り時間が少ない場合は、反復回数を絞ったコピーで実行する（共有のエージェントは変更しない）
+    if should_degrade("cap_agent_iterations", f"最大{DEGRADED_MAX_ITERATIONS}回に制限"):
+        agent_executor = agent_executor.copy(update={"max_iterations": DEGRADED_MAX_ITERATIONS})
+    with observe_stage("agent"):
+        response = await agent_executor.ainvoke({"input": user_query}, config=config)
     final_answer = response["output"]
 
     # 実際のプロンプトを構築（エージェントが使用する基本的なプロンプト）
@@ -166,6 +213,15 @@ async def process_rag_plus_function_calling(user_query: str,
         "details": "LLMエージェントが質問に対する回答を生成しました"
     })
 
+    if cache_trace:
+        cache_hits = sum(1 for entry in cache_trace if entry["cache_hit"])
+        intermediate_steps.append({
+            "step": 4,
+            "action": "ツール結果キャッシュ",
+            "details": f"ツール呼び出し{len(cache_trace)}件中{cache_hits}件をキャッシュから返却",
+            "tool_calls": cache_trace
+        })
+
     if demo_mode:
         print("\n" + "=" * 70)
         print("最終回答:")
@@ -0,0 +1,60 @@
+"""
+複数ワーカーでのAPIサーバー起動 (serve.py)
+目的: 検索インデックスとチャンクストアを1回だけ構築して共有ディレクトリに公開し、
+各ワーカーがそれを読み取り専用でメモリマップする構成でuvicornを複数ワーカー起動する。
+
+起動の流れ:
+    1. 別プロセスで python shared_index.py publish を実行（埋め込みモデルを親プロセスに残さない）
+    2. Prometheusのマルチプロセス用ディレクトリを初期化（/metrics は全ワーカーの集計を返す）
+    3. SHARED_INDEX=true で uvicorn を --workers N 相当で起動
+
+ナレッジを更新した場合は、サーバーを止めずに python shared_index.py publish を再実行すれば、
+各ワーカーが次のリクエストで新しいスナップショットに切り替わる。
+なお、クエリ埋め込みやツール結果などのプロセス内キャッシュと /stats/* の統計はワーカーごとの値になる。
+
+使用例:
+    python serve.py --workers 4
+    python serve.py --workers 4 --skip-publish
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+import uvicorn
+
+BACKEND_DIR = Path(__file__).parent
+DEFAULT_METRICS_DIR = BACKEND_DIR.parent.parent / "cache" / "prometheus_multiproc"
+
+
+def main():
+    """直接実行用"""
+    parser = argparse.ArgumentParser(description="共有インデックスを使った複数ワーカーでのAPIサーバー起動")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="ワーカープロセス数")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--skip-publish", action="store_true", help="公開済みのスナップショットをそのまま使う")
+    args = parser.parse_args()
+
+    if not args.skip_publish:
+        print("📦 共有インデックスを構築・公開中...")
+        subprocess.run([sys.executable, str(BACKEND_DIR / "shared_index.py"), "publish"], cwd=BACKEND_DIR, check=True)
+
+    # 前回起動時のワーカーのメトリクスファイルが残らないよう、起動ごとに空にする
+    metrics_dir = Path(os.getenv("PROMETHEUS_MULTIPROC_DIR", DEFAULT_METRICS_DIR))
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    metrics_dir.mkdir(parents=True, exist_ok=True)
+
+    # ワーカーは環境変数を引き継いで起動される（prometheus_clientはインポート時に参照するため、起動前に設定する）
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = str(metrics_dir)
+    os.environ["SHARED_INDEX"] = "true"
+
+    print(f"🚀 {args.workers}ワーカーで起動します（共有インデックス使用）")
+    uvicorn.run("main:app", host=args.host, port=args.port, workers=args.workers, log_level="info")
+
+
+if __name__ == "__main__":
+    main()
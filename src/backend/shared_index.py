@@ -0,0 +1,217 @@
+"""
+複数ワーカーで共有する読み取り専用の検索インデックス
+チャンクストアとFAISSインデックスを1回だけ構築してスナップショットとしてディレクトリに保存し、
+各ワーカープロセスはそれを読み取り専用でメモリマップする。同じファイルのページは全ワーカーで
+共有されるため、ワーカーを増やしても増えるのは主にモデルの重みで、コーパス分のメモリは増えない。
+
+ディレクトリ構成（スロット = ナレッジのパス・チャンク設定・インデックス設定の組）:
+    SHARED_INDEX_DIR/<スロット>/CURRENT          現在のスナップショット名（os.replaceで原子的に差し替え）
+    SHARED_INDEX_DIR/<スロット>/<スナップショット>/  chunks.utf8, *.bin, chunks.json, index.faiss
+
+新しいバージョンの公開はスナップショットを書き終えてからCURRENTを差し替えるだけで、
+各ワーカーは次のリクエストでCURRENTの変化を検知して新しいスナップショットを開く。
+PUT /knowledge でknowledge.txtを更新した場合は、更新を受けたワーカーが公開し直す。
+
+使用例:
+    python shared_index.py publish
+    python shared_index.py publish --knowledge ../../data/knowledge.txt
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import faiss
+from chunk_store import ChunkStore
+from chunker import DEFAULT_CHUNK_CONFIG, FANCALL_CHUNK_CONFIG, ChunkConfig
+from vector_index import IndexConfig, RetrievalIndex, get_index_config, get_retrieval_index
+
+SHARED_INDEX_DIR = Path(os.getenv("SHARED_INDEX_DIR", Path(__file__).parent.parent.parent / "cache" / "shared_index"))
+CURRENT_FILE = "CURRENT"
+# 公開後も残すスナップショット数（差し替え直後に旧スナップショットで処理中のリクエストがあるため）
+KEEP_SNAPSHOTS = 2
+
+# RAG系モードが使用するチャンク設定（公開の既定対象）
+RAG_CHUNK_CONFIGS = (DEFAULT_CHUNK_CONFIG, FANCALL_CHUNK_CONFIG)
+
+
+def default_knowledge_source() -> Path:
+    """RAG系モードの検索対象（main.pyのRAG_KNOWLEDGE_SOURCEと同じ決め方）"""
+    if os.getenv("KNOWLEDGE_DIR"):
+        return Path(os.environ["KNOWLEDGE_DIR"])
+    return Path(__file__).parent.parent.parent / "data" / "knowledge.txt"
+
+
+def slot_name(knowledge_path: Path, config: ChunkConfig, index_config: IndexConfig) -> str:
+    """ナレッジのパス・チャンク設定・インデックス設定からスロット名を決める"""
+    key = repr((str(Path(knowledge_path).resolve()), tuple(config), tuple(index_config)))
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+
+def _mmap_read_flags() -> int:
+    """FAISSインデックスをメモリマップで読み込むフラグ"""
+    # IO_FLAG_MMAPはIVFの転置リストを、IO_FLAG_MMAP_IFC（faiss 1.9以降）はFlat系のベクトルをメモリマップする
+    return faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY | getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+
+
+def _write_current(slot_dir: Path, snapshot_name: str):
+    """CURRENTを一時ファイル経由で原子的に差し替える"""
+    tmp_path = slot_dir / f"{CURRENT_FILE}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(snapshot_name)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, slot_dir / CURRENT_FILE)
+
+
+def _prune_snapshots(slot_dir: Path, keep: int):
+    """古いスナップショットを削除（メモリマップ中のファイルを削除できない環境では残す）"""
+    snapshots = sorted((path for path in slot_dir.iterdir() if path.is_dir() and not path.name.startswith(".")),
+                       key=lambda path: path.stat().st_mtime)
+    for path in snapshots[:-keep]:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def publish_snapshot(knowledge_path: Path,
+                     config: ChunkConfig,
+                     index_config: Optional[IndexConfig] = None,
+                     root: Path = SHARED_INDEX_DIR) -> Path:
+    """
+    検索インデックスを構築してスナップショットとして公開する
+
+    Returns:
+        公開したスナップショットのディレクトリ
+    """
+    index_config = index_config or get_index_config()
+    # 公開済みのスナップショットではなく、現在のナレッジから構築したインデックスを公開する
+    retrieval_index = get_retrieval_index(knowledge_path, config, index_config, use_shared=False,
+                                          wait_for_current=True)
+
+    slot_dir = root / slot_name(knowledge_path, config, index_config)
+    slot_dir.mkdir(parents=True, exist_ok=True)
+    snapshot_name = f"{retrieval_index.version}-{time.strftime('%Y%m%d%H%M%S')}-{os.getpid()}"
+
+    # 書きかけのスナップショットをワーカーが開かないよう、一時ディレクトリに書いてから名前を変える
+    tmp_dir = slot_dir / f".{snapshot_name}.tmp"
+    retrieval_index.store.save(tmp_dir)
+    faiss.write_index(retrieval_index.index, str(tmp_dir / "index.faiss"))
+    with open(tmp_dir / "snapshot.json", "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "knowledge_path": str(Path(knowledge_path).resolve()),
+                "chunk_config": config._asdict(),
+                "index_config": retrieval_index.index_config._asdict(),
+                "published_at": time.strftime("%Y-%m-%dT%H:%M:%S")
+            },
+            f,
+            ensure_ascii=False,
+            indent=4)
+    snapshot_dir = slot_dir / snapshot_name
+    os.replace(tmp_dir, snapshot_dir)
+
+    _write_current(slot_dir, snapshot_name)
+    _prune_snapshots(slot_dir, KEEP_SNAPSHOTS)
+    return snapshot_dir
+
+
+def publish_all(knowledge_path: Path) -> List[Path]:
+    """RAG系モードが使用する全チャンク設定のスナップショットを公開する"""
+    return [publish_snapshot(knowledge_path, config) for config in RAG_CHUNK_CONFIGS]
+
+
+def open_snapshot(snapshot_dir: Path) -> RetrievalIndex:
+    """スナップショットを読み取り専用で開く"""
+    store = ChunkStore.open(snapshot_dir)
+    index_path = str(snapshot_dir / "index.faiss")
+    try:
+        index = faiss.read_index(index_path, _mmap_read_flags())
+    except RuntimeError:
+        # メモリマップに対応しないインデックス種別・faissのバージョンでは通常の読み込みに戻す
+        index = faiss.read_index(index_path)
+    with open(snapshot_dir / "snapshot.json", "r", encoding="utf-8") as f:
+        index_config = IndexConfig(**json.load(f)["index_config"])
+    return RetrievalIndex(store, index, index_config)
+
+
+class SharedIndexReader:
+    """1スロットのCURRENTを監視し、変化したときだけ新しいスナップショットを開く"""
+
+    def __init__(self, slot_dir: Path):
+        self.slot_dir = slot_dir
+        self._stamp: Optional[Tuple[int, int, int]] = None
+        self._snapshot_name: Optional[str] = None
+        self._retrieval_index: Optional[RetrievalIndex] = None
+        self._lock = threading.Lock()
+
+    def get(self) -> Optional[RetrievalIndex]:
+        """現在のスナップショットの検索インデックス（未公開の場合はNone）"""
+        try:
+            stat = (self.slot_dir / CURRENT_FILE).stat()
+        except FileNotFoundError:
+            return None
+        # os.replaceで差し替えるとinodeとmtimeが変わるため、stat1回で変化を検知できる
+        stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if stamp == self._stamp:
+            return self._retrieval_index
+
+        with self._lock:
+            if stamp != self._stamp:
+                snapshot_name = (self.slot_dir / CURRENT_FILE).read_text(encoding="utf-8").strip()
+                if snapshot_name != self._snapshot_name:
+                    # 旧スナップショットは処理中のリクエストが参照し終えるまで閉じない
+                    self._retrieval_index = open_snapshot(self.slot_dir / snapshot_name)
+                    self._snapshot_name = snapshot_name
+                    print(f"📂 共有インデックスを読み込みました: {snapshot_name} ({len(self._retrieval_index.store)}チャンク)")
+                self._stamp = stamp
+        return self._retrieval_index
+
+
+# スロット名 -> SharedIndexReader
+_readers: Dict[str, SharedIndexReader] = {}
+_readers_lock = threading.Lock()
+_warned_slots = set()
+
+
+def get_shared_retrieval_index(knowledge_path: Path, config: ChunkConfig,
+                               index_config: IndexConfig) -> Optional[RetrievalIndex]:
+    """
+    公開済みの共有インデックスを取得する
+
+    スロットが未公開の場合はNoneを返す（呼び出し側はプロセス内で構築する）。
+    """
+    name = slot_name(knowledge_path, config, index_config)
+    reader = _readers.get(name)
+    if reader is None:
+        with _readers_lock:
+            reader = _readers.setdefault(name, SharedIndexReader(SHARED_INDEX_DIR / name))
+
+    retrieval_index = reader.get()
+    if retrieval_index is None and name not in _warned_slots:
+        _warned_slots.add(name)
+        print(f"⚠️ 共有インデックスが未公開のため、このプロセスで構築します: {knowledge_path} "
+              f"(chunk_size={config.chunk_size})。python shared_index.py publish で公開できます")
+    return retrieval_index
+
+
+def main():
+    """直接実行用"""
+    parser = argparse.ArgumentParser(description="複数ワーカーで共有する検索インデックスの公開")
+    parser.add_argument("command", choices=["publish"])
+    parser.add_argument("--knowledge", type=Path, default=default_knowledge_source(), help="ナレッジファイルまたはディレクトリ")
+    args = parser.parse_args()
+
+    for config in RAG_CHUNK_CONFIGS:
+        started = time.perf_counter()
+        snapshot_dir = publish_snapshot(args.knowledge, config)
+        print(f"✅ 公開しました: {snapshot_dir} (chunk_size={config.chunk_size}, "
+              f"{time.perf_counter() - started:.2f}秒)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+同一リクエストの相乗り処理（シングルフライト）
+同じ質問が短時間に集中した場合（サポート記事の公開直後など）、処理中の同一リクエスト
+（正規化したクエリ・処理モード・ナレッジのバージョン・期限が一致するもの）には新たに処理を起動せず、
+先行するリクエスト（リーダー）の処理結果をそのまま共有する。
+
+- リーダーの処理は独立したタスクとして実行するため、リーダーのクライアントが切断しても
+  相乗りしているリクエストの処理は継続する（処理の打ち切りは、呼び出し側が処理本体に含める期限で行う）
+- リーダーの処理が失敗した場合は、相乗りしている全リクエストに同じ例外を返す
+- 処理が終わったキーは即座に削除する（結果のキャッシュは行わず、失敗も次のリクエストに持ち越さない）
+"""
+
+import asyncio
+import os
+import re
+import unicodedata
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from metrics import COALESCED
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def is_single_flight_enabled() -> bool:
+    """環境変数から相乗り処理の有効・無効を取得"""
+    return os.getenv("SINGLE_FLIGHT_ENABLED", "true").lower() == "true"
+
+
+def normalize_query(query: str) -> str:
+    """相乗りの判定に使うクエリの正規化（全角・半角の統一、空白の統一、英字の小文字化）"""
+    return _WHITESPACE_RE.sub(" ", unicodedata.normalize("NFKC", query)).strip().lower()
+
+
+class SingleFlightAborted(RuntimeError):
+    """相乗りしていたリーダーの処理がキャンセルされた場合の例外"""
+
+
+class SingleFlight:
+    """キーごとに処理中のタスクを1つだけ持ち、同じキーの呼び出しをそのタスクに相乗りさせる"""
+
+    def __init__(self):
+        self._in_flight: Dict[Hashable, asyncio.Task] = {}
+        self.leaders = 0
+        self.coalesced = 0
+        self.failed_flights = 0
+        self.coalesced_failures = 0
+        # 1回の処理に相乗りしたリクエスト数の最大値
+        self.max_followers = 0
+        self._followers: Dict[Hashable, int] = {}
+
+    def _finish(self, key: Hashable, task: asyncio.Task):
+        # 後から同じキーで起動された別のタスクを消さないよう、自分のタスクの場合だけ削除する
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        self.max_followers = max(self.max_followers, self._followers.pop(key, 0))
+        if not task.cancelled() and task.exception() is not None:
+            self.failed_flights += 1
+
+    def is_in_flight(self, key: Hashable) -> bool:
+        """同じキーの処理が実行中か（Trueの場合、次のdoは相乗りになる）"""
+        return key in self._in_flight
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]], mode: str = "none") -> Any:
+        """
+        キーに対する処理を実行する（同じキーの処理が実行中であればその結果を待つ）
+
+        Args:
+            key: 相乗りの判定に使うキー
+            func: 処理本体（引数なしのコルーチン関数）
+            mode: メトリクスのラベルに使う処理モード
+
+        Returns:
+            処理結果（相乗りした場合はリーダーと同じオブジェクトのため、変更しないこと）
+
+        Raises:
+            処理本体が送出した例外（相乗りしたリクエストにも同じ例外を送出する）
+        """
+        task = self._in_flight.get(key)
+        shared = task is not None
+        if shared:
+            self.coalesced += 1
+            self._followers[key] += 1
+            COALESCED.labels(mode=mode).inc()
+        else:
+            # タスクは現在のコンテキスト（段階計測用のContextVarなど）を引き継いで実行される
+            task = asyncio.create_task(func())
+            self._in_flight[key] = task
+            self._followers[key] = 0
+            self.leaders += 1
+            task.add_done_callback(lambda done, key=key: self._finish(key, done))
+
+        # 呼び出し元がキャンセルされてもタスク自体は止めない（他のリクエストが結果を待っているため）
+        await asyncio.wait({task})
+        if task.cancelled():
+            raise SingleFlightAborted("相乗りしていた処理が中断されました")
+        if shared and task.exception() is not None:
+            self.coalesced_failures += 1
+        return task.result()
+
+    def get_stats(self) -> Dict[str, Any]:
+        total = self.leaders + self.coalesced
+        return {
+            "enabled": is_single_flight_enabled(),
+            "in_flight": len(self._in_flight),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "coalesced_rate": round(self.coalesced / total, 3) if total else 0.0,
+            "max_followers": self.max_followers,
+            "failed_flights": self.failed_flights,
+            "coalesced_failures": self.coalesced_failures
+        }
+
+
+_single_flight: Optional[SingleFlight] = None
+
+
+def get_single_flight() -> SingleFlight:
+    """共有の相乗り処理を取得"""
+    global _single_flight
+    if _single_flight is None:
+        _single_flight = SingleFlight()
+    return _single_flight
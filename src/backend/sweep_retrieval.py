@@ -0,0 +1,245 @@
+"""
+検索パラメータのスイープ (sweep_retrieval.py)
+目的: ラベル付きの評価データ（質問 -> 関連セクション）を使い、チャンクサイズ・オーバーラップ・検索数k・
+再ランキング設定（候補数・最終チャンク数）の組み合わせをオフラインで総当たりし、
+設定値を根拠に基づいて選べるようにする。LLMは使用しない（埋め込みモデルとCrossEncoderのみ）。
+
+評価指標:
+    - recall: 質問ごとの関連セクションのうち、取得したチャンクでカバーできた割合の平均（recall@k）
+    - mrr: 関連セクションのチャンクが最初に現れた順位の逆数の平均
+    - context_tokens: 取得したチャンクを連結したコンテキストのトークン数の平均
+    - retrieve_ms / rerank_ms: 検索・再ランキングのレイテンシ（クエリ埋め込みは設定に依存しないため別に計測）
+
+使用例:
+    python sweep_retrieval.py
+    python sweep_retrieval.py --chunk-sizes 400 800 1200 --overlaps 0 150 --k 3 5 8 --rerank --output sweep.json
+"""
+
+import argparse
+import json
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+from chunker import ChunkConfig, DEFAULT_CHUNK_CONFIG, FANCALL_CHUNK_CONFIG
+from token_utils import count_tokens
+from vector_index import RetrievalIndex, get_embeddings, get_index_config, get_retrieval_index
+
+DATA_DIR = Path(__file__).parent.parent.parent / "data"
+DEFAULT_EVAL_PATH = DATA_DIR / "retrieval_eval.json"
+
+
+def load_eval_set(eval_path: Path) -> Tuple[Path, List[Dict[str, Any]]]:
+    """
+    評価データを読み込む
+
+    Returns:
+        (ナレッジファイルのパス, [{"question": ..., "relevant_sections": [...]}, ...])
+    """
+    with open(eval_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    knowledge_path = Path(eval_path).parent / data.get("knowledge", "knowledge.txt")
+    return knowledge_path, data["questions"]
+
+
+def rank_metrics(ranked_sections: Sequence[str], relevant: Set[str]) -> Tuple[float, float]:
+    """取得順のセクション名から (recall, 逆順位) を計算"""
+    if not relevant:
+        return 0.0, 0.0
+    recall = len(relevant & set(ranked_sections)) / len(relevant)
+    reciprocal_rank = next((1 / rank for rank, section in enumerate(ranked_sections, 1) if section in relevant), 0.0)
+    return recall, reciprocal_rank
+
+
+def _latency_stats(seconds: List[float], prefix: str) -> Dict[str, float]:
+    array = np.asarray(seconds) * 1000
+    return {
+        f"{prefix}_p50": round(float(np.percentile(array, 50)), 3),
+        f"{prefix}_p95": round(float(np.percentile(array, 95)), 3)
+    }
+
+
+def _evaluate(retrieval_index: RetrievalIndex,
+              questions: List[Dict[str, Any]],
+              query_vectors: List[List[float]],
+              search_k: int,
+              rerank: Optional[Callable[[str, List[int]], List[int]]] = None) -> Dict[str, Any]:
+    """全質問で検索（と再ランキング）を実行し、指標を集計する"""
+    store = retrieval_index.store
+    recalls, reciprocal_ranks, context_tokens = [], [], []
+    retrieve_seconds, rerank_seconds = [], []
+
+    for item, vector in zip(questions, query_vectors):
+        started = time.perf_counter()
+        chunk_ids = [chunk_id for chunk_id, _ in retrieval_index.search_by_vector(vector, search_k)]
+        retrieve_seconds.append(time.perf_counter() - started)
+
+        if rerank is not None:
+            started = time.perf_counter()
+            chunk_ids = rerank(item["question"], chunk_ids)
+            rerank_seconds.append(time.perf_counter() - started)
+
+        recall, reciprocal_rank = rank_metrics([store.section(chunk_id) for chunk_id in chunk_ids],
+                                               set(item["relevant_sections"]))
+        recalls.append(recall)
+        reciprocal_ranks.append(reciprocal_rank)
+        context_tokens.append(count_tokens("\n\n".join(store.texts(chunk_ids))))
+
+    result = {
+        "recall": round(float(np.mean(recalls)), 4),
+        "mrr": round(float(np.mean(reciprocal_ranks)), 4),
+        "context_tokens": round(float(np.mean(context_tokens)), 1),
+        **_latency_stats(retrieve_seconds, "retrieve_ms")
+    }
+    if rerank_seconds:
+        result.update(_latency_stats(rerank_seconds, "rerank_ms"))
+    return result
+
+
+def run_sweep(knowledge_path: Path,
+              questions: List[Dict[str, Any]],
+              chunk_sizes: List[int],
+              overlaps: List[int],
+              k_values: List[int],
+              rerank_grid: Optional[List[Tuple[int, int]]] = None) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    パラメータの全組み合わせを評価する
+
+    Args:
+        rerank_grid: (再ランキング候補数, 最終チャンク数) のリスト（Noneの場合は再ランキングを評価しない）
+
+    Returns:
+        (設定ごとの結果リスト, クエリ埋め込みのレイテンシ)
+    """
+    # クエリ埋め込みはチャンク設定に依存しないため、1回だけ計算して全設定で共有する
+    embeddings = get_embeddings()
+    embed_seconds = []
+    query_vectors = []
+    for item in questions:
+        started = time.perf_counter()
+        query_vectors.append(embeddings.embed_query(item["question"]))
+        embed_seconds.append(time.perf_counter() - started)
+
+    rerank_chunk_ids = None
+    if rerank_grid:
+        from run_rag_advanced import rerank_chunk_ids
+
+    index_config = get_index_config()
+    results = []
+    for chunk_size in chunk_sizes:
+        for overlap in overlaps:
+            if overlap >= chunk_size:
+                continue
+            chunk_config = ChunkConfig(chunk_size=chunk_size, chunk_overlap=overlap)
+            started = time.perf_counter()
+            retrieval_index = get_retrieval_index(knowledge_path, chunk_config, index_config)
+            build_seconds = time.perf_counter() - started
+            base = {
+                "chunk_size": chunk_size,
+                "chunk_overlap": overlap,
+                "chunks": len(retrieval_index.store),
+                "build_seconds": round(build_seconds, 3)
+            }
+
+            for k in k_values:
+                result = {**base, "k": k, "rerank": None, **_evaluate(retrieval_index, questions, query_vectors, k)}
+                results.append(result)
+                _print_result(result)
+
+            for max_candidates, top_k in rerank_grid or []:
+
+                def rerank(question: str, chunk_ids: List[int]) -> List[int]:
+                    return rerank_chunk_ids(question, chunk_ids, retrieval_index.store, top_k, max_candidates)
+
+                result = {
+                    **base, "k": top_k,
+                    "rerank": {
+                        "max_candidates": max_candidates,
+                        "top_k": top_k
+                    },
+                    **_evaluate(retrieval_index, questions, query_vectors, max_candidates, rerank)
+                }
+                results.append(result)
+                _print_result(result)
+
+    return results, _latency_stats(embed_seconds, "embed_ms")
+
+
+def _describe(result: Dict[str, Any]) -> str:
+    label = f"size={result['chunk_size']:<5} overlap={result['chunk_overlap']:<4} k={result['k']:<3}"
+    if result["rerank"]:
+        label += f" rerank={result['rerank']['max_candidates']}->{result['rerank']['top_k']}"
+    return label
+
+
+def _print_result(result: Dict[str, Any]):
+    line = (f"   {_describe(result):<52} recall={result['recall']:.3f} mrr={result['mrr']:.3f} "
+            f"tokens={result['context_tokens']:7.1f} retrieve_p50={result['retrieve_ms_p50']:.3f}ms")
+    if "rerank_ms_p50" in result:
+        line += f" rerank_p50={result['rerank_ms_p50']:.1f}ms"
+    print(line)
+
+
+def rank_results(results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """recallの高い順、同率ならMRRの高い順、さらにコンテキストトークン数の少ない順に並べる"""
+    return sorted(results, key=lambda r: (-r["recall"], -r["mrr"], r["context_tokens"]))
+
+
+def main():
+    """直接実行用"""
+    parser = argparse.ArgumentParser(description="検索パラメータのスイープ（recall / MRR / トークン数 / レイテンシ）")
+    parser.add_argument("--eval", type=Path, default=DEFAULT_EVAL_PATH, help="評価データのJSON")
+    parser.add_argument("--chunk-sizes",
+                        type=int,
+                        nargs="*",
+                        default=sorted({FANCALL_CHUNK_CONFIG.chunk_size, DEFAULT_CHUNK_CONFIG.chunk_size, 1200}))
+    parser.add_argument("--overlaps",
+                        type=int,
+                        nargs="*",
+                        default=sorted({0, FANCALL_CHUNK_CONFIG.chunk_overlap, DEFAULT_CHUNK_CONFIG.chunk_overlap}))
+    parser.add_argument("--k", type=int, nargs="*", default=[3, 5, 8, 12], help="評価する検索数")
+    parser.add_argument("--rerank", action="store_true", help="CrossEncoderによる再ランキングも評価する")
+    parser.add_argument("--rerank-candidates", type=int, nargs="*", default=[12, 20], help="再ランキングする候補数")
+    parser.add_argument("--rerank-top-k", type=int, nargs="*", default=[3, 4, 6], help="再ランキング後に使用するチャンク数")
+    parser.add_argument("--top", type=int, default=10, help="ランキングに表示する設定数")
+    parser.add_argument("--output", type=Path, help="結果をJSONで保存するパス")
+    args = parser.parse_args()
+
+    knowledge_path, questions = load_eval_set(args.eval)
+    rerank_grid = None
+    if args.rerank:
+        rerank_grid = [(candidates, top_k) for candidates in args.rerank_candidates for top_k in args.rerank_top_k
+                       if top_k <= candidates]
+
+    print("=== 検索パラメータのスイープ ===")
+    print(f"ナレッジ: {knowledge_path}, 質問数: {len(questions)}, インデックス: {get_index_config().index_type}")
+    print("-" * 50)
+
+    results, embed_latency = run_sweep(knowledge_path, questions, args.chunk_sizes, args.overlaps, args.k, rerank_grid)
+    ranked = rank_results(results)
+
+    print(f"\n=== 上位{min(args.top, len(ranked))}設定（recall → MRR → トークン数の順） ===")
+    print(f"クエリ埋め込み: p50 {embed_latency['embed_ms_p50']}ms, p95 {embed_latency['embed_ms_p95']}ms")
+    for rank, result in enumerate(ranked[:args.top], 1):
+        print(f"{rank:>3}.", end="")
+        _print_result(result)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "eval": str(args.eval),
+                    "questions": len(questions),
+                    "index_type": get_index_config().index_type,
+                    "embed_latency": embed_latency,
+                    "results": ranked
+                },
+                f,
+                ensure_ascii=False,
+                indent=4)
+        print(f"\n結果を保存しました: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
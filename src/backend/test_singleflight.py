@@ -0,0 +1,166 @@
+"""
+singleflight.SingleFlight の相乗り処理と、main.process_query と同じ形で期限を適用した場合のテスト
+
+実行方法（src/backend で実行）:
+    python -m pytest -q test_singleflight.py
+"""
+
+import asyncio
+
+import pytest
+from deadline import Deadline, DeadlineExceeded
+from singleflight import SingleFlight, SingleFlightAborted
+
+
+async def _start(single_flight: SingleFlight, key, func, count: int):
+    """同じキーで count 件の呼び出しを開始し、全員が処理（リーダーのタスク）を待ち始めるまで進める"""
+    callers = [asyncio.create_task(single_flight.do(key, func)) for _ in range(count)]
+    await asyncio.sleep(0)
+    return callers
+
+
+def test_leader_result_is_shared_with_followers():
+
+    async def scenario():
+        single_flight = SingleFlight()
+        release = asyncio.Event()
+        calls = []
+
+        async def work():
+            calls.append(1)
+            await release.wait()
+            return {"response": "ok"}
+
+        callers = await _start(single_flight, "key", work, 3)
+        assert single_flight.is_in_flight("key")
+        release.set()
+        results = await asyncio.gather(*callers)
+
+        assert len(calls) == 1
+        assert all(result is results[0] for result in results)
+        assert not single_flight.is_in_flight("key")
+        stats = single_flight.get_stats()
+        assert (stats["leaders"], stats["coalesced"], stats["max_followers"]) == (1, 2, 2)
+
+    asyncio.run(scenario())
+
+
+def test_leader_exception_is_propagated_to_followers():
+
+    async def scenario():
+        single_flight = SingleFlight()
+        release = asyncio.Event()
+
+        async def work():
+            await release.wait()
+            raise ValueError("失敗")
+
+        callers = await _start(single_flight, "key", work, 3)
+        release.set()
+        results = await asyncio.gather(*callers, return_exceptions=True)
+
+        assert all(isinstance(result, ValueError) for result in results)
+        assert not single_flight.is_in_flight("key")
+        stats = single_flight.get_stats()
+        assert (stats["failed_flights"], stats["coalesced_failures"]) == (1, 2)
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_leader_raises_single_flight_aborted():
+
+    async def scenario():
+        single_flight = SingleFlight()
+
+        async def work():
+            await asyncio.sleep(10)
+
+        callers = await _start(single_flight, "key", work, 2)
+        single_flight._in_flight["key"].cancel()
+        results = await asyncio.gather(*callers, return_exceptions=True)
+
+        assert all(isinstance(result, SingleFlightAborted) for result in results)
+        assert not single_flight.is_in_flight("key")
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_caller_does_not_cancel_shared_work():
+
+    async def scenario():
+        single_flight = SingleFlight()
+        release = asyncio.Event()
+
+        async def work():
+            await release.wait()
+            return "ok"
+
+        leader, follower = await _start(single_flight, "key", work, 2)
+        leader.cancel()
+        await asyncio.sleep(0)
+        release.set()
+
+        assert await follower == "ok"
+        assert leader.cancelled()
+
+    asyncio.run(scenario())
+
+
+def test_finish_does_not_evict_newer_task_for_same_key():
+
+    async def scenario():
+        single_flight = SingleFlight()
+        releases = [asyncio.Event(), asyncio.Event()]
+
+        async def work(index):
+            await releases[index].wait()
+            return index
+
+        (first_caller,) = await _start(single_flight, "key", lambda: work(0), 1)
+        first_task = single_flight._in_flight["key"]
+        releases[0].set()
+        assert await first_caller == 0
+
+        (second_caller,) = await _start(single_flight, "key", lambda: work(1), 1)
+        second_task = single_flight._in_flight["key"]
+        assert second_task is not first_task
+
+        # 前の処理の完了通知が後から届いても、同じキーの新しい処理は削除しない
+        single_flight._finish("key", first_task)
+        assert single_flight._in_flight.get("key") is second_task
+
+        releases[1].set()
+        assert await second_caller == 1
+        assert not single_flight.is_in_flight("key")
+
+    asyncio.run(scenario())
+
+
+def test_deadline_inside_shared_task_cancels_work_for_all_callers():
+    """main.process_query と同じく、リーダーの期限を共有する処理の内側で適用した場合"""
+
+    async def scenario():
+        single_flight = SingleFlight()
+        deadline = Deadline(0.05, min_remaining={})
+        state = {"cancelled": False}
+
+        async def work():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                state["cancelled"] = True
+                raise
+
+        callers = await _start(single_flight, "key", lambda: deadline.run(work()), 2)
+        results = await asyncio.gather(*callers, return_exceptions=True)
+
+        assert all(isinstance(result, DeadlineExceeded) for result in results)
+        # 期限を過ぎた処理は打ち切られる（処理枠を保持したまま走り続けない）
+        assert state["cancelled"]
+        assert not single_flight.is_in_flight("key")
+
+    asyncio.run(scenario())
+
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main(["-q", __file__]))
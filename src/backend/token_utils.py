@@ -0,0 +1,23 @@
+"""
+トークン数計算用のユーティリティモジュール
+"""
+
+from functools import lru_cache
+
+import tiktoken
+
+
+@lru_cache(maxsize=None)
+def _get_encoding(model: str):
+    """モデルに対応するエンコーディングを取得（プロセス内でキャッシュ）"""
+    return tiktoken.encoding_for_model(model)
+
+
+def count_tokens(text: str, model: str = "gpt-3.5-turbo") -> int:
+    """テキストのトークン数をカウント"""
+    try:
+        encoding = _get_encoding(model)
+        return len(encoding.encode(text))
+    except Exception:
+        # フォールバック: 文字数の1/4を概算トークン数とする
+        return len(text) // 4
@@ -0,0 +1,157 @@
+"""
+決定的なツールの結果キャッシュ
+同じナレッジバージョン・同じ引数であれば同じ結果を返すツールについて、
+(ツール名, 正規化した引数, ナレッジバージョン) をキーに結果をTTL・件数上限付きで保持する。
+ツールは正規化した引数で実行するため、キーが同じ呼び出しはキャッシュの有無によらず同じ結果になる。
+キャッシュのヒット・ミスはリクエスト単位のトレースに記録し、intermediate_stepsに表示できる。
+"""
+
+import functools
+import inspect
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from metrics import record_cache
+
+# (ツール名, 正規化した引数, ナレッジバージョン)
+CacheKey = Tuple[str, str, str]
+
+# 現在のリクエスト（またはツール呼び出し）で発生したキャッシュ参照の記録
+_cache_trace: ContextVar[Optional[List[Dict[str, Any]]]] = ContextVar("tool_cache_trace", default=None)
+
+
+class ToolResultCache:
+    """TTLと件数上限付きのツール結果キャッシュ（LRUで追い出し）"""
+
+    def __init__(self, maxsize: int = 256, ttl_seconds: float = 300.0):
+        self.maxsize = maxsize
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[CacheKey, Tuple[float, float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: CacheKey) -> Tuple[bool, Any, float]:
+        """(ヒットしたか, 結果, キャッシュ経過秒数) を返す"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored_at, expires_at, value = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, value, now - stored_at
+                del self._entries[key]
+            self.misses += 1
+            return False, None, 0.0
+
+    def put(self, key: CacheKey, value: Any, ttl_seconds: Optional[float] = None):
+        now = time.monotonic()
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        with self._lock:
+            self._entries[key] = (now, now + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0
+            }
+
+
+_tool_result_cache = ToolResultCache(maxsize=int(os.getenv("TOOL_CACHE_MAXSIZE", 256)),
+                                     ttl_seconds=float(os.getenv("TOOL_CACHE_TTL_SECONDS", 300)))
+
+
+def get_tool_result_cache() -> ToolResultCache:
+    """共有のツール結果キャッシュを取得"""
+    return _tool_result_cache
+
+
+def _normalize_value(value: Any) -> Any:
+    """文字列は全角半角（NFKC）と空白を正規化する"""
+    if isinstance(value, str):
+        return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", value)).strip()
+    return value
+
+
+def normalize_arguments(func: Callable, args: tuple, kwargs: dict) -> inspect.BoundArguments:
+    """関数の引数を名前付きに揃えて正規化する（キャッシュキーとツールの実行の両方に使う）"""
+    bound = inspect.signature(func).bind(*args, **kwargs)
+    bound.apply_defaults()
+    for name, value in bound.arguments.items():
+        bound.arguments[name] = _normalize_value(value)
+    return bound
+
+
+def start_tool_cache_trace() -> List[Dict[str, Any]]:
+    """
+    現在のコンテキストでキャッシュ参照の記録を開始し、記録先のリストを返す
+
+    asyncio.to_threadやタスクはコンテキストをコピーして実行されるため、
+    その中で呼ばれたツールの参照もこのリストに記録される。
+    """
+    trace: List[Dict[str, Any]] = []
+    _cache_trace.set(trace)
+    return trace
+
+
+def cached_tool(version_fn: Optional[Callable[[], str]] = None,
+                ttl_seconds: Optional[float] = None) -> Callable[[Callable], Callable]:
+    """
+    ツール関数の結果をキャッシュするデコレータ（@toolの内側に付ける）
+
+    Args:
+        version_fn: 現在のナレッジバージョンを返す関数（ナレッジに依存しないツールは省略）
+        ttl_seconds: このツールの有効期間（省略時はTOOL_CACHE_TTL_SECONDS）
+    """
+
+    def decorator(func: Callable) -> Callable:
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            cache = get_tool_result_cache()
+            # 同じキーの呼び出しが同じ結果になるよう、ツール自体も正規化した引数で実行する
+            bound = normalize_arguments(func, args, kwargs)
+            normalized_args = json.dumps(bound.arguments, ensure_ascii=False, sort_keys=True, default=str)
+            key = (func.__name__, normalized_args, version_fn() if version_fn else "")
+
+            hit, value, age = cache.get(key)
+            record_cache("tool_result", hit)
+            if not hit:
+                value = func(*bound.args, **bound.kwargs)
+                cache.put(key, value, ttl_seconds)
+
+            trace = _cache_trace.get()
+            if trace is not None:
+                trace.append({
+                    "tool": func.__name__,
+                    "args": json.loads(normalized_args),
+                    "cache_hit": hit,
+                    "age_seconds": round(age, 1)
+                })
+            return value
+
+        return wrapper
+
+    return decorator
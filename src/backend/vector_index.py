@@ -0,0 +1,365 @@
+"""
+ベクトル検索インデックス
+チャンクストアのチャンクIDをそのままFAISSの行番号として使い、検索結果をチャンクIDで返す
+インデックス種別（Flat / HNSW / IVF-Flat / IVF-PQ）とパラメータは環境変数で切り替えられる
+"""
+
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import faiss
+import numpy as np
+from chunk_store import ChunkStore, get_chunk_store
+from chunker import ChunkConfig
+from inference_backend import get_embedding_model_args
+from knowledge_base import get_knowledge_version
+from langchain_community.embeddings import HuggingFaceEmbeddings
+from metrics import observe_stage
+from query_embedder import get_query_embedder
+
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+
+INDEX_TYPES = ("flat", "hnsw", "ivf_flat", "ivf_pq")
+
+# FAISSがクラスタ中心1つあたりに推奨する最小学習ベクトル数
+_MIN_POINTS_PER_CENTROID = 39
+
+
+class IndexConfig(NamedTuple):
+    """FAISSインデックス設定"""
+    index_type: str = "flat"
+    # IVF系: クラスタ数と検索時に調べるクラスタ数
+    nlist: int = 1024
+    nprobe: int = 16
+    # IVF-PQ: サブベクトル数（次元数を割り切れる値）とコードのビット数
+    pq_m: int = 48
+    pq_nbits: int = 8
+    # HNSW: グラフの接続数と構築時・検索時の探索幅
+    hnsw_m: int = 32
+    ef_construction: int = 200
+    ef_search: int = 64
+
+
+def get_index_config() -> IndexConfig:
+    """環境変数からFAISSインデックス設定を取得"""
+    index_type = os.getenv("FAISS_INDEX_TYPE", "flat").lower()
+    if index_type not in INDEX_TYPES:
+        print(f"警告: 未知のFAISS_INDEX_TYPE '{index_type}' のためflatを使用します（指定可能: {', '.join(INDEX_TYPES)}）")
+        index_type = "flat"
+
+    defaults = IndexConfig()
+    return IndexConfig(index_type=index_type,
+                       nlist=int(os.getenv("FAISS_NLIST", defaults.nlist)),
+                       nprobe=int(os.getenv("FAISS_NPROBE", defaults.nprobe)),
+                       pq_m=int(os.getenv("FAISS_PQ_M", defaults.pq_m)),
+                       pq_nbits=int(os.getenv("FAISS_PQ_NBITS", defaults.pq_nbits)),
+                       hnsw_m=int(os.getenv("FAISS_HNSW_M", defaults.hnsw_m)),
+                       ef_construction=int(os.getenv("FAISS_EF_CONSTRUCTION", defaults.ef_construction)),
+                       ef_search=int(os.getenv("FAISS_EF_SEARCH", defaults.ef_search)))
+
+
+def resolve_index_config(config: IndexConfig, dimension: int, num_vectors: int) -> IndexConfig:
+    """
+    ベクトル数・次元数に対して学習できない設定を、構築可能な設定に補正する
+
+    IVF系はクラスタ数に対して学習データが少ないと品質が大きく落ちるため、クラスタ数を減らすか
+    フラットインデックスに切り替える。
+    """
+    if config.index_type not in ("ivf_flat", "ivf_pq"):
+        return config
+
+    nlist = min(config.nlist, num_vectors // _MIN_POINTS_PER_CENTROID)
+    if nlist < 2:
+        print(f"ℹ️ ベクトル数({num_vectors})が少ないため、{config.index_type}の代わりにflatインデックスを使用します")
+        return config._replace(index_type="flat")
+    config = config._replace(nlist=nlist)
+
+    if config.index_type == "ivf_pq":
+        if dimension % config.pq_m != 0:
+            print(f"ℹ️ pq_m={config.pq_m}が次元数{dimension}を割り切れないため、ivf_flatを使用します")
+            return config._replace(index_type="ivf_flat")
+        if num_vectors < (1 << config.pq_nbits) * _MIN_POINTS_PER_CENTROID:
+            print(f"ℹ️ ベクトル数({num_vectors})がPQの学習に不足しているため、ivf_flatを使用します")
+            return config._replace(index_type="ivf_flat")
+    return config
+
+
+def create_faiss_index(dimension: int, config: IndexConfig) -> faiss.Index:
+    """設定に応じた未学習のFAISSインデックス（L2距離）を作成"""
+    if config.index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dimension, config.hnsw_m)
+        index.hnsw.efConstruction = config.ef_construction
+    elif config.index_type == "ivf_flat":
+        index = faiss.index_factory(dimension, f"IVF{config.nlist},Flat")
+    elif config.index_type == "ivf_pq":
+        index = faiss.index_factory(dimension, f"IVF{config.nlist},PQ{config.pq_m}x{config.pq_nbits}")
+    else:
+        index = faiss.IndexFlatL2(dimension)
+    apply_search_params(index, config)
+    return index
+
+
+def apply_search_params(index: faiss.Index, config: IndexConfig):
+    """検索時パラメータ（nprobe / efSearch）をインデックスに設定"""
+    parameter_space = faiss.ParameterSpace()
+    if config.index_type in ("ivf_flat", "ivf_pq"):
+        parameter_space.set_index_parameter(index, "nprobe", config.nprobe)
+    elif config.index_type == "hnsw":
+        parameter_space.set_index_parameter(index, "efSearch", config.ef_search)
+
+
+def build_faiss_index(vectors: np.ndarray, config: IndexConfig) -> Tuple[faiss.Index, IndexConfig]:
+    """
+    ベクトル群からFAISSインデックスを構築する（IVF系は学習も行う）
+
+    Returns:
+        (構築したインデックス, 実際に使用した設定)
+    """
+    num_vectors, dimension = vectors.shape
+    config = resolve_index_config(config, dimension, num_vectors)
+    index = create_faiss_index(dimension, config)
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+    return index, config
+
+
+class IncrementalIndexBuilder:
+    """
+    ベクトルをバッチ単位で追加しながらインデックスを構築するビルダー
+
+    IVF系は学習に必要な件数が集まるまでベクトルをバッファし、学習後は逐次追加する。
+    保持するベクトルは学習用サンプル分に限られる（フラット/HNSWはバッファしない）。
+    """
+
+    def __init__(self, config: IndexConfig):
+        self.config = config
+        self.index = None
+        self._pending: List[np.ndarray] = []
+        self._pending_count = 0
+        if config.index_type in ("ivf_flat", "ivf_pq"):
+            train_target = config.nlist * _MIN_POINTS_PER_CENTROID
+            if config.index_type == "ivf_pq":
+                train_target = max(train_target, (1 << config.pq_nbits) * _MIN_POINTS_PER_CENTROID)
+            self._train_target = train_target
+        else:
+            self._train_target = 0
+
+    def add(self, vectors: np.ndarray):
+        """ベクトルのバッチを追加"""
+        if len(vectors) == 0:
+            return
+        if self.index is not None:
+            self.index.add(vectors)
+            return
+        self._pending.append(vectors)
+        self._pending_count += len(vectors)
+        if self._pending_count >= self._train_target:
+            self._create_from_pending()
+
+    def _create_from_pending(self):
+        vectors = np.concatenate(self._pending)
+        self._pending = []
+        self._pending_count = 0
+        self.index, self.config = build_faiss_index(vectors, self.config)
+
+    def finish(self, dimension: int) -> Tuple[faiss.Index, IndexConfig]:
+        """構築を完了し、(インデックス, 実際に使用した設定) を返す"""
+        if self.index is None:
+            if self._pending:
+                self._create_from_pending()
+            else:
+                self.index, self.config = build_faiss_index(np.zeros((0, dimension), dtype="float32"), self.config)
+        return self.index, self.config
+
+
+# 埋め込みモデルをグローバルに初期化してキャッシュ
+_embeddings = None
+_embeddings_lock = threading.Lock()
+
+
+def get_embeddings() -> HuggingFaceEmbeddings:
+    """埋め込みモデルをシングルトンパターンで取得"""
+    global _embeddings
+    if _embeddings is None:
+        with _embeddings_lock:
+            if _embeddings is None:
+                # INFERENCE_BACKEND=onnx の場合は量子化済みONNXモデルをONNX Runtimeで実行する
+                model_name, model_kwargs = get_embedding_model_args(EMBEDDING_MODEL_NAME)
+                _embeddings = HuggingFaceEmbeddings(model_name=model_name, model_kwargs=model_kwargs)
+    return _embeddings
+
+
+class RetrievalIndex:
+    """チャンクストアとFAISSインデックスの組"""
+
+    def __init__(self,
+                 store: ChunkStore,
+                 index: faiss.Index,
+                 index_config: IndexConfig,
+                 ingest_stats: Optional[Dict] = None):
+        self.store = store
+        self.index = index
+        self.index_config = index_config
+        self.version = store.version
+        # ディレクトリから取り込んだ場合の取り込み統計
+        self.ingest_stats = ingest_stats
+
+    @classmethod
+    def build(cls, store: ChunkStore, index_config: IndexConfig, batch_size: int = 64) -> "RetrievalIndex":
+        """チャンクストアの全チャンクを埋め込み、設定に応じたインデックスを構築"""
+        embeddings = get_embeddings()
+        batches = []
+        for batch_start in range(0, len(store), batch_size):
+            batch_ids = range(batch_start, min(batch_start + batch_size, len(store)))
+            batches.append(np.asarray(embeddings.embed_documents(store.texts(batch_ids)), dtype="float32"))
+
+        if batches:
+            vectors = np.concatenate(batches)
+        else:
+            vectors = np.zeros((0, len(embeddings.embed_query(""))), dtype="float32")
+        index, resolved_config = build_faiss_index(vectors, index_config)
+        return cls(store, index, resolved_config)
+
+    def search_by_vector(self, vector: List[float], k: int) -> List[Tuple[int, float]]:
+        """クエリベクトルで検索し、(チャンクID, 距離) を近い順に返す"""
+        k = min(k, len(self.store))
+        if k <= 0:
+            return []
+        distances, ids = self.index.search(np.asarray([vector], dtype="float32"), k)
+        return [(int(chunk_id), float(distance)) for chunk_id, distance in zip(ids[0], distances[0]) if chunk_id != -1]
+
+    def search(self, query: str, k: int) -> List[int]:
+        """クエリ文字列で検索し、チャンクIDを近い順に返す（同期版）"""
+        with observe_stage("embed"):
+            vector = get_query_embedder().embed_sync(query)
+        with observe_stage("retrieve"):
+            return [chunk_id for chunk_id, _ in self.search_by_vector(vector, k)]
+
+    async def asearch(self, query: str, k: int) -> List[int]:
+        """クエリ文字列で検索し、チャンクIDを近い順に返す（同時実行中の他リクエストとまとめて埋め込む）"""
+        return [chunk_id for chunk_id, _ in await self.asearch_with_distances(query, k)]
+
+    async def asearch_with_distances(self, query: str, k: int) -> List[Tuple[int, float]]:
+        """クエリ文字列で検索し、(チャンクID, 距離) を近い順に返す（asearchの距離付き版）"""
+        with observe_stage("embed"):
+            vector = await get_query_embedder().embed(query)
+        with observe_stage("retrieve"):
+            return self.search_by_vector(vector, k)
+
+
+# (バージョン, チャンク設定, インデックス設定) -> RetrievalIndex
+_index_cache: Dict[Tuple[str, ChunkConfig, IndexConfig], RetrievalIndex] = {}
+_index_cache_lock = threading.Lock()
+
+# ナレッジディレクトリの取り込みはイベントループ・リクエスト処理とは別のスレッドで1件ずつ実行する
+_ingest_executor: Optional[ThreadPoolExecutor] = None
+# (バージョン, チャンク設定, インデックス設定) -> 取り込み（失敗した場合はディレクトリが変わるまで再実行しない）
+_directory_builds: Dict[Tuple[str, ChunkConfig, IndexConfig], Future] = {}
+
+
+def _cache_index(key: Tuple[str, ChunkConfig, IndexConfig], retrieval_index: RetrievalIndex):
+    """構築したインデックスをキャッシュし、同じ設定の古いバージョンを削除する（_index_cache_lockを保持して呼ぶ）"""
+    for old_key in [k for k in _index_cache if k[1:] == key[1:]]:
+        del _index_cache[old_key]
+    _index_cache[key] = retrieval_index
+
+
+def _ingest_in_background(knowledge_dir: Path, config: ChunkConfig, index_config: IndexConfig) -> RetrievalIndex:
+    from ingest import ingest_directory
+    try:
+        retrieval_index = ingest_directory(knowledge_dir, config, index_config)
+    except Exception as e:
+        print(f"⚠️ ナレッジディレクトリの取り込みに失敗しました: {e}")
+        raise
+    with _index_cache_lock:
+        _cache_index((retrieval_index.version, config, index_config), retrieval_index)
+    return retrieval_index
+
+
+def _get_directory_index(knowledge_dir: Path, config: ChunkConfig, index_config: IndexConfig,
+                         wait: bool) -> RetrievalIndex:
+    """
+    ナレッジディレクトリの検索インデックスを取得する
+
+    ディレクトリが変わった場合は取り込みをバックグラウンドで開始し、完了するまでは
+    構築済みの前のバージョンを返す。前のバージョンがない（初回の）場合とwait=Trueの場合は取り込みの完了を待つ。
+    """
+    global _ingest_executor
+    key = (get_knowledge_version(knowledge_dir), config, index_config)
+    retrieval_index = _index_cache.get(key)
+    if retrieval_index is not None:
+        return retrieval_index
+
+    with _index_cache_lock:
+        retrieval_index = _index_cache.get(key)
+        if retrieval_index is not None:
+            return retrieval_index
+        previous = next((index for k, index in _index_cache.items() if k[1:] == key[1:]), None)
+        build = _directory_builds.get(key)
+        if build is None:
+            if _ingest_executor is None:
+                _ingest_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="knowledge-ingest")
+            for old_key in [k for k in _directory_builds if k[1:] == key[1:]]:
+                del _directory_builds[old_key]
+            build = _ingest_executor.submit(_ingest_in_background, knowledge_dir, config, index_config)
+            _directory_builds[key] = build
+            if previous is not None:
+                print(f"🔄 ナレッジディレクトリの変更を検出しました。取り込みが完了するまで前のバージョン"
+                      f"（{previous.version}）で検索します")
+
+    if previous is not None and not wait:
+        return previous
+    return build.result()
+
+
+def get_retrieval_index(knowledge_path: Path,
+                        config: ChunkConfig,
+                        index_config: Optional[IndexConfig] = None,
+                        use_shared: bool = True,
+                        wait_for_current: bool = False) -> RetrievalIndex:
+    """
+    ナレッジの検索インデックスを取得する
+
+    ナレッジの内容・チャンク設定・インデックス設定のいずれかが変わった場合のみ、
+    埋め込みとインデックス構築をやり直す。ディレクトリを指定した場合は、
+    配下の全ファイルを並列取り込みパイプラインでバックグラウンドで取り込む。SHARED_INDEX=trueの場合は、
+    shared_index.pyで公開済みのスナップショットがあればそれを返す。
+
+    初回の構築・取り込みは完了まで待つため、イベントループからは asyncio.to_thread 経由で呼び出すこと。
+
+    Args:
+        knowledge_path: ナレッジファイルまたはナレッジディレクトリのパス
+        config: チャンク分割設定
+        index_config: FAISSインデックス設定（未指定時は環境変数から取得）
+        use_shared: 公開済みの共有スナップショットを使用するか（公開処理自体はFalseで呼ぶ）
+        wait_for_current: ディレクトリの取り込み中も前のバージョンを返さず、現在の内容の取り込みを待つか
+    """
+    if index_config is None:
+        index_config = get_index_config()
+
+    # 複数ワーカー構成では、公開済みの共有スナップショット（読み取り専用のメモリマップ）を使用する
+    if use_shared and os.getenv("SHARED_INDEX", "false").lower() == "true":
+        from shared_index import get_shared_retrieval_index
+        shared_index = get_shared_retrieval_index(knowledge_path, config, index_config)
+        if shared_index is not None:
+            return shared_index
+
+    if Path(knowledge_path).is_dir():
+        return _get_directory_index(Path(knowledge_path), config, index_config, wait_for_current)
+
+    store = get_chunk_store(knowledge_path, config)
+    key = (store.version, config, index_config)
+    retrieval_index = _index_cache.get(key)
+    if retrieval_index is not None:
+        return retrieval_index
+
+    with _index_cache_lock:
+        retrieval_index = _index_cache.get(key)
+        if retrieval_index is None:
+            retrieval_index = RetrievalIndex.build(store, index_config)
+            _cache_index(key, retrieval_index)
+    return retrieval_index
@@ -0,0 +1,108 @@
+"""
+起動時ウォームアップとレディネス状態
+有効な各処理モードについて、モデル・インデックス・LLMクライアントの初期化（各モジュールのwarm_up）と
+合成クエリ1件の実行を行い、すべて完了したらレディネスを有効にする。
+"""
+
+import asyncio
+import os
+import time
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from mode_registry import get_mode_module
+
+# 合成クエリ（全モード共通）
+DEFAULT_WARMUP_QUERY = "エラーコードE-404の対処法は？"
+
+
+def get_warmup_settings() -> Dict[str, Any]:
+    """環境変数からウォームアップ設定を取得"""
+    return {
+        "enabled": os.getenv("WARMUP_ON_STARTUP", "true").lower() == "true",
+        "run_query": os.getenv("WARMUP_RUN_QUERY", "true").lower() == "true",
+        "query": os.getenv("WARMUP_QUERY", DEFAULT_WARMUP_QUERY)
+    }
+
+
+class ReadinessState:
+    """モードごとのウォームアップ状況（pending / warming / ready / failed）"""
+
+    def __init__(self):
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.skipped = False
+        self.modes: Dict[str, Dict[str, Any]] = {}
+
+    def reset(self, modes: List[str]):
+        self.started_at = time.time()
+        self.finished_at = None
+        self.skipped = False
+        self.modes = {mode: {"status": "pending"} for mode in modes}
+
+    @property
+    def ready(self) -> bool:
+        """ウォームアップが終了し、有効な全モードの初期化に成功していればTrue"""
+        if self.skipped:
+            return True
+        return self.finished_at is not None and all(state["status"] == "ready" for state in self.modes.values())
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "warmup": "skipped" if self.skipped else ("finished" if self.finished_at else "running"),
+            "warmup_seconds": round(self.finished_at - self.started_at, 2) if self.finished_at and self.started_at else None,
+            "modes": self.modes
+        }
+
+
+readiness = ReadinessState()
+
+
+async def warm_up_modes(modes: List[str],
+                        knowledge_paths: Dict[str, Path],
+                        run_query: Callable[[str, str], Awaitable[Dict[str, Any]]]):
+    """
+    有効なモードを順にウォームアップする
+
+    モードごとに実装モジュールの読み込みとwarm_up（スレッドで実行）を行い、続けて合成クエリを
+    1件実行する。1つのモードが失敗しても残りのモードのウォームアップは続ける。
+
+    Args:
+        modes: ウォームアップするモード
+        knowledge_paths: モード -> ナレッジのパス
+        run_query: (モード, クエリ) を受け取り、通常のリクエストと同じ経路で処理する関数
+    """
+    settings = get_warmup_settings()
+    if not settings["enabled"]:
+        readiness.skipped = True
+        print("ℹ️ 起動時ウォームアップは無効です（WARMUP_ON_STARTUP=false）")
+        return
+
+    readiness.reset(modes)
+    print(f"🔥 ウォームアップを開始します: {', '.join(modes)}")
+    for mode in modes:
+        state = readiness.modes[mode]
+        state["status"] = "warming"
+        try:
+            started = time.perf_counter()
+            module = await asyncio.to_thread(get_mode_module, mode)
+            state["details"] = await asyncio.to_thread(module.warm_up, knowledge_paths[mode])
+            state["init_seconds"] = round(time.perf_counter() - started, 2)
+
+            if settings["run_query"]:
+                started = time.perf_counter()
+                await run_query(mode, settings["query"])
+                state["query_seconds"] = round(time.perf_counter() - started, 2)
+
+            state["status"] = "ready"
+            print(f"✅ モード '{mode}' のウォームアップ完了")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            state["status"] = "failed"
+            state["error"] = str(e)
+            print(f"❌ モード '{mode}' のウォームアップに失敗しました: {e}")
+
+    readiness.finished_at = time.time()
+    print(f"🔥 ウォームアップ終了（レディネス: {'OK' if readiness.ready else 'NG'}）")
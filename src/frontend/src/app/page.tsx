@@ -26,6 +26,7 @@ interface ProcessResponse {
   total_tokens: number;
   intermediate_steps: IntermediateStep[];
   log_file: string;
+  route?: { mode: string; intent: string; reason: string } | null;
 }
 
 interface LogDetail {
@@ -45,7 +46,8 @@ const MODES: ProcessingMode[] = [
   { value: 'rag_only', label: 'RAGベーシック', description: 'ベクトル検索による情報取得', color: 'bg-green-100 text-green-800 border-green-300' },
   { value: 'rag_advanced', label: 'RAG高度版', description: 'CrossEncoder再ランキング+最適化', color: 'bg-emerald-100 text-emerald-800 border-emerald-300' },
   { value: 'function_calling', label: 'Function Calling', description: 'LLMによる動的ツール利用', color: 'bg-purple-100 text-purple-800 border-purple-300' },
-  { value: 'rag_function_calling', label: 'RAG + Function Calling', description: 'RAGとFunction Callingの組み合わせ（推奨）', color: 'bg-amber-100 text-amber-800 border-amber-300' }
+  { value: 'rag_function_calling', label: 'RAG + Function Calling', description: 'RAGとFunction Callingの組み合わせ（推奨）', color: 'bg-amber-100 text-amber-800 border-amber-300' },
+  { value: 'auto', label: '自動選択', description: '質問の内容から最適なモードを自動で選択', color: 'bg-sky-100 text-sky-800 border-sky-300' }
 ];
 
 export default function Home() {
@@ -134,7 +136,9 @@ export default function Home() {
       setCurrentStep('完了');
       setProgress(100);
       
-      toast.success('処理が完了しました');
+      const route = response.data.route;
+      const routedMode = route ? MODES.find(mode => mode.value === route.mode) : undefined;
+      toast.success(route ? `処理が完了しました（自動選択: ${routedMode?.label ?? route.mode}）` : '処理が完了しました');
       fetchLogFiles();
     } catch (error) {
       toast.error('処理中にエラーが発生しました');